@@ -1,25 +1,40 @@
-import requests
-import os
+"""
+Moves every headset plugged into this machine by USB onto wifi, by asking simu-launch to enroll them and printing how
+each one got on. Same as the "Add USB Headsets" button.
+
+    python activator.py
+    python activator.py --server http://192.168.0.155:8000
+"""
+import argparse
 import time
-import datetime
-while True:
-    time_only = datetime.datetime.now().strftime("%H:%M:%S")
-    ip_address = os.popen("adb shell ip route").read()
-    print(f"{time_only} { ip_address}")
-    if ip_address:
-        ip_address = ip_address.split(" ")[8]
-        print(ip_address)
-
-        os.system("adb tcpip 5555")
-
-        payload = {
-            'remote_address': ip_address
-        }
-        print('restarting in tcpip mode... waiting 3 seconds')
-        time.sleep(3)
-        print('letting storystarter know about Quest...')
-        outcome = os.popen("""adb shell "printf 'GET /connect HTTP/1.1\r\n http://192.168.0.155 \r\n\r\n' | nc 192.168.0.155 8000""").read()
-        print(outcome,222)
-
-        print("Finished")
-    time.sleep(5)
\ No newline at end of file
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://127.0.0.1:8000", help="the simu-launch server")
+    args = parser.parse_args()
+
+    outcome = requests.post(args.server + "/enroll-usb").json()
+    if not outcome["success"]:
+        print(outcome["error"])
+        return
+    print(f"Moving {outcome['device_count']} headsets onto wifi...")
+
+    seen = {}
+    while True:
+        job = requests.get(f"{args.server}/jobs/{outcome['job_id']}").json()
+        for device in job["devices"]:
+            line = f"{device['serial']}: {device['status']} {device['message']}"
+            if seen.get(device["serial"]) != line:
+                print(line)
+                seen[device["serial"]] = line
+        if job["finished"]:
+            print("Finished" if job["status"] == "done" else job["message"])
+            return
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
+import asyncio
 import subprocess
 from collections import namedtuple
 
+from tracing import span
+
 
 class NoEndPointException(BaseException):
     pass
 
 
 def adb_command(arr):
-    outcome = subprocess.run(arr, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=3)
+    with span(" ".join(arr[1:3]), "subprocess"):
+        outcome = subprocess.run(arr, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=3)
     message = outcome.stdout.decode('ascii')
     err = outcome.stderr.decode('ascii')
     if err:
@@ -21,9 +25,10 @@ def adb_command_no_wait(arr):
     subprocess.Popen(arr)
 
 
-def adb_image(device):
+def adb_image(device, timeout=10):
     cmd = f'adb -s {device} shell screencap -p'.split(' ')
-    outcome = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    with span("screencap", "subprocess", serial=device):
+        outcome = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
     message = outcome.stdout
     err = outcome.stderr.decode('ascii')
     if err:
@@ -32,6 +37,41 @@ def adb_image(device):
     return message
 
 
+async def adb_image_async(device, timeout=10):
+    """Same as adb_image but does not block the event loop. Returns None if the screencap took longer than timeout"""
+    cmd = f'adb -s {device} shell screencap -p'.split(' ')
+    with span("screencap", "subprocess", serial=device):
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            message, err = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return None
+    if err and 'Network is unreachable' in err.decode('ascii', errors='replace'):
+        raise NoEndPointException
+    return message
+
+
+async def adb_command_async(args, timeout=10):
+    """
+        Runs an adb command without blocking the event loop.
+
+    :param args: the arguments after `adb`, ie: ['-s', serial, 'tcpip', '5555']
+    :return: stdout and stderr, decoded
+    :raises asyncio.TimeoutError: if it took longer than timeout, the process is killed
+    """
+    with span(" ".join(args[2:4] if args[0] == "-s" else args[:2]), "subprocess"):
+        process = await asyncio.create_subprocess_exec("adb", *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            out, err = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+    return out.decode("utf-8", errors="replace"), err.decode("utf-8", errors="replace")
+
+
 def scan_devices():
     outcome = adb_command(["adb", "devices"])
     alive = [serial.split('\t')[0] for serial in outcome.splitlines()[1:] if 'offline' not in serial and serial]
@@ -0,0 +1,40 @@
+"""fleet profiles
+
+Revision ID: 5d2e8a7c41f3
+Revises: 9b1f4c2d7e10
+Create Date: 2026-10-19 14:03:27.530916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a7c41f3'
+down_revision = '9b1f4c2d7e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the server makes missing tables itself at startup, it may be there already
+    if 'fleet_profiles' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'fleet_profiles',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('devices', sa.String(), nullable=True),
+            sa.Column('apk_name', sa.String(), nullable=True),
+            sa.Column('volume', sa.Integer(), nullable=True),
+            sa.Column('screen_off_timeout', sa.Integer(), nullable=True),
+            sa.Column('home_app', sa.Boolean(), nullable=True),
+            sa.Column('active', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(op.f('ix_fleet_profiles_id'), 'fleet_profiles', ['id'], unique=False)
+        op.create_index(op.f('ix_fleet_profiles_active'), 'fleet_profiles', ['active'], unique=False)
+
+
+def downgrade():
+    op.drop_table('fleet_profiles')
@@ -0,0 +1,46 @@
+"""apk manifest details
+
+Revision ID: 7e4c19a2b8d5
+Revises: 5d2e8a7c41f3
+Create Date: 2026-10-19 16:41:09.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4c19a2b8d5'
+down_revision = '5d2e8a7c41f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases started by a version that added these columns itself at startup already have some of them
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns('items')}
+    indexes = {index["name"] for index in inspector.get_indexes('items')}
+    for column in (
+        sa.Column('package_name', sa.String(), nullable=True),
+        sa.Column('version_code', sa.Integer(), nullable=True),
+        sa.Column('launch_activity', sa.String(), nullable=True),
+        sa.Column('is_vr', sa.Boolean(), nullable=True),
+        sa.Column('sha256', sa.String(), nullable=True),
+    ):
+        if column.name not in columns:
+            op.add_column('items', column)
+    for column in ('package_name', 'sha256'):
+        if op.f(f'ix_items_{column}') not in indexes:
+            op.create_index(op.f(f'ix_items_{column}'), 'items', [column], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('items') as batch_op:
+        batch_op.drop_index(op.f('ix_items_sha256'))
+        batch_op.drop_index(op.f('ix_items_package_name'))
+        batch_op.drop_column('sha256')
+        batch_op.drop_column('is_vr')
+        batch_op.drop_column('launch_activity')
+        batch_op.drop_column('version_code')
+        batch_op.drop_column('package_name')
@@ -0,0 +1,57 @@
+"""jobs
+
+Revision ID: 9b1f4c2d7e10
+Revises: 3ca28444a49e
+Create Date: 2026-10-19 10:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1f4c2d7e10'
+down_revision = '3ca28444a49e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the server makes missing tables itself at startup, they may be there already
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'jobs' not in tables:
+        op.create_table(
+            'jobs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('kind', sa.String(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.Column('params', sa.String(), nullable=True),
+            sa.Column('message', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(op.f('ix_jobs_id'), 'jobs', ['id'], unique=False)
+        op.create_index(op.f('ix_jobs_kind'), 'jobs', ['kind'], unique=False)
+        op.create_index(op.f('ix_jobs_status'), 'jobs', ['status'], unique=False)
+    if 'job_devices' not in tables:
+        op.create_table(
+            'job_devices',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('job_id', sa.Integer(), nullable=True),
+            sa.Column('serial', sa.String(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.Column('message', sa.String(), nullable=True),
+            sa.Column('progress', sa.Integer(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['job_id'], ['jobs.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(op.f('ix_job_devices_id'), 'job_devices', ['id'], unique=False)
+        op.create_index(op.f('ix_job_devices_job_id'), 'job_devices', ['job_id'], unique=False)
+        op.create_index(op.f('ix_job_devices_serial'), 'job_devices', ['serial'], unique=False)
+
+
+def downgrade():
+    op.drop_table('job_devices')
+    op.drop_table('jobs')
@@ -0,0 +1,136 @@
+"""
+Installing APKs by streaming them straight into the package manager.
+
+ppadb's device.install pushes the APK to /data/local/tmp and then runs `pm install` on it, so every byte is written to
+the headset twice, it needs free space for two copies, and a failed push leaves the half copy behind. For 1-2GB Quest
+builds that is most of the install time. Instead, the APK is written down the adb exec channel into
+`cmd package install -S <size>`, the way `adb install` does on Android 7 and later, so it goes straight to where the
+package manager keeps it.
+
+Headsets whose adbd lacks the `cmd` feature (older than Android 7) are installed by pushing, as before, and so is any
+headset the streamed install turned out not to work on. SIMU_INSTALL_MODE=push pushes always, SIMU_INSTALL_MODE=pull
+has the headsets download APKs from simu-launch instead (see apk_pull.py).
+"""
+import logging
+import os
+import re
+import time
+
+from ppadb import InstallError
+
+import apk_pull
+from federation import file_sha256
+from tracing import span
+
+CHUNK_BYTES = 1024 * 1024
+RESULT_PATTERN = re.compile(r"(Success|Failure|Error)\s?(.*)")
+# cmd is there but can't install from stdin: the package service is missing or too old for -S
+UNSUPPORTED = ("Can't find service: package", "Unknown option: -S", "cmd: not found")
+
+_streaming = {}
+
+
+def supports_streaming(device) -> bool:
+    """
+        Whether the headset's adbd can run `cmd`, asked once per headset.
+    """
+    if os.environ.get("SIMU_INSTALL_MODE", "auto") == "push":
+        return False
+    if device.serial not in _streaming:
+        try:
+            with device.client.create_connection() as conn:
+                conn.send(f"host-serial:{device.serial}:features")
+                features = conn.receive()
+        except RuntimeError as e:
+            logging.info(f"Could not get the adb features of {device.serial}, installing by push: {e}")
+            features = ""
+        _streaming[device.serial] = "cmd" in features.split(",")
+    return _streaming[device.serial]
+
+
+def stream_install(device, path: str, progress=None, chunk_bytes: int = CHUNK_BYTES) -> str:
+    """
+        Streams an APK into `cmd package install -S`.
+
+    :param device: the ppadb Device
+    :param path: the APK
+    :param progress: called with (bytes sent, total bytes) after each chunk, from the installing thread
+    :return: what the package manager answered, or adb's error if the headset refused the exec: service
+    """
+    size = os.path.getsize(path)
+    conn = device.create_connection()
+    with conn:
+        try:
+            conn.send(f"exec:cmd package install -S {size}")
+        except RuntimeError as e:
+            # adbd without the exec: service
+            return str(e)
+        sent = 0
+        with open(path, "rb") as apk:
+            while True:
+                chunk = apk.read(chunk_bytes)
+                if not chunk:
+                    break
+                conn.socket.sendall(chunk)
+                sent += len(chunk)
+                if progress is not None:
+                    progress(sent, size)
+        return conn.read_all().decode("utf-8", errors="replace")
+
+
+def install(device, path: str, progress=None) -> dict:
+    """
+        Installs an APK on a headset, streamed when it can be and pushed otherwise. Blocking, run it on a thread.
+
+    :param device: the ppadb Device
+    :param path: the APK
+    :param progress: called with (bytes sent, total bytes) as the APK is streamed, from the installing thread
+    :return: {"method": "pull", "stream" or "push", "bytes", "seconds", "mb_per_s"}
+    :raises InstallError: if the package manager refused the APK
+    """
+    if os.environ.get("SIMU_INSTALL_MODE") == "pull":
+        base_url = apk_pull.base_url_for(device.serial)
+        if base_url is not None:
+            try:
+                return apk_pull.pull_install(device, path, file_sha256(path), base_url)
+            except FileNotFoundError as e:
+                logging.info(f"{e}, installing over adb")
+
+    size = os.path.getsize(path)
+    started = time.perf_counter()
+    method = "push"
+    if supports_streaming(device):
+        with span("stream install", "adb", serial=device.serial, bytes=size):
+            result = stream_install(device, path, progress)
+        if any(message in result for message in UNSUPPORTED) or result.startswith("ERROR"):
+            logging.info(f"Streamed install is not supported on {device.serial}, installing by push: {result.strip()}")
+            _streaming[device.serial] = False
+        else:
+            match = RESULT_PATTERN.search(result)
+            if not match or match.group(1) != "Success":
+                raise InstallError(path, match.group(2) if match else result.strip())
+            method = "stream"
+    if method == "push":
+        with span("push install", "adb", serial=device.serial, bytes=size):
+            device.install(path)
+        if progress is not None:
+            progress(size, size)
+
+    seconds = time.perf_counter() - started
+    outcome = {
+        "method": method,
+        "bytes": size,
+        "seconds": round(seconds, 2),
+        "mb_per_s": round(size / 1024 / 1024 / seconds, 1) if seconds > 0 else None,
+    }
+    logging.info(f"Installed {path} on {device.serial} by {method}: {outcome['mb_per_s']}MB/s")
+    return outcome
+
+
+def describe(outcome: dict) -> str:
+    """
+        An install outcome as a job message, ie: 'Installed (stream, 1.2GB at 38.0MB/s)'
+    """
+    size = outcome["bytes"] / 1024 / 1024
+    size = f"{size / 1024:.1f}GB" if size >= 1024 else f"{size:.1f}MB"
+    return f"Installed ({outcome['method']}, {size} at {outcome['mb_per_s']}MB/s)"
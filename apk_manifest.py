@@ -0,0 +1,205 @@
+"""
+What an experience is, read from its APK on the server rather than asked of a headset.
+
+APKs are zips holding AndroidManifest.xml in Android's binary XML format. Only that one entry is read (whatever the
+size of the APK) and parsed for the package name, version, the activity the launcher starts and whether it is a VR
+app (a launcher intent filter with the com.oculus.intent.category.VR category, or declaring VR head tracking). /upload
+stores these in APKDetails, so starting and stopping an experience needs no `dumpsys package` round trip.
+
+Results are cached by the APK's sha256, in memory and in APKDetails, so the same APK uploaded again, under any name,
+isn't parsed again.
+"""
+import struct
+import zipfile
+
+VR_CATEGORY = "com.oculus.intent.category.VR"
+LAUNCHER_CATEGORIES = {"android.intent.category.LAUNCHER", "android.intent.category.INFO", VR_CATEGORY}
+MAIN_ACTION = "android.intent.action.MAIN"
+VR_FEATURES = {"android.hardware.vr.headtracking", "android.software.vr.mode"}
+
+RES_STRING_POOL = 0x0001
+RES_XML = 0x0003
+RES_XML_START_ELEMENT = 0x0102
+RES_XML_END_ELEMENT = 0x0103
+RES_XML_RESOURCE_MAP = 0x0180
+UTF8_FLAG = 0x100
+NO_INDEX = 0xFFFFFFFF
+
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+
+# attribute resource ids, for APKs whose attribute names were stripped by obfuscation
+ATTRIBUTE_IDS = {
+    0x01010003: "name",
+    0x0101021B: "versionCode",
+    0x0101021C: "versionName",
+    0x01010202: "targetActivity",
+}
+
+_by_sha256 = {}
+
+
+def _string_pool(data: bytes, offset: int) -> list:
+    _, header_size, _, count, _, flags, strings_start, _ = struct.unpack_from("<HHIIIIII", data, offset)
+    offsets = struct.unpack_from(f"<{count}I", data, offset + header_size)
+    base = offset + strings_start
+    strings = []
+    for start in offsets:
+        position = base + start
+        if flags & UTF8_FLAG:
+            # utf-16 length, then utf-8 length, each one or two bytes
+            for _ in range(2):
+                length = data[position]
+                position += 1
+                if length & 0x80:
+                    length = ((length & 0x7F) << 8) | data[position]
+                    position += 1
+            strings.append(data[position: position + length].decode("utf-8", "replace"))
+        else:
+            length = struct.unpack_from("<H", data, position)[0]
+            position += 2
+            if length & 0x8000:
+                length = ((length & 0x7FFF) << 16) | struct.unpack_from("<H", data, position)[0]
+                position += 2
+            strings.append(data[position: position + length * 2].decode("utf-16-le", "replace"))
+    return strings
+
+
+def parse_binary_xml(data: bytes):
+    """
+        Walks Android binary XML.
+
+    :return: yields ("start", tag, {attribute: value}) and ("end", tag, None), attribute names without namespace
+    """
+    chunk_type, header_size, size = struct.unpack_from("<HHI", data, 0)
+    if chunk_type != RES_XML:
+        raise ValueError("Not Android binary XML")
+    strings = []
+    resource_ids = []
+    offset = header_size
+    end = min(size, len(data))
+    while offset + 8 <= end:
+        chunk_type, header_size, chunk_size = struct.unpack_from("<HHI", data, offset)
+        if chunk_size < 8:
+            raise ValueError("Corrupt binary XML")
+        if chunk_type == RES_STRING_POOL:
+            strings = _string_pool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP:
+            resource_ids = struct.unpack_from(f"<{(chunk_size - header_size) // 4}I", data, offset + header_size)
+        elif chunk_type in (RES_XML_START_ELEMENT, RES_XML_END_ELEMENT):
+            extension = offset + header_size
+            _, name = struct.unpack_from("<II", data, extension)
+            tag = strings[name]
+            if chunk_type == RES_XML_END_ELEMENT:
+                yield "end", tag, None
+            else:
+                attribute_start, attribute_size, attribute_count = struct.unpack_from("<HHH", data, extension + 8)
+                attributes = {}
+                for index in range(attribute_count):
+                    position = extension + attribute_start + index * attribute_size
+                    _, name, raw, _, _, data_type, value = struct.unpack_from("<IIIHBBI", data, position)
+                    key = strings[name] if name < len(strings) else ""
+                    if not key and name < len(resource_ids):
+                        key = ATTRIBUTE_IDS.get(resource_ids[name], "")
+                    attributes[key] = _value(strings, raw, data_type, value)
+                yield "start", tag, attributes
+        offset += chunk_size
+
+
+def _value(strings: list, raw: int, data_type: int, value: int):
+    if raw != NO_INDEX:
+        return strings[raw]
+    if data_type == TYPE_STRING:
+        return strings[value]
+    if data_type == TYPE_INT_BOOLEAN:
+        return value != 0
+    if data_type in (TYPE_INT_DEC, TYPE_INT_HEX):
+        return value
+    if data_type == TYPE_REFERENCE:
+        return f"@0x{value:08x}"
+    return value
+
+
+def parse_manifest(data: bytes) -> dict:
+    """
+        A binary AndroidManifest.xml -> {"package", "version_code", "version_name", "launch_activity", "is_vr"}
+    """
+    manifest = {"package": None, "version_code": None, "version_name": None, "launch_activity": None, "is_vr": False}
+    activity = None
+    actions, categories = set(), set()
+    in_filter = False
+    for event, tag, attributes in parse_binary_xml(data):
+        if event == "start":
+            if tag == "manifest":
+                manifest["package"] = attributes.get("package")
+                manifest["version_code"] = attributes.get("versionCode")
+                manifest["version_name"] = attributes.get("versionName")
+            elif tag in ("activity", "activity-alias"):
+                activity = attributes.get("name")
+            elif tag == "intent-filter":
+                in_filter = True
+                actions, categories = set(), set()
+            elif tag == "action" and in_filter:
+                actions.add(attributes.get("name"))
+            elif tag == "category" and in_filter:
+                categories.add(attributes.get("name"))
+            elif tag == "uses-feature" and attributes.get("name") in VR_FEATURES:
+                manifest["is_vr"] = manifest["is_vr"] or attributes.get("required", True) is not False
+        elif tag == "intent-filter":
+            in_filter = False
+            if activity and MAIN_ACTION in actions and categories & LAUNCHER_CATEGORIES:
+                if VR_CATEGORY in categories:
+                    manifest["is_vr"] = True
+                # a VR launcher entry wins over a flat one, otherwise the first launcher entry
+                if manifest["launch_activity"] is None or VR_CATEGORY in categories:
+                    manifest["launch_activity"] = activity
+        elif tag in ("activity", "activity-alias"):
+            activity = None
+
+    if manifest["package"] is None:
+        raise ValueError("No package name in the manifest")
+    if manifest["launch_activity"] and manifest["launch_activity"].startswith("."):
+        manifest["launch_activity"] = manifest["package"] + manifest["launch_activity"]
+    elif manifest["launch_activity"] and "." not in manifest["launch_activity"]:
+        manifest["launch_activity"] = manifest["package"] + "." + manifest["launch_activity"]
+    return manifest
+
+
+def read_apk(path: str, sha256: str = None) -> dict:
+    """
+        The manifest details of an APK, see parse_manifest.
+
+    :param path: the APK
+    :param sha256: the APK's sha256 if already known, a result cached for it is returned without opening the APK
+    :raises ValueError: if it is not an APK
+    """
+    if sha256 is not None and sha256 in _by_sha256:
+        return dict(_by_sha256[sha256])
+    try:
+        with zipfile.ZipFile(path) as apk:
+            data = apk.read("AndroidManifest.xml")
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise ValueError(f"{path} is not an APK: {e}")
+    try:
+        manifest = parse_manifest(data)
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"Could not read the manifest of {path}: {e}")
+    if sha256 is not None:
+        _by_sha256[sha256] = dict(manifest)
+    return manifest
+
+
+def from_details(item) -> dict:
+    """
+        The manifest details stored in an APKDetails row, as from read_apk.
+    """
+    return {
+        "package": item.package_name,
+        "version_code": item.version_code,
+        "version_name": None,
+        "launch_activity": item.launch_activity,
+        "is_vr": bool(item.is_vr),
+    }
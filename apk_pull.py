@@ -0,0 +1,171 @@
+"""
+Installing APKs by having the headsets download them from simu-launch over HTTP.
+
+Pushed or streamed, every byte of an APK goes through the one adb server on the Pi, headset after headset. With
+SIMU_INSTALL_MODE=pull the headsets fetch it themselves instead: simu-launch serves the APKs at /apks/<name> (with Range
+and ETag, so an interrupted download carries on where it stopped), each headset is told over adb shell to download its
+copy with curl or wget, all of them at once, and adb only carries the short download and install commands.
+
+The download is kept under a name made from the APK's sha256 until it is installed, so a headset that drops off the
+wifi half way resumes it the next time the install is tried. Headsets the server can't be reached from (plugged in by
+USB, or without curl and wget) are installed the usual way, see apk_install.py.
+
+The headsets are given `SIMU_APK_BASE_URL` (ie: http://10.0.0.20:8000) when set, otherwise the Pi's address on the
+headset's network and `SIMU_HTTP_PORT` (default 8000).
+"""
+import logging
+import os
+import socket
+import time
+from urllib.parse import quote
+
+from ppadb import InstallError
+
+from tracing import span
+
+CHUNK_BYTES = 256 * 1024
+MEDIA_TYPE = "application/vnd.android.package-archive"
+DOWNLOAD_DIR = "/data/local/tmp"
+DOWNLOAD_ATTEMPTS = 5
+NO_CLIENT = "simu-pull: no curl or wget"
+
+
+def parse_range(header: str, size: int):
+    """
+        A Range header -> the (first, last) byte wanted, both included.
+
+    :return: None when the header isn't a single byte range this understands, which is answered with the whole file
+    :raises ValueError: if the range is outside the file
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not (first or last) or not (first.isdigit() or not first) or not (last.isdigit() or not last):
+        return None
+    if not first:
+        # the last n bytes
+        if int(last) == 0:
+            raise ValueError(f"{header} is empty")
+        return max(size - int(last), 0), size - 1
+    first, last = int(first), int(last) if last else size - 1
+    if first >= size:
+        raise ValueError(f"{header} is outside the {size} bytes")
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+def file_chunks(path: str, first: int, last: int, chunk_bytes: int = CHUNK_BYTES):
+    """
+        Yields bytes first to last of a file. Plain iterator, so Starlette reads it on its thread pool.
+    """
+    remaining = last - first + 1
+    with open(path, "rb") as f:
+        f.seek(first)
+        while remaining > 0:
+            chunk = f.read(min(chunk_bytes, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def wifi_address(serial: str):
+    """
+        The headset's IP address if it is connected over wifi, ie: '192.168.0.155:5555' -> '192.168.0.155'
+    """
+    host, _, port = serial.rpartition(":")
+    return host if host and port.isdigit() else None
+
+
+def base_url_for(serial: str):
+    """
+        The address the headset can reach simu-launch on, None if there isn't one.
+    """
+    if os.environ.get("SIMU_APK_BASE_URL"):
+        return os.environ["SIMU_APK_BASE_URL"].rstrip("/")
+    address = wifi_address(serial)
+    if address is None:
+        return None
+    try:
+        # nothing is sent, connecting a UDP socket only picks the interface the headset is reached through
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect((address, 9))
+            local = probe.getsockname()[0]
+    except OSError:
+        return None
+    return f"http://{local}:{os.environ.get('SIMU_HTTP_PORT', 8000)}"
+
+
+def download_path(sha256: str) -> str:
+    return f"{DOWNLOAD_DIR}/simu-pull-{sha256[:16]}.apk"
+
+
+def download_command(url: str, destination: str, size: int, attempts: int = DOWNLOAD_ATTEMPTS) -> str:
+    """
+        The shell script a headset downloads an APK with: resumes a partial download, retries a few times, then prints
+        the size and sha256 of what it has.
+    """
+    return (
+        f"f={destination}; "
+        f"for attempt in {' '.join(str(n) for n in range(1, attempts + 1))}; do "
+        f"have=$(stat -c %s $f 2>/dev/null || echo 0); "
+        f"[ $have -ge {size} ] && break; "
+        f"if command -v curl >/dev/null; then curl -sfL -C - -o $f '{url}'; "
+        f"elif command -v wget >/dev/null; then wget -q -c -O $f '{url}'; "
+        f"else echo '{NO_CLIENT}'; exit 1; fi || sleep $attempt; "
+        f"done; "
+        f"stat -c %s $f; sha256sum $f"
+    )
+
+
+def pull_install(device, path: str, sha256: str, base_url: str) -> dict:
+    """
+        Has the headset download the APK from base_url and installs it from there. Blocking, run it on a thread.
+
+    :param device: the ppadb Device
+    :param path: the APK, as served at /apks/<its name>
+    :param sha256: the APK's sha256
+    :param base_url: the address of this simu-launch as seen from the headset
+    :return: {"method": "pull", "bytes", "seconds", "mb_per_s"}
+    :raises InstallError: if the download didn't complete or the package manager refused the APK
+    :raises FileNotFoundError: if the headset has neither curl nor wget
+    """
+    size = os.path.getsize(path)
+    url = f"{base_url}/apks/{quote(os.path.basename(path))}"
+    destination = download_path(sha256)
+    started = time.perf_counter()
+    with span("pull download", "adb", serial=device.serial, bytes=size):
+        output = device.shell(download_command(url, destination, size))
+    if NO_CLIENT in output:
+        raise FileNotFoundError(f"{device.serial} has neither curl nor wget")
+    try:
+        # the last two lines are the size and the sha256 of the download
+        have, digest = output.strip().splitlines()[-2:]
+        have, digest = int(have), digest.split()[0]
+    except (ValueError, IndexError):
+        have, digest = 0, None
+    if have < size or digest != sha256:
+        if have >= size:
+            # complete but not what is served now, start afresh next time
+            device.shell(f"rm -f {destination}")
+        raise InstallError(path, f"download from {url} incomplete: {output.strip()[-200:]}")
+    downloaded = time.perf_counter()
+
+    with span("pull install", "adb", serial=device.serial):
+        result = device.shell(f"pm install -r {destination}")
+    device.shell(f"rm -f {destination}")
+    if "Success" not in result:
+        raise InstallError(path, result.strip())
+
+    seconds = time.perf_counter() - started
+    logging.info(
+        f"{device.serial} downloaded {path} in {downloaded - started:.1f}s and installed it in "
+        f"{seconds - (downloaded - started):.1f}s"
+    )
+    return {
+        "method": "pull",
+        "bytes": size,
+        "seconds": round(seconds, 2),
+        "mb_per_s": round(size / 1024 / 1024 / (downloaded - started), 1) if downloaded > started else None,
+    }
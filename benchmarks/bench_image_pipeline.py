@@ -0,0 +1,100 @@
+"""
+Per-stage timings of the screenshot pipeline (image_pipeline.py), using pytest-benchmark.
+
+    pytest benchmarks/bench_image_pipeline.py
+
+Results can be saved and compared across commits, failing the run if a stage gets slower:
+
+    pytest benchmarks/bench_image_pipeline.py --benchmark-autosave
+    pytest benchmarks/bench_image_pipeline.py --benchmark-compare --benchmark-compare-fail=mean:15%
+
+The frames are generated at the native resolution of each headset/phone. Real recordings can be added by dropping
+`adb exec-out screencap -p > benchmarks/fixtures/<name>.png` files into benchmarks/fixtures, they are picked up
+automatically.
+"""
+import glob
+import os
+
+import pytest
+
+import image_pipeline
+from benchmarks.fake_adb import solid_png
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+THUMBNAIL_HEIGHT = 108
+
+GENERATED = {
+    "quest1-2880x1600": (2880, 1600),
+    "quest2-3664x1920": (3664, 1920),
+    "quest3-4128x2208": (4128, 2208),
+    "android-1080x2400": (1080, 2400),
+}
+
+
+def load_fixtures():
+    fixtures = {}
+    for name, size in GENERATED.items():
+        fixtures[name] = lambda size=size: solid_png(*size)
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.png"))):
+        fixtures["recorded-" + os.path.splitext(os.path.basename(path))[0]] = lambda path=path: open(path, "rb").read()
+    return fixtures
+
+
+FIXTURES = load_fixtures()
+_cache = {}
+
+
+@pytest.fixture(params=sorted(FIXTURES), scope="module")
+def screencap(request):
+    if request.param not in _cache:
+        _cache[request.param] = FIXTURES[request.param]()
+    return _cache[request.param]
+
+
+@pytest.fixture(scope="module")
+def decoded(screencap):
+    return image_pipeline.decode(screencap)
+
+
+@pytest.mark.benchmark(group="crlf")
+def test_normalise_line_endings(benchmark, screencap):
+    with_crlf = screencap.replace(b"\n", b"\r\n")
+    result = benchmark(image_pipeline.normalise_line_endings, with_crlf)
+    assert result == screencap
+
+
+@pytest.mark.benchmark(group="decode")
+def test_decode(benchmark, screencap):
+    image = benchmark(image_pipeline.decode, screencap)
+    assert image is not None
+
+
+@pytest.mark.benchmark(group="crop")
+def test_crop(benchmark, decoded):
+    image = benchmark(image_pipeline.crop_left_eye, decoded)
+    assert image.shape[1] == decoded.shape[1] // 2
+
+
+@pytest.mark.benchmark(group="resize")
+def test_resize(benchmark, decoded):
+    image = benchmark(image_pipeline.resize_to_height, image_pipeline.crop_left_eye(decoded), THUMBNAIL_HEIGHT)
+    assert image.shape[0] == THUMBNAIL_HEIGHT
+
+
+@pytest.mark.benchmark(group="encode")
+def test_encode(benchmark, decoded):
+    thumbnail = image_pipeline.resize_to_height(image_pipeline.crop_left_eye(decoded), THUMBNAIL_HEIGHT)
+    encoded = benchmark(image_pipeline.encode_png, thumbnail)
+    assert len(encoded)
+
+
+@pytest.mark.benchmark(group="base64")
+def test_base64(benchmark, decoded):
+    thumbnail = image_pipeline.resize_to_height(image_pipeline.crop_left_eye(decoded), THUMBNAIL_HEIGHT)
+    encoded = image_pipeline.encode_png(thumbnail)
+    assert benchmark(image_pipeline.to_base64, encoded)
+
+
+@pytest.mark.benchmark(group="pipeline")
+def test_pipeline(benchmark, screencap):
+    assert benchmark(image_pipeline.process_screencap, screencap, THUMBNAIL_HEIGHT)
@@ -0,0 +1,688 @@
+"""
+A fake adb server that simulates a fleet of headsets, so simu-launch can be benchmarked (and poked at) with far more
+devices than anyone has on their desk.
+
+It speaks enough of the adb smart-socket protocol for ppadb (host:devices, host:transport, shell:, exec:, sync: push,
+host:connect, ...) and comes with a tiny `adb` command line shim for the places where simu-launch shells out to the
+adb binary instead. Point simu-launch at it with the standard ANDROID_ADB_SERVER_PORT environment variable and put the
+shim directory first on the PATH (see FakeAdbServer.environment()).
+
+    python -m benchmarks.fake_adb --devices 20 --port 5038
+
+Each device can be given latency, jitter and a failure rate, and serves canned screencap / package list / dumpsys
+output.
+"""
+import argparse
+import asyncio
+import dataclasses
+import os
+import random
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+DEVICE_TMP = "/data/local/tmp"
+DEVICE_STORAGE = "/sdcard"
+DEFAULT_PACKAGES = [
+    "com.oculus.shellenv",
+    "com.StoryFutures.experience",
+    "com.TrajectoryTheatre.SimuLaunchHome",
+    "com.amazon.calculator",
+]
+
+
+def solid_png(width: int, height: int, seed: int = 0) -> bytes:
+    """
+        Builds a PNG with some structure to it (bands plus noise) so decoding costs roughly what a real headset frame
+        does. Uses zlib directly so the fake server does not need OpenCV.
+    """
+    rnd = random.Random(seed)
+    tiles = []
+    for _ in range(16):
+        tile = bytearray()
+        for _ in range(61):
+            value = rnd.getrandbits(8) & 0x1F
+            tile += bytes((value, (value + 40) & 0xFF, (value + 80) & 0xFF))
+        tiles.append(bytes(tile))
+
+    rows = []
+    band = max(1, height // 8)
+    for y in range(height):
+        base = (y // band) * 30 % 256
+        tile = bytes((b + base) & 0xFF for b in tiles[rnd.randrange(len(tiles))])
+        row = (tile * (width // 61 + 1))[: width * 3]
+        rows.append(b"\x00" + row)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+@dataclass
+class FakeDevice:
+    serial: str
+    latency_ms: float = 20
+    jitter_ms: float = 10
+    failure_rate: float = 0.0
+    battery: int = 80
+    volume: int = 10
+    packages: List[str] = field(default_factory=lambda: list(DEFAULT_PACKAGES))
+    resumed: str = "com.oculus.shellenv/.ShellEnvActivity"
+    screen_on: bool = True
+    screen_off_timeout: int = 30000
+    crlf_screencap: bool = False
+    ip: str = ""
+    tcp_port: int = 0
+    installed: Dict[str, int] = field(default_factory=dict)
+    features: str = "shell_v2,cmd,stat_v2"
+    # what the package manager answers installs with, ie: "Failure [INSTALL_FAILED_INSUFFICIENT_STORAGE]"
+    install_result: str = "Success"
+    streamed: int = 0
+    # when set, the APK downloads the device is told to do (see apk_pull.py) are really done, into this directory
+    download_dir: str = None
+    # when set, files pushed under /sdcard are really written here, and scripts run in /sdcard are run on them
+    storage_dir: str = None
+    boot_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    calls: int = 0
+    screencaps: int = 0
+
+    async def delay(self):
+        wait = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if wait > 0:
+            await asyncio.sleep(wait / 1000)
+
+    def fails(self):
+        return self.failure_rate and random.random() < self.failure_rate
+
+    def shell(self, command: str, screencap: bytes) -> bytes:
+        """
+            Runs a shell command line. Understands `;` separated commands, `echo` and `| grep` filters, enough for
+            the compound commands simu-launch sends.
+        """
+        self.calls += 1
+        outputs = []
+        for part in command.split(";"):
+            stages = [stage.strip() for stage in part.split(" | ")]
+            if stages[0].startswith("echo "):
+                output = stages[0][5:].strip("'\"") + "\n"
+            else:
+                output = self._shell(stages[0], screencap)
+            for stage in stages[1:]:
+                if stage.startswith("grep ") and isinstance(output, str):
+                    pattern = stage[5:].strip().strip("'\"")
+                    output = "".join(line + "\n" for line in output.splitlines() if pattern in line)
+            outputs.append(output if isinstance(output, bytes) else output.encode())
+        return b"".join(outputs)
+
+    def local_path(self, path: str):
+        """
+            Where a path on the device is kept on this machine, None if it isn't.
+        """
+        if self.download_dir and path.startswith(DEVICE_TMP + "/"):
+            return self.download_dir + path[len(DEVICE_TMP):]
+        if self.storage_dir and path.startswith(DEVICE_STORAGE + "/"):
+            return self.storage_dir + path[len(DEVICE_STORAGE):]
+        return None
+
+    def runs_locally(self, command: str) -> bool:
+        """
+            Whether a command is one of the scripts run for real: APK downloads and folder comparisons.
+        """
+        if self.download_dir and "simu-pull" in command and not command.startswith("pm install"):
+            return True
+        return bool(self.storage_dir) and command.startswith(f"cd {DEVICE_STORAGE}/")
+
+    def run_locally(self, command: str) -> bytes:
+        """
+            Runs a command line on this machine, with download_dir standing for /data/local/tmp and storage_dir for
+            /sdcard. Blocking.
+        """
+        self.calls += 1
+        mapped = [
+            (device_path, local) for device_path, local in
+            ((DEVICE_TMP, self.download_dir), (DEVICE_STORAGE, self.storage_dir)) if local
+        ]
+        for device_path, local in mapped:
+            command = command.replace(device_path, local)
+        outcome = subprocess.run(["sh", "-c", command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = outcome.stdout
+        for device_path, local in mapped:
+            output = output.replace(local.encode(), device_path.encode())
+        return output
+
+    def _shell(self, command, screencap):
+        if command.startswith("screencap"):
+            self.screencaps += 1
+            return screencap.replace(b"\n", b"\r\n") if self.crlf_screencap else screencap
+        if command.startswith("dumpsys battery"):
+            return f"Current Battery Service state:\n  AC powered: false\n  level: {self.battery}\n  scale: 100\n"
+        if command.startswith("dumpsys activity"):
+            return (
+                "ACTIVITY MANAGER ACTIVITIES (dumpsys activity activities)\n"
+                f"    mResumedActivity: ActivityRecord{{1a2b3c u0 {self.resumed} t12}}\n"
+                "    mLastPausedActivity: null\n"
+            )
+        if command.startswith("dumpsys power"):
+            return f"Display Power: state={'ON' if self.screen_on else 'OFF'}\n"
+        if command.startswith("cmd package list packages") or command.startswith("pm list packages"):
+            return "".join(f"package:{package}\n" for package in self.packages)
+        if command.startswith("dumpsys package"):
+            wanted = command[len("dumpsys package"):].strip()
+            if not wanted:
+                return "".join(
+                    f"        4f1c2d1 {package}/com.unity3d.player.UnityPlayerActivity filter 9e8d7c6\n"
+                    for package in self.packages
+                )
+            if wanted in self.packages:
+                return f"Packages:\n  Package [{wanted}] (4f1c2d1):\n    versionCode=1 minSdk=23\n    versionName=0.1\n"
+            return f"Unable to find package: {wanted}\n"
+        if command.startswith("am start"):
+            component = command.split(" ")[-1]
+            self.resumed = component
+            return f"Starting: Intent {{ cmp={component} }}\n"
+        if command.startswith("am force-stop"):
+            self.resumed = "com.oculus.shellenv/.ShellEnvActivity"
+            return ""
+        if command.startswith("monkey"):
+            return "Events injected: 1\n"
+        if command.startswith("pm install") or "package install" in command:
+            if self.install_result != "Success":
+                return self.install_result + "\n"
+            package = os.path.basename(command.split()[-1])
+            if package.endswith(".apk") and package[:-4] not in self.packages:
+                self.packages.append(package[:-4])
+            return "Success\n"
+        if command.startswith("cmd media_session volume") or command.startswith("media volume"):
+            if "--get" in command:
+                return f"volume is {self.volume} in range [0..15]\n"
+            if "--set" in command:
+                self.volume = int(command.split("--set")[1].split()[0])
+            return ""
+        if command.startswith("settings put system screen_off_timeout"):
+            self.screen_off_timeout = int(command.split()[-1])
+            return ""
+        if command.startswith("settings get system screen_off_timeout"):
+            return f"{self.screen_off_timeout}\n"
+        if command.startswith("cat /proc/sys/kernel/random/boot_id"):
+            return self.boot_id + "\n"
+        if command.startswith("ip addr show wlan0"):
+            return (
+                "3: wlan0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500\n"
+                f"    inet {self.ip or '127.0.0.1'}/24 brd 192.168.0.255 scope global wlan0\n"
+            )
+        if command.startswith("ip route"):
+            return f"192.168.0.0/24 dev wlan0 proto kernel scope link src {self.ip or '127.0.0.1'}\n"
+        return ""
+
+
+class FakeAdbServer:
+    def __init__(
+        self,
+        device_count: int = 10,
+        port: int = 0,
+        latency_ms: float = 20,
+        jitter_ms: float = 10,
+        failure_rate: float = 0.0,
+        screen_size=(3664, 1920),
+        wireless: bool = False,
+    ):
+        """
+        :param device_count: how many headsets to simulate
+        :param port: the port to listen on, 0 picks a free one
+        :param latency_ms: average delay added to every device command
+        :param jitter_ms: +/- random variation on the latency
+        :param failure_rate: chance (0-1) that a device command fails as 'device offline'
+        :param screen_size: (width, height) of the screencap each device returns
+        :param wireless: give devices ip:port serials backed by real listening sockets, so check_alive's port probe
+            is exercised. Otherwise devices look USB attached.
+        """
+        self.port = port
+        self.wireless = wireless
+        self.device_count = device_count
+        self.device_kwargs = dict(latency_ms=latency_ms, jitter_ms=jitter_ms, failure_rate=failure_rate)
+        self.screencap = solid_png(*screen_size)
+        self.devices: Dict[str, FakeDevice] = {}
+        self.dropped = {}
+        self._servers = []
+        self._trackers = []
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self.shim_dir = None
+
+    # -- lifecycle ----------------------------------------------------------------------------------------------
+
+    async def start_async(self):
+        server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self._servers.append(server)
+
+        for i in range(self.device_count):
+            if self.wireless:
+                listener = await asyncio.start_server(self._handle_device_port, "127.0.0.1", 0)
+                self._servers.append(listener)
+                serial = f"127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+                ip = "127.0.0.1"
+            else:
+                # each USB headset gets its own loopback address, so switching it to tcpip and connecting works for real
+                serial = f"FAKE{i:04d}"
+                ip = f"127.0.{10 + i // 250}.{i % 250 + 1}"
+            self.devices[serial] = FakeDevice(serial=serial, ip=ip, **self.device_kwargs)
+        return self
+
+    def start(self):
+        """
+            Runs the server on a background thread with its own event loop, returns once it is listening.
+        """
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start_async())
+            self._ready.set()
+            self._loop.run_forever()
+            # stopped: end the connections still open, so the loop closes cleanly
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True, name="fake-adb")
+        self._thread.start()
+        self._ready.wait(30)
+        return self
+
+    def stop(self):
+        def close():
+            for server in self._servers:
+                server.close()
+            self._loop.stop()
+
+        if self._loop is not None:
+            # servers belong to the loop's thread, closing them from here races with connections finishing there
+            self._loop.call_soon_threadsafe(close)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def drop(self, serial: str, down_s: float = 0, reboot: bool = False):
+        """
+            Simulates a headset's wifi dropping: it disappears from adb and refuses connections for down_s seconds.
+
+        :param reboot: come back with a new boot id and the volume reset, as if it had restarted meanwhile
+        """
+
+        def run():
+            device = self.devices.pop(serial)
+            if reboot:
+                device.boot_id = str(uuid.uuid4())
+                device.volume = 10
+            self.dropped[serial] = (device, time.monotonic() + down_s)
+            self._notify_trackers()
+
+        self._loop.call_soon_threadsafe(run)
+
+    def write_shim(self, directory: str) -> str:
+        """
+            Writes an `adb` executable into directory that forwards to this server.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "adb")
+        module = os.path.abspath(__file__)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{module}" cli "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
+        self.shim_dir = directory
+        return path
+
+    def environment(self, base: dict = None) -> dict:
+        env = dict(os.environ if base is None else base)
+        env["ANDROID_ADB_SERVER_PORT"] = str(self.port)
+        if self.shim_dir:
+            env["PATH"] = self.shim_dir + os.pathsep + env.get("PATH", "")
+        return env
+
+    # -- protocol -----------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _okay(data: bytes = None) -> bytes:
+        if data is None:
+            return b"OKAY"
+        return b"OKAY" + f"{len(data):04x}".encode() + data
+
+    @staticmethod
+    def _fail(message: str) -> bytes:
+        data = message.encode()
+        return b"FAIL" + f"{len(data):04x}".encode() + data
+
+    def _devices_payload(self, long: bool = False) -> bytes:
+        lines = []
+        for serial in self.devices:
+            line = f"{serial}\tdevice"
+            if long:
+                line += " product:hollywood model:Quest_2 device:hollywood transport_id:1"
+            lines.append(line + "\n")
+        return "".join(lines).encode()
+
+    async def _handle_device_port(self, reader, writer):
+        writer.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        device = None
+        try:
+            while True:
+                header = await reader.readexactly(4)
+                request = (await reader.readexactly(int(header, 16))).decode()
+                keep_going, device = await self._dispatch(request, device, reader, writer)
+                await writer.drain()
+                if not keep_going:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except RuntimeError:
+                pass
+
+    async def _dispatch(self, request, device, reader, writer):
+        """
+            Handles one smart-socket request. Returns (keep the connection open, device selected by host:transport).
+        """
+        if request.startswith("host:transport:") or request.startswith("host:tport:serial:"):
+            serial = request.split(":", 2)[2] if request.startswith("host:transport:") else request.split(":", 3)[3]
+            device = self.devices.get(serial)
+            if device is None:
+                writer.write(self._fail(f"device '{serial}' not found"))
+                return False, None
+            if device.fails():
+                writer.write(self._fail("device offline"))
+                return False, None
+            writer.write(self._okay())
+            if request.startswith("host:tport:"):
+                writer.write(struct.pack("<Q", 1))
+            return True, device
+        if request in ("host:transport-any", "host:transport-usb") and self.devices:
+            writer.write(self._okay())
+            return True, next(iter(self.devices.values()))
+        if request in ("host:devices", "host:devices-l"):
+            writer.write(self._okay(self._devices_payload(request.endswith("-l"))))
+            return False, device
+        if request == "host:track-devices":
+            writer.write(self._okay(self._devices_payload()))
+            await writer.drain()
+            self._trackers.append(writer)
+            try:
+                await reader.read()
+            finally:
+                self._trackers.remove(writer)
+            return False, device
+        if request == "host:version":
+            writer.write(self._okay(b"0029"))
+            return False, device
+        if request == "host:features":
+            writer.write(self._okay(b"shell_v2,cmd,stat_v2"))
+            return False, device
+        if request == "host:kill":
+            writer.write(self._okay())
+            return False, device
+        if request.startswith("host:connect:"):
+            address = request[len("host:connect:"):]
+            writer.write(self._okay(self._connect(address).encode()))
+            return False, device
+        if request.startswith("host:disconnect:"):
+            address = request[len("host:disconnect:"):]
+            self.devices.pop(address, None)
+            self._notify_trackers()
+            writer.write(self._okay(f"disconnected {address}".encode()))
+            return False, device
+        if request.startswith("host-serial:"):
+            serial, command = request[len("host-serial:"):].rsplit(":", 1)
+            if serial not in self.devices:
+                writer.write(self._fail(f"device '{serial}' not found"))
+            elif command == "get-state":
+                writer.write(self._okay(b"device"))
+            elif command == "features":
+                writer.write(self._okay(self.devices[serial].features.encode()))
+            else:
+                writer.write(self._okay(serial.encode()))
+            return False, device
+
+        if device is None:
+            writer.write(self._fail("no device selected"))
+            return False, device
+
+        if request.startswith("exec:") and "cmd" not in device.features.split(","):
+            # adbd from before Android 7
+            writer.write(self._fail("closed"))
+            return False, device
+        if request.startswith("shell") or request.startswith("exec:"):
+            command = request.split(":", 1)[1]
+            writer.write(self._okay())
+            await device.delay()
+            if "install -S" in command:
+                remaining = int(command.split("-S")[1].split()[0])
+                while remaining > 0:
+                    chunk = await reader.read(min(remaining, 65536))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    device.streamed += len(chunk)
+            if device.runs_locally(command):
+                writer.write(await asyncio.get_running_loop().run_in_executor(None, device.run_locally, command))
+                return False, device
+            writer.write(device.shell(command, self.screencap))
+            return False, device
+        if request.startswith("tcpip:"):
+            await self._listen_tcpip(device, int(request.split(":")[1]))
+            writer.write(self._okay())
+            writer.write(f"restarting in TCP mode port: {request.split(':')[1]}\n".encode())
+            return False, device
+        if request.startswith("reboot:"):
+            writer.write(self._okay())
+            return False, device
+        if request == "sync:":
+            writer.write(self._okay())
+            await self._sync(device, reader, writer)
+            return False, device
+
+        writer.write(self._fail(f"unknown request {request}"))
+        return False, device
+
+    def _connect(self, address: str) -> str:
+        if address in self.devices:
+            return f"already connected to {address}"
+        if address in self.dropped:
+            device, until = self.dropped[address]
+            if time.monotonic() < until:
+                return f"failed to connect to '{address}': No route to host"
+            del self.dropped[address]
+            self.devices[address] = device
+            self._notify_trackers()
+            return f"connected to {address}"
+        ip, _, port = address.partition(":")
+        port = int(port or 5555)
+        for device in list(self.devices.values()):
+            if device.ip == ip and device.tcp_port == port:
+                serial = f"{ip}:{port}"
+                self.devices[serial] = dataclasses.replace(device, serial=serial)
+                self._notify_trackers()
+                return f"connected to {serial}"
+        return f"failed to connect to '{address}': Connection refused"
+
+    def _notify_trackers(self):
+        payload = self._devices_payload()
+        for writer in self._trackers:
+            writer.write(f"{len(payload):04x}".encode() + payload)
+
+    async def _listen_tcpip(self, device, port: int):
+        if device.tcp_port == port:
+            return
+        try:
+            listener = await asyncio.start_server(self._handle_device_port, device.ip, port)
+        except OSError:
+            return
+        self._servers.append(listener)
+        device.tcp_port = port
+
+    async def _sync(self, device, reader, writer):
+        path = local = stored = None
+        received = 0
+        while True:
+            command = await reader.readexactly(4)
+            length = struct.unpack("<I", await reader.readexactly(4))[0]
+            if command == b"SEND":
+                path = (await reader.readexactly(length)).decode().rsplit(",", 1)[0]
+                received = 0
+                local = device.local_path(path)
+                if local is not None:
+                    os.makedirs(os.path.dirname(local), exist_ok=True)
+                    stored = open(local, "wb")
+            elif command == b"DATA":
+                data = await reader.readexactly(length)
+                received += length
+                if local is not None:
+                    stored.write(data)
+            elif command == b"DONE":
+                await device.delay()
+                device.installed[path] = received
+                if local is not None:
+                    # the length is the file's modification time
+                    stored.close()
+                    os.utime(local, (length, length))
+                writer.write(b"OKAY" + struct.pack("<I", 0))
+                await writer.drain()
+            elif command in (b"STAT", b"LST2", b"STA2"):
+                remote = (await reader.readexactly(length)).decode()
+                size = device.installed.get(remote, 0)
+                writer.write(b"STAT" + struct.pack("<III", 0o100644 if size else 0, size, 0))
+                await writer.drain()
+            elif command == b"QUIT":
+                return
+            else:
+                writer.write(b"FAIL" + struct.pack("<I", 11) + b"unsupported")
+                return
+
+
+def _request(port, request, serial=None, stream_stdin=False):
+    """
+        Used by the cli shim: sends a request to the fake server and returns the raw reply bytes.
+    """
+    sock = socket.create_connection(("127.0.0.1", port))
+    try:
+        def send(message):
+            data = message.encode()
+            sock.sendall(f"{len(data):04x}".encode() + data)
+            status = sock.recv(4)
+            if status != b"OKAY":
+                error = sock.recv(1024)
+                raise RuntimeError(error[4:].decode(errors="replace"))
+
+        if serial:
+            send(f"host:transport:{serial}")
+        send(request)
+        if stream_stdin:
+            sock.sendall(sys.stdin.buffer.read())
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+    finally:
+        sock.close()
+
+
+def cli(argv):
+    """
+        Minimal stand in for the adb binary: devices, shell, exec-out, tcpip, connect, disconnect, start/kill-server.
+    """
+    port = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+    serial = None
+    args = list(argv)
+    while args and args[0].startswith("-s"):
+        flag = args.pop(0)
+        serial = flag[2:] if len(flag) > 2 else args.pop(0)
+
+    if not args:
+        return 1
+    command, rest = args[0], args[1:]
+    try:
+        if command == "devices":
+            body = _request(port, "host:devices")
+            sys.stdout.write("List of devices attached\n" + body[4:].decode())
+        elif command in ("shell", "exec-out"):
+            output = _request(port, "shell:" + " ".join(rest), serial=serial)
+            sys.stdout.buffer.write(output)
+        elif command == "tcpip":
+            sys.stdout.buffer.write(_request(port, f"tcpip:{rest[0]}", serial=serial))
+        elif command == "connect":
+            sys.stdout.write(_request(port, f"host:connect:{rest[0]}")[4:].decode() + "\n")
+        elif command == "disconnect":
+            sys.stdout.write(_request(port, f"host:disconnect:{rest[0] if rest else ''}")[4:].decode() + "\n")
+        elif command in ("start-server", "kill-server"):
+            pass
+        else:
+            sys.stderr.write(f"fake adb: unsupported command {command}\n")
+            return 1
+    except RuntimeError as e:
+        sys.stderr.write(f"error: {e}\n")
+        return 1
+    except ConnectionRefusedError:
+        sys.stderr.write("* daemon not running\n")
+        return 1
+    sys.stdout.flush()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated adb server with a fleet of fake headsets")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--port", type=int, default=5038)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--wireless", action="store_true")
+    parser.add_argument("--shim-dir", default=None, help="also write an adb shim into this directory")
+    args = parser.parse_args()
+
+    server = FakeAdbServer(
+        device_count=args.devices,
+        port=args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate,
+        wireless=args.wireless,
+    ).start()
+    if args.shim_dir:
+        server.write_shim(args.shim_dir)
+    print(f"fake adb server with {len(server.devices)} devices on 127.0.0.1:{server.port}")
+    print(f"export ANDROID_ADB_SERVER_PORT={server.port}")
+    if args.shim_dir:
+        print(f"export PATH={os.path.abspath(args.shim_dir)}:$PATH")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "cli":
+        sys.exit(cli(sys.argv[2:]))
+    main()
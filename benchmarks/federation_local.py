@@ -0,0 +1,79 @@
+"""
+Runs a hub and several peer simu-launch nodes on this machine, each with its own fake adb server and headsets, and
+drives the hub to check federation end to end: merged /devices, /load staging the APK on each peer once, /start and
+/stop fanned out, and screenshots of a peer's headset proxied through the hub.
+
+    python -m benchmarks.federation_local
+    python -m benchmarks.federation_local --peers 3 --devices 10 --latency-ms 50
+
+Run it from the repository root.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+
+import requests
+
+from benchmarks.fake_adb import FakeAdbServer
+from benchmarks.fleet_benchmark import EXPERIENCE_APK, simu_launch_server
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    response = func()
+    body = response.json()
+    summary = {key: value for key, value in body.items() if key != "nodes"} if isinstance(body, dict) else body
+    print(f"{label:<34} {response.status_code} {(time.perf_counter() - start) * 1000:8.1f} ms  {str(summary)[:110]}")
+    sys.stdout.flush()
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", type=int, default=2, help="peer nodes besides the hub")
+    parser.add_argument("--devices", type=int, default=5, help="headsets per node")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    with ExitStack() as stack:
+        def node(extra_env=None):
+            fake = FakeAdbServer(device_count=args.devices, latency_ms=args.latency_ms, wireless=True).start()
+            stack.callback(fake.stop)
+            workdir = tempfile.mkdtemp(prefix="simu-federation-")
+            stack.callback(shutil.rmtree, workdir, True)
+            fake.write_shim(os.path.join(workdir, "bin"))
+            return stack.enter_context(simu_launch_server(fake, workdir, extra_env))
+
+        peers = [node() for _ in range(args.peers)]
+        for peer in peers:
+            # peers start without the experience, the hub has to stage it
+            requests.post(peer + "/remove-remote-experience", json={"experience": EXPERIENCE_APK})
+        hub = node({"SIMU_PEERS": ",".join(peers)})
+        requests.post(
+            hub + "/add-remote-experience",
+            json={"devices": [], "apk_name": EXPERIENCE_APK, "command": "com.unity3d.player.UnityPlayerActivity"},
+        )
+        print(f"hub {hub}, peers {', '.join(peers)}")
+
+        devices = timed("GET /devices", lambda: requests.get(hub + "/devices"))["devices"]
+        print(f"{len(devices)} headsets over {len({device['node'] for device in devices})} nodes")
+        payload = {"devices": [], "experience": EXPERIENCE_APK}
+        timed("POST /load (stages the APK)", lambda: requests.post(hub + "/load", json=payload))
+        timed("POST /load (already staged)", lambda: requests.post(hub + "/load", json=payload))
+        timed("POST /start", lambda: requests.post(hub + "/start", json=payload))
+        timed("POST /stop", lambda: requests.post(hub + "/stop", json=payload))
+
+        remote = [device["id"] for device in devices if device["node"]]
+        some = {"devices": remote[:1] + [device["id"] for device in devices if not device["node"]][:1],
+                "experience": EXPERIENCE_APK}
+        timed("POST /start (one local, one peer)", lambda: requests.post(hub + "/start", json=some))
+        if remote:
+            timed("GET /device-screen (peer headset)", lambda: requests.get(f"{hub}/device-screen/1000/small/{remote[0]}"))
+
+
+if __name__ == "__main__":
+    main()
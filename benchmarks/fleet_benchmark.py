@@ -0,0 +1,221 @@
+"""
+Measures how simu-launch copes as the fleet grows, using the fake adb server in place of real headsets.
+
+For every fleet size a fresh fake adb server and a fresh uvicorn process (with its own throw-away database) are
+started, then each endpoint is hit repeatedly from a pool of concurrent clients and the latency percentiles and
+throughput are reported.
+
+    python -m benchmarks.fleet_benchmark
+    python -m benchmarks.fleet_benchmark --devices 1,10 --requests 20 --latency-ms 50 --failure-rate 0.05
+    python -m benchmarks.fleet_benchmark --json results.json
+
+Run it from the repository root.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+
+from benchmarks.fake_adb import FakeAdbServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPERIENCE_PACKAGE = "com.StoryFutures.experience"
+EXPERIENCE_APK = EXPERIENCE_PACKAGE + ".apk"
+ENDPOINTS = ["devices", "start", "stop", "load", "device-screen", "devices-experiences"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_http(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.1)
+    return False
+
+
+def start_simu_launch(fake: FakeAdbServer, workdir: str, extra_env: dict = None):
+    """
+        Starts uvicorn against the fake adb server without waiting for it. The working directory gets links to static/
+        and templates/ plus its own apks/ folder and database, so the benchmark never touches the real ones.
+
+    :param extra_env: any further environment variables for the server, ie: SIMU_PEERS
+    :return: the uvicorn process and its base url
+    """
+    for name in ("static", "templates"):
+        os.symlink(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+    os.makedirs(os.path.join(workdir, "apks"))
+    with open(os.path.join(workdir, "apks", EXPERIENCE_APK), "wb") as f:
+        f.write(os.urandom(256 * 1024))
+
+    port = free_port()
+    env = fake.environment()
+    env["SIMU_DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    env["SIMU_HTTP_PORT"] = str(port)
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--app-dir", REPO_DIR, "--log-level", "warning"],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+def stop_process(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+@contextmanager
+def simu_launch_server(fake: FakeAdbServer, workdir: str, extra_env: dict = None):
+    """
+        Starts uvicorn against the fake adb server (see start_simu_launch) and waits until it answers.
+    """
+    process, base_url = start_simu_launch(fake, workdir, extra_env)
+    try:
+        if not wait_for_http(base_url + "/debug/traces"):
+            raise RuntimeError("simu-launch did not start, try running uvicorn by hand to see why")
+        yield base_url
+    finally:
+        stop_process(process)
+
+
+def endpoint_request(session: requests.Session, base_url: str, endpoint: str, serial: str):
+    if endpoint == "devices":
+        return session.get(base_url + "/devices")
+    if endpoint == "start":
+        return session.post(base_url + "/start", json={"devices": [], "experience": EXPERIENCE_APK})
+    if endpoint == "stop":
+        return session.post(base_url + "/stop", json={"devices": [], "experience": EXPERIENCE_APK})
+    if endpoint == "load":
+        return session.post(base_url + "/load", json={"devices": [], "experience": EXPERIENCE_APK})
+    if endpoint == "device-screen":
+        return session.get(f"{base_url}/device-screen/1000/small/{serial}")
+    if endpoint == "devices-experiences":
+        return session.get(base_url + "/devices-experiences")
+    raise ValueError(endpoint)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_endpoint(base_url, endpoint, serials, request_count, concurrency):
+    sessions = {}
+
+    def one(i):
+        session = sessions.setdefault(i % concurrency, requests.Session())
+        start = time.perf_counter()
+        try:
+            response = endpoint_request(session, base_url, endpoint, serials[i % len(serials)])
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(request_count)))
+    wall = time.perf_counter() - started
+
+    latencies = [latency * 1000 for latency, _ in results]
+    return {
+        "endpoint": endpoint,
+        "requests": request_count,
+        "errors": sum(1 for _, ok in results if not ok),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p90_ms": round(percentile(latencies, 90), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "throughput_rps": round(request_count / wall, 2),
+    }
+
+
+def run_fleet(device_count, args):
+    fake = FakeAdbServer(
+        device_count=device_count,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate,
+        wireless=args.wireless,
+    ).start()
+    workdir = tempfile.mkdtemp(prefix="simu-bench-")
+    try:
+        fake.write_shim(os.path.join(workdir, "bin"))
+        with simu_launch_server(fake, workdir) as base_url:
+            requests.post(
+                base_url + "/add-remote-experience",
+                json={"devices": [], "apk_name": EXPERIENCE_APK, "command": "com.unity3d.player.UnityPlayerActivity"},
+            )
+            serials = list(fake.devices)
+            results = []
+            for endpoint in args.endpoints:
+                result = run_endpoint(base_url, endpoint, serials, args.requests, args.concurrency)
+                result["devices"] = device_count
+                results.append(result)
+                print_row(result)
+            return results
+    finally:
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+COLUMNS = ["devices", "endpoint", "requests", "errors", "p50_ms", "p90_ms", "p99_ms", "mean_ms", "throughput_rps"]
+
+
+def print_row(result):
+    print("  ".join(str(result[column]).rjust(len(column) if column != "endpoint" else 20) for column in COLUMNS))
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", default="1,10,50,100", help="comma separated fleet sizes")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint per fleet size")
+    parser.add_argument("--concurrency", type=int, default=8, help="simultaneous clients (browsers)")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--wireless", action="store_true", help="use ip:port serials so check_alive probes run")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+    args.endpoints = [endpoint for endpoint in args.endpoints.split(",") if endpoint]
+
+    print("  ".join(column.rjust(len(column) if column != "endpoint" else 20) for column in COLUMNS))
+    results = []
+    for device_count in [int(n) for n in args.devices.split(",")]:
+        results.extend(run_fleet(device_count, args))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Times installing an APK on every headset of a fleet through adb (streamed, see apk_install.py) and by the headsets
+downloading it from simu-launch themselves (SIMU_INSTALL_MODE=pull, see apk_pull.py).
+
+The fake headsets really do download: each runs the download command it is sent with this machine's curl, into a
+directory of its own, so resuming and the Range requests are exercised for real.
+
+    python -m benchmarks.pull_install
+    python -m benchmarks.pull_install --devices 8 --apk-mb 200 --json pull_install.json
+
+Run it from the repository root.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import requests
+
+from benchmarks.fake_adb import FakeAdbServer
+from benchmarks.fleet_benchmark import EXPERIENCE_APK, simu_launch_server
+
+MODES = {"stream": {}, "pull": {"SIMU_INSTALL_MODE": "pull"}}
+
+
+def measure(fake: FakeAdbServer, shim_dir: str, extra_env: dict, apk_mb: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix="simu-install-")
+    downloads = tempfile.mkdtemp(prefix="simu-headsets-")
+    for device in fake.devices.values():
+        device.download_dir = tempfile.mkdtemp(dir=downloads)
+    try:
+        with simu_launch_server(fake, workdir, dict(extra_env, PATH=shim_dir + os.pathsep + os.environ["PATH"])) \
+                as base_url:
+            with open(os.path.join(workdir, "apks", EXPERIENCE_APK), "wb") as f:
+                f.write(os.urandom(apk_mb * 1024 * 1024))
+            started = time.perf_counter()
+            job_id = requests.post(base_url + "/load", json={"experience": EXPERIENCE_APK, "devices": []}).json()["job_id"]
+            while True:
+                job = requests.get(f"{base_url}/jobs/{job_id}").json()
+                if job["finished"]:
+                    break
+                time.sleep(0.1)
+            seconds = time.perf_counter() - started
+        return {
+            "status": job["status"],
+            "seconds": round(seconds, 2),
+            "fleet_mb_per_s": round(apk_mb * len(fake.devices) / seconds, 1),
+            "messages": sorted({device["message"].split(",")[0] for device in job["devices"]}),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        shutil.rmtree(downloads, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=8)
+    parser.add_argument("--apk-mb", type=int, default=100, help="size of the APK installed")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    fake = FakeAdbServer(device_count=args.devices, latency_ms=args.latency_ms, wireless=True).start()
+    shim_dir = tempfile.mkdtemp(prefix="simu-adb-")
+    fake.write_shim(shim_dir)
+    try:
+        results = {mode: measure(fake, shim_dir, extra_env, args.apk_mb) for mode, extra_env in MODES.items()}
+    finally:
+        fake.stop()
+        shutil.rmtree(shim_dir, ignore_errors=True)
+
+    print(f"{'mode':<8} {'status':>7} {'seconds':>8} {'fleet MB/s':>11}")
+    for mode, result in results.items():
+        print(f"{mode:<8} {result['status']:>7} {result['seconds']:>8} {result['fleet_mb_per_s']:>11}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
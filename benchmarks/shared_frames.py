@@ -0,0 +1,103 @@
+"""
+Counts the screencaps simu-launch takes when it runs several worker processes and many browsers poll the thumbnails,
+with and without the frames being shared between the workers (SIMU_FRAME_RING=1, see frame_ring.py).
+
+Each worker is its own uvicorn process on its own port and the browsers are spread over them evenly, as uvicorn's own
+--workers leaves it to the kernel which worker answers, which under light load is nearly always the same one.
+
+    python -m benchmarks.shared_frames
+    python -m benchmarks.shared_frames --workers 4 --browsers 6 --seconds 10 --json shared_frames.json
+
+Run it from the repository root.
+"""
+import argparse
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fake_adb import FakeAdbServer
+from benchmarks.fleet_benchmark import start_simu_launch, stop_process, wait_for_http
+
+MODES = {"per-worker": {}, "shared": {"SIMU_FRAME_RING": "1"}}
+
+
+def poll(base_url: str, serials: list, until: float, refresh_s: float) -> list:
+    """
+        One browser: asks for every headset's thumbnail each refresh, like the devices page does.
+    """
+    latencies = []
+    with requests.Session() as session:
+        while time.perf_counter() < until:
+            started = time.perf_counter()
+            for serial in serials:
+                session.get(f"{base_url}/device-screen/1000/small/{serial}", timeout=30)
+            latencies.append(time.perf_counter() - started)
+            time.sleep(max(0.0, refresh_s - (time.perf_counter() - started)))
+    return latencies
+
+
+def measure(fake: FakeAdbServer, extra_env: dict, workers: int, browsers: int, seconds: float) -> dict:
+    ring_dir = tempfile.mkdtemp(prefix="simu-frames-")
+    extra_env = dict(extra_env, SIMU_FRAME_RING_DIR=ring_dir)
+    workdirs = [tempfile.mkdtemp(prefix="simu-worker-") for _ in range(workers)]
+    servers = [start_simu_launch(fake, workdir, extra_env) for workdir in workdirs]
+    try:
+        for _, base_url in servers:
+            if not wait_for_http(base_url + "/debug/traces"):
+                raise RuntimeError("simu-launch did not start, try running uvicorn by hand to see why")
+        serials = list(fake.devices)
+        for device in fake.devices.values():
+            device.screencaps = 0
+        until = time.perf_counter() + seconds
+        with ThreadPoolExecutor(browsers) as pool:
+            runs = list(pool.map(
+                lambda browser: poll(servers[browser % workers][1], serials, until, 1.0), range(browsers)
+            ))
+        latencies = sorted(latency for run in runs for latency in run)
+        screencaps = sum(device.screencaps for device in fake.devices.values())
+        return {
+            "screencaps_per_headset_per_s": round(screencaps / len(serials) / seconds, 2),
+            "refresh_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        }
+    finally:
+        for process, _ in servers:
+            stop_process(process)
+        for directory in workdirs + [ring_dir]:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3, help="worker processes")
+    parser.add_argument("--browsers", type=int, default=6, help="pages polling every headset once a second")
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=8)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    fake = FakeAdbServer(device_count=args.devices, latency_ms=150).start()
+    shim_dir = tempfile.mkdtemp(prefix="simu-adb-")
+    fake.write_shim(shim_dir)
+    try:
+        results = {
+            mode: measure(fake, extra_env, args.workers, args.browsers, args.seconds) for mode, extra_env in MODES.items()
+        }
+    finally:
+        fake.stop()
+        shutil.rmtree(shim_dir, ignore_errors=True)
+
+    print(f"{'mode':<12} {'screencaps/headset/s':>21} {'refresh p50':>12}")
+    for mode, result in results.items():
+        print(f"{mode:<12} {result['screencaps_per_headset_per_s']:>21} {result['refresh_p50_ms']:>10}ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
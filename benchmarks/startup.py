@@ -0,0 +1,115 @@
+"""
+Measures how quickly simu-launch answers after being started and how much memory it holds, as on a Pi coming back after
+a power cut, for the normal and the low memory (SIMU_LOW_MEMORY=1) modes.
+
+For each mode a fresh server is started against the fake adb server and timed until its first response, its resident
+memory is read then and again after the first thumbnail (which is when OpenCV gets loaded).
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 5 --json startup.json
+
+Linux only (memory is read from /proc). Run it from the repository root.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import requests
+
+from benchmarks.fake_adb import FakeAdbServer
+from benchmarks.fleet_benchmark import start_simu_launch, stop_process
+
+MODES = {"default": {}, "low-memory": {"SIMU_LOW_MEMORY": "1"}}
+
+
+def rss_mb(pid: int, children: bool = True) -> float:
+    """
+        Resident memory of a process, plus that of its children (ie: image worker processes).
+    """
+    pids = [pid]
+    if children:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                            pids.append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass
+    total_kb = 0
+    for each in pids:
+        try:
+            with open(f"/proc/{each}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total_kb / 1024, 1)
+
+
+def measure(fake: FakeAdbServer, extra_env: dict, timeout: float = 60) -> dict:
+    workdir = tempfile.mkdtemp(prefix="simu-startup-")
+    started = time.perf_counter()
+    process, base_url = start_simu_launch(fake, workdir, extra_env)
+    try:
+        while True:
+            try:
+                requests.get(base_url + "/debug/traces", timeout=1)
+                break
+            except requests.RequestException:
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError("simu-launch did not start, try running uvicorn by hand to see why")
+                time.sleep(0.02)
+        first_response = time.perf_counter() - started
+        idle = rss_mb(process.pid)
+
+        serial = next(iter(fake.devices))
+        if "base64_image" not in requests.get(f"{base_url}/device-screen/1000/small/{serial}", timeout=30).json():
+            raise RuntimeError("No thumbnail was made")
+        after_thumbnail = rss_mb(process.pid)
+        return {
+            "first_response_s": round(first_response, 2),
+            "rss_idle_mb": idle,
+            "rss_after_thumbnail_mb": after_thumbnail,
+        }
+    finally:
+        stop_process(process)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="servers started per mode, the median is reported")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    fake = FakeAdbServer(device_count=1, latency_ms=20).start()
+    shim_dir = tempfile.mkdtemp(prefix="simu-adb-")
+    fake.write_shim(shim_dir)
+    results = {}
+    try:
+        for mode, extra_env in MODES.items():
+            runs = [measure(fake, extra_env) for _ in range(args.runs)]
+            results[mode] = {key: round(statistics.median(run[key] for run in runs), 2) for key in runs[0]}
+    finally:
+        fake.stop()
+        shutil.rmtree(shim_dir, ignore_errors=True)
+
+    print(f"{'mode':<12} {'first response':>15} {'rss idle':>10} {'rss after thumbnail':>20}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<12} {result['first_response_s']:>14}s {result['rss_idle_mb']:>8}MB "
+            f"{result['rss_after_thumbnail_mb']:>18}MB"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Server rendered device cards (templates/ui/card.html) and table rows (templates/ui/list-item.html), sent to the pages
+only when they change.
+
+Each device's fragment is keyed by a hash of what it is rendered from, and the last render per device is kept, so a
+device whose state is unchanged costs neither a Jinja render here nor any bytes on the wire: the page posts the hashes
+it already has and gets back only the fragments that differ, which it swaps in place.
+"""
+import hashlib
+import json
+
+VIEWS = {
+    "card": ("ui/card.html", "device_card"),
+    "row": ("ui/list-item.html", "device_row"),
+}
+
+
+def state_hash(device: dict) -> str:
+    payload = json.dumps(device, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class FragmentCache:
+    def __init__(self, env, icon_paths: list):
+        """
+        :param env: the Jinja environment, ie: Jinja2Templates().env
+        :param icon_paths: the icon templates a device may be decorated with, anything else is not included
+        """
+        self.env = env
+        self.icon_paths = list(icon_paths)
+        self.rendered = {view: {} for view in VIEWS}
+        self.stats = {"rendered": 0, "cached": 0, "unchanged": 0}
+
+    def _render(self, view: str, device: dict) -> str:
+        template, macro = VIEWS[view]
+        return str(getattr(self.env.get_template(template).module, macro)(device, self.icon_paths))
+
+    def fragments(self, view: str, devices: list, known: dict) -> dict:
+        """
+            The fragments a page is missing.
+
+        :param view: card or row
+        :param devices: the devices, as from /devices
+        :param known: device id -> hash of the fragment the page already shows
+        :return: the device ids in order, and {id: {"hash", "html"}} for the devices whose fragment differs from known
+        """
+        if view not in VIEWS:
+            raise ValueError(f"No {view} fragments, only {', '.join(VIEWS)}")
+        cache = self.rendered[view]
+        changed = {}
+        for device in devices:
+            serial = device["id"]
+            digest = state_hash(device)
+            if known.get(serial) == digest:
+                self.stats["unchanged"] += 1
+                continue
+            if serial in cache and cache[serial][0] == digest:
+                self.stats["cached"] += 1
+            else:
+                cache[serial] = (digest, self._render(view, device))
+                self.stats["rendered"] += 1
+            changed[serial] = {"hash": digest, "html": cache[serial][1]}
+
+        current = {device["id"] for device in devices}
+        for serial in [serial for serial in cache if serial not in current]:
+            del cache[serial]
+        return {"devices": [device["id"] for device in devices], "fragments": changed}
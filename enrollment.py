@@ -0,0 +1,113 @@
+"""
+Moving every USB attached headset onto wifi in one go, for setting up a rack of headsets on a USB hub.
+
+DeviceTracker follows the adb server's own device list (`host:track-devices`, pushed by adb whenever a device is
+plugged in, unplugged or authorised) so the USB headsets are always known without polling `adb devices`. Enrolling
+then onboards all of them at once through the onboarding pipeline, as one job with a status per headset.
+"""
+import asyncio
+import logging
+
+from tracing import span
+
+
+def parse_device_list(payload: str) -> dict:
+    """
+        `serial<TAB>state` lines -> {serial: state}
+    """
+    devices = {}
+    for line in payload.splitlines():
+        if "\t" in line:
+            serial, state = line.split("\t", 1)
+            devices[serial] = state.split()[0] if state else ""
+    return devices
+
+
+def is_usb(serial: str) -> bool:
+    return ":" not in serial and not serial.startswith("emulator-")
+
+
+class DeviceTracker:
+    def __init__(self, host: str, port: int, retry_s: float = 2):
+        """
+        :param host: the adb server's host
+        :param port: the adb server's port
+        :param retry_s: seconds to wait before reconnecting if the adb server goes away
+        """
+        self.host = host
+        self.port = port
+        self.retry_s = retry_s
+        self.devices = {}
+        self.changed = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self.changed = asyncio.Event()
+            self._task = asyncio.ensure_future(self._track())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _request(self, service: str):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(f"{len(service):04x}{service}".encode())
+        await writer.drain()
+        status = await reader.readexactly(4)
+        if status != b"OKAY":
+            length = int(await reader.readexactly(4), 16)
+            message = (await reader.readexactly(length)).decode(errors="replace")
+            writer.close()
+            raise RuntimeError(f"adb server refused {service}: {message}")
+        return reader, writer
+
+    @staticmethod
+    async def _read_message(reader) -> str:
+        length = int(await reader.readexactly(4), 16)
+        return (await reader.readexactly(length)).decode(errors="replace")
+
+    async def _track(self):
+        while True:
+            try:
+                reader, writer = await self._request("host:track-devices")
+                try:
+                    while True:
+                        devices = parse_device_list(await self._read_message(reader))
+                        if devices != self.devices:
+                            logging.info(f"adb devices changed: {devices}")
+                            self.devices = devices
+                            self.changed.set()
+                            self.changed = asyncio.Event()
+                finally:
+                    writer.close()
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError, RuntimeError, ValueError) as e:
+                logging.info(f"Lost the adb device tracker ({e}), retrying in {self.retry_s}s")
+                await asyncio.sleep(self.retry_s)
+
+    async def list_devices(self) -> dict:
+        """
+            The devices adb knows about: straight from the tracker when it is running, otherwise asked for once.
+        """
+        if self.running:
+            return dict(self.devices)
+        with span("host:devices", "adb"):
+            reader, writer = await self._request("host:devices")
+            try:
+                return parse_device_list(await self._read_message(reader))
+            finally:
+                writer.close()
+
+    async def usb_devices(self) -> dict:
+        """
+            USB attached devices and their state (device, unauthorized, offline...)
+        """
+        return {serial: state for serial, state in (await self.list_devices()).items() if is_usb(serial)}
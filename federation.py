@@ -0,0 +1,245 @@
+"""
+Federation: one simu-launch (the hub) fronting several others (peers), so a venue can spread its headsets over a few
+Pis and still run them from one page.
+
+SIMU_PEERS lists the peers' base urls, ie: `http://10.0.0.21:8000,http://10.0.0.22:8000`. The hub then:
+
+- merges its own /devices with every peer's, remembering which node each headset belongs to
+- splits /start, /stop, /load and /volume by node and sends each peer only its own headsets, all at once
+- proxies /device-screen for a peer's headsets to that peer
+- copies an APK to each peer once (checked by sha256) before asking it to install, rather than per headset
+
+Requests from the hub carry the X-Simu-Federated header and are never fanned out again, so two hubs listing each other
+can't loop.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from tracing import span, run_in_executor
+
+FEDERATED_HEADER = "X-Simu-Federated"
+PEER_TIMEOUT_S = float(os.environ.get("SIMU_PEER_TIMEOUT_S", 10))
+UPLOAD_TIMEOUT_S = float(os.environ.get("SIMU_PEER_UPLOAD_TIMEOUT_S", 600))
+
+
+def peers_from_env():
+    return [peer.strip().rstrip("/") for peer in os.environ.get("SIMU_PEERS", "").split(",") if peer.strip()]
+
+
+_hashes = {}
+
+
+def file_sha256(path: str) -> str:
+    """
+        The sha256 of a file, remembered until the file changes so large APKs are only hashed once.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if key not in _hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+def merge_results(results: dict) -> dict:
+    """
+        Combines the {"success": ..} replies of each node into one. Commands run as jobs give one job per node, their
+        ids are returned as "jobs", node name -> job id, to be followed at /jobs/{job_id}?node=<node name>.
+
+    :param results: node name -> that node's reply
+    """
+    merged = {"success": all(result.get("success") for result in results.values())}
+    errors = []
+    for node, result in results.items():
+        for key, value in result.items():
+            if key == "device_count":
+                merged["device_count"] = merged.get("device_count", 0) + value
+            elif key in ("error", "error_log", "fails", "errors"):
+                errors.append(f"{node}: {value}")
+            elif key == "job_id":
+                merged.setdefault("jobs", {})[node] = value
+            elif key != "success":
+                merged.setdefault(key, value)
+    if errors:
+        merged["error"] = ", ".join(errors)
+    merged["nodes"] = results
+    return merged
+
+
+def merge_devices(local: dict, peer_results: dict) -> dict:
+    """
+        Combines /devices from this node and each peer, tagging every headset with the node it belongs to (None for
+        this one).
+    """
+    devices = [dict(device, node=None) for device in local.get("devices", [])]
+    errs = list(local.get("errs", []))
+    for peer, result in peer_results.items():
+        if "devices" not in result:
+            errs.append(f"{peer}: {result.get('error', 'no reply')}")
+            continue
+        devices.extend(dict(device, node=peer) for device in result["devices"])
+        errs.extend(f"{peer}: {err}" for err in result.get("errs", []))
+    return {"devices": devices, "errs": errs}
+
+
+class Federation:
+    def __init__(self, peers: list = None, timeout: float = PEER_TIMEOUT_S):
+        """
+        :param peers: base urls of the peers, defaults to SIMU_PEERS
+        :param timeout: seconds to wait for a peer before reporting it as unreachable
+        """
+        self.peers = peers if peers is not None else peers_from_env()
+        self.timeout = timeout
+        self.device_nodes = {}
+        self._executor = None
+        self._staged = {}
+        self._staging = {}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max(4, len(self.peers) * 2), thread_name_prefix="peers")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def fans_out(self, request) -> bool:
+        """
+            Whether this request should be spread over the peers: only if there are any, and it didn't come from a hub.
+        """
+        return bool(self.peers) and FEDERATED_HEADER.lower() not in request.headers
+
+    def node_for(self, serial: str):
+        """
+            The peer a headset belongs to, or None if it is this node's (or not seen yet).
+        """
+        return self.device_nodes.get(serial)
+
+    def route(self, serials: list) -> dict:
+        """
+            Groups headsets by node, None being this node. An empty list means every headset, so every node gets one.
+        """
+        if not serials:
+            return {None: [], **{peer: [] for peer in self.peers}}
+        groups = {}
+        for serial in serials:
+            groups.setdefault(self.node_for(serial), []).append(serial)
+        return groups
+
+    # -- talking to peers ----------------------------------------------------------------------------------------
+
+    def _request(self, method: str, url: str, timeout: float = None, **kwargs):
+        headers = dict(kwargs.pop("headers", {}), **{FEDERATED_HEADER: "1"})
+        response = requests.request(method, url, headers=headers, timeout=timeout or self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def call(self, peer: str, method: str, path: str, **kwargs) -> dict:
+        """
+            Calls a peer, turning connection problems into a {"success": False} reply rather than raising.
+        """
+        with span(f"{method} {path}", "peer", peer=peer):
+            try:
+                return await run_in_executor(
+                    self.executor, lambda: self._request(method, peer + path, **kwargs)
+                )
+            except (requests.RequestException, ValueError) as e:
+                logging.info(f"Peer {peer} failed {method} {path}: {e}")
+                return {"success": False, "error": f"unreachable ({e.__class__.__name__})"}
+
+    async def devices(self, local: dict) -> dict:
+        peers = await asyncio.gather(*[self.call(peer, "GET", "/devices") for peer in self.peers])
+        merged = merge_devices(local, dict(zip(self.peers, peers)))
+        self.device_nodes = {device["id"]: device["node"] for device in merged["devices"] if device.get("node")}
+        return merged
+
+    async def fan_out(self, path: str, payload, run_local, before_peer=None) -> dict:
+        """
+            Runs a devices command across this node and the peers concurrently, each with only its own headsets.
+
+        :param path: the endpoint to post to on the peers, ie: /start
+        :param payload: the pydantic payload, its devices are split between the nodes
+        :param run_local: coroutine function running the command here, given the payload for this node's headsets
+        :param before_peer: optional coroutine function (peer) run before posting to a peer, ie: to stage an APK
+        """
+        groups = self.route(payload.devices)
+
+        async def on_peer(peer, devices):
+            if before_peer is not None:
+                staged = await before_peer(peer)
+                if not staged.get("success", True):
+                    return staged
+            return await self.call(peer, "POST", path, json=payload.copy(update={"devices": devices}).dict())
+
+        nodes = []
+        calls = []
+        for node, devices in groups.items():
+            nodes.append(node or "local")
+            if node is None:
+                calls.append(run_local(payload.copy(update={"devices": devices})))
+            else:
+                calls.append(on_peer(node, devices))
+        return merge_results(dict(zip(nodes, await asyncio.gather(*calls))))
+
+    async def stage_apk(self, peer: str, apk_path: str) -> dict:
+        """
+            Makes sure the peer has the APK, uploading it once if its copy is missing or different. Concurrent loads
+            to the same peer share the one upload.
+        """
+        name = os.path.basename(apk_path)
+        sha256 = await run_in_executor(self.executor, file_sha256, apk_path)
+        if self._staged.get((peer, name)) == sha256:
+            return {"success": True}
+
+        key = (peer, name, sha256)
+        if key not in self._staging:
+            self._staging[key] = asyncio.ensure_future(self._upload(peer, apk_path, name, sha256))
+            self._staging[key].add_done_callback(lambda _: self._staging.pop(key, None))
+        return await asyncio.shield(self._staging[key])
+
+    async def _upload(self, peer: str, apk_path: str, name: str, sha256: str) -> dict:
+        remote = await self.call(peer, "GET", f"/federation/apks/{name}")
+        if remote.get("sha256") != sha256:
+            logging.info(f"Staging {name} on {peer}")
+
+            def upload():
+                with open(apk_path, "rb") as f:
+                    return self._request(
+                        "PUT",
+                        f"{peer}/federation/apks/{name}",
+                        timeout=UPLOAD_TIMEOUT_S,
+                        data=f,
+                        headers={"X-Simu-Sha256": sha256},
+                    )
+
+            with span("stage apk", "peer", peer=peer, apk=name):
+                try:
+                    remote = await run_in_executor(self.executor, upload)
+                except (requests.RequestException, ValueError) as e:
+                    return {"success": False, "error": f"could not stage {name} ({e.__class__.__name__})"}
+            if not remote.get("success"):
+                return remote
+        self._staged[(peer, name)] = sha256
+        return {"success": True}
+
+    async def stage_experience(self, peer: str, details: dict) -> dict:
+        """
+            Copies an experience's launch details to a peer so it can start/stop it on its headsets.
+        """
+        if self._staged.get((peer, "details", details["apk_name"])) == details:
+            return {"success": True}
+        result = await self.call(peer, "POST", "/federation/experiences", json=details)
+        if result.get("success"):
+            self._staged[(peer, "details", details["apk_name"])] = details
+        return result
@@ -0,0 +1,95 @@
+"""
+Battery, current app, screen state and volume for every headset, gathered with one adb shell call per device.
+
+The UI used to call /battery and /current-experience separately for every device on every poll. /fleet-status asks all
+devices at once, concurrently, and keeps the answer for a couple of seconds so every open browser shares it.
+"""
+import asyncio
+import os
+import time
+
+from ppadb.client_async import ClientAsync
+
+from scheduler import DeviceScheduler, Priority
+from snapshots import Snapshot
+from tracing import span
+
+SEPARATOR = "--simu-launch--"
+
+STATUS_COMMAND = f"; echo {SEPARATOR}; ".join(
+    [
+        "dumpsys battery | grep level",
+        "dumpsys activity activities | grep ResumedActivity",
+        "dumpsys power | grep 'Display Power'",
+        "cmd media_session volume --stream 3 --get",
+    ]
+)
+
+FLEET_STATUS_TTL_S = float(os.environ.get("SIMU_FLEET_STATUS_TTL_S", 3))
+DEVICE_TIMEOUT_S = 5
+
+
+def parse_status(output: str) -> dict:
+    """
+        Parses the output of STATUS_COMMAND. Anything missing (older Android versions don't all support the media
+        session command) comes back as None.
+    """
+    sections = (output.split(SEPARATOR) + ["", "", "", ""])[:4]
+    battery_out, activity_out, power_out, volume_out = [section.strip() for section in sections]
+
+    battery = None
+    for line in battery_out.splitlines():
+        tokens = line.split(":")
+        if tokens[0].strip() == "level" and len(tokens) == 2 and tokens[1].strip().isdigit():
+            battery = int(tokens[1])
+
+    current_app = None
+    if activity_out:
+        tokens = activity_out.splitlines()[0].split(" ")
+        if len(tokens) >= 2:
+            current_app = tokens[-2].split("/")[0]
+
+    screen_on = None
+    if "state=" in power_out:
+        screen_on = power_out.split("state=")[1].split()[0] == "ON"
+
+    volume = None
+    if "volume is " in volume_out:
+        value = volume_out.split("volume is ")[1].split()[0]
+        volume = int(value) if value.isdigit() else None
+
+    return {"battery": battery, "current_app": current_app, "screen_on": screen_on, "volume": volume}
+
+
+class FleetStatus:
+    def __init__(self, client_async: ClientAsync, scheduler: DeviceScheduler, ttl: float = FLEET_STATUS_TTL_S):
+        self.client_async = client_async
+        self.scheduler = scheduler
+        self.snapshot = Snapshot(self._refresh, ttl)
+
+    async def get(self):
+        return await self.snapshot.get()
+
+    async def device_status(self, device) -> dict:
+        try:
+            output = await asyncio.wait_for(
+                self.scheduler.submit(device.serial, Priority.STATUS, device.shell, STATUS_COMMAND, key="fleet-status"),
+                DEVICE_TIMEOUT_S,
+            )
+        except asyncio.TimeoutError:
+            return {"serial": device.serial, "error": "timed out"}
+        except RuntimeError as e:
+            previous = (self.snapshot.value or {}).get("devices", {}).get(device.serial)
+            if previous and "error" not in previous:
+                return dict(previous, stale=True)
+            return {"serial": device.serial, "error": str(e)}
+        return {"serial": device.serial, **parse_status(output)}
+
+    async def _refresh(self):
+        with span("fleet status", "adb"):
+            try:
+                devices = await self.client_async.devices()
+            except RuntimeError as e:
+                return {"devices": {}, "updated_at": time.time(), "error": str(e)}
+            statuses = await asyncio.gather(*[self.device_status(device) for device in devices])
+        return {"devices": {status["serial"]: status for status in statuses}, "updated_at": time.time()}
@@ -0,0 +1,190 @@
+"""
+Thumbnails shared between uvicorn workers, so a headset is captured once however many workers its browsers talk to.
+
+Each headset gets a small ring of recent frames in a memory mapped file (in /dev/shm, so it never touches the SD card),
+which every worker maps. Whichever worker needs a fresh frame first takes the headset's capture lock and captures it;
+the others find the frame in the ring, or wait for the capture in progress rather than starting their own.
+
+Layout of a ring file:
+
+    HEADER                     magic, slot count, slot size, sequence number of the latest frame
+    slots x (SLOT + payload)   sequence, time, length, height and hash of the frame, then the frame itself
+
+Only the worker holding the capture lock writes, and readers take no lock at all: a slot's sequence is odd while it is
+being written and each reader checks it is the same (and even) before and after copying the frame out of the mapping,
+and checks the frame's hash, retrying if the writer got in the way. The writer moves on to the next slot for every
+frame, so it is rarely in the way.
+
+Enabled with SIMU_FRAME_RING=1, Linux only. SIMU_FRAME_MAX_AGE_S (default 1) is how old a frame may be and still be
+served instead of capturing a new one.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"SIMUFRM1"
+HEADER = struct.Struct("<8sIIQ")
+HEADER_BYTES = 64
+LATEST_OFFSET = 16
+SLOT = struct.Struct("<QdIIQ")
+SEQUENCE = struct.Struct("<Q")
+RING_DIR = os.environ.get("SIMU_FRAME_RING_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+MAX_AGE_S = float(os.environ.get("SIMU_FRAME_MAX_AGE_S", 1))
+
+Frame = namedtuple("Frame", ["sequence", "timestamp", "height", "payload"])
+
+
+def frame_digest(payload: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "little")
+
+
+def enabled() -> bool:
+    return os.environ.get("SIMU_FRAME_RING") == "1" and fcntl is not None
+
+
+class FrameRing:
+    def __init__(self, serial: str, directory: str = RING_DIR, slots: int = 4, slot_bytes: int = 256 * 1024):
+        """
+            Maps the headset's ring, creating it if this is the first worker to use it.
+
+        :param serial: the headset
+        :param directory: where ring files are kept, all workers must use the same
+        :param slots: frames kept, only used when creating the ring
+        :param slot_bytes: largest frame, only used when creating the ring
+        """
+        self.path = os.path.join(directory, f"simu-frames-{quote(serial, safe='')}")
+        if not os.path.exists(self.path):
+            self._create(directory, slots, slot_bytes)
+        self.fd = os.open(self.path, os.O_RDWR)
+        # captures of the headset in progress in this worker, the flock is taken by the first and dropped by the last
+        self.holders = 0
+        magic, self.slots, self.slot_bytes, _ = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        if magic != MAGIC:
+            os.close(self.fd)
+            raise ValueError(f"{self.path} is not a frame ring")
+        self.map = mmap.mmap(self.fd, HEADER_BYTES + self.slots * (SLOT.size + self.slot_bytes))
+
+    def _create(self, directory: str, slots: int, slot_bytes: int):
+        """
+            Makes the ring under another name and links it into place, so no worker ever maps a half made ring.
+        """
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix="simu-frames-new-")
+        try:
+            os.ftruncate(fd, HEADER_BYTES + slots * (SLOT.size + slot_bytes))
+            os.pwrite(fd, HEADER.pack(MAGIC, slots, slot_bytes, 0), 0)
+            os.link(temporary, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.close(fd)
+            os.remove(temporary)
+
+    def _slot_offset(self, sequence: int) -> int:
+        return HEADER_BYTES + (sequence % self.slots) * (SLOT.size + self.slot_bytes)
+
+    def latest_sequence(self) -> int:
+        return SEQUENCE.unpack_from(self.map, LATEST_OFFSET)[0]
+
+    def publish(self, payload: bytes, height: int, timestamp: float = None) -> int:
+        """
+            Writes a frame into the next slot. Only the holder of the capture lock may publish.
+
+        :return: the frame's sequence number, 0 if it was too big to share
+        """
+        if len(payload) > self.slot_bytes:
+            return 0
+        sequence = self.latest_sequence() + 1
+        offset = self._slot_offset(sequence)
+        SEQUENCE.pack_into(self.map, offset, 2 * sequence - 1)
+        self.map[offset + SLOT.size: offset + SLOT.size + len(payload)] = payload
+        SLOT.pack_into(
+            self.map, offset, 2 * sequence - 1, timestamp or time.time(), len(payload), height, frame_digest(payload)
+        )
+        SEQUENCE.pack_into(self.map, offset, 2 * sequence)
+        SEQUENCE.pack_into(self.map, LATEST_OFFSET, sequence)
+        return sequence
+
+    def latest(self, max_age: float = None, retries: int = 3) -> Frame:
+        """
+            The newest frame, without taking any lock.
+
+        :param max_age: seconds, an older frame counts as no frame
+        :param retries: attempts when the writer overwrote the frame while it was being read
+        :return: the Frame, or None
+        """
+        for _ in range(retries):
+            sequence = self.latest_sequence()
+            if sequence == 0:
+                return None
+            offset = self._slot_offset(sequence)
+            written, timestamp, length, height, digest = SLOT.unpack_from(self.map, offset)
+            if written != 2 * sequence or length > self.slot_bytes:
+                continue
+            payload = self.map[offset + SLOT.size: offset + SLOT.size + length]
+            if SEQUENCE.unpack_from(self.map, offset)[0] != written or frame_digest(payload) != digest:
+                continue
+            if max_age is not None and time.time() - timestamp > max_age:
+                return None
+            return Frame(sequence, timestamp, height, payload)
+        return None
+
+    def try_capture(self) -> bool:
+        """
+            Takes the headset's capture lock if no other worker has it. Never blocks.
+
+            The flock belongs to this worker's open file, so it can't tell two captures in the same worker (ie: of two
+            thumbnail heights) apart: they share it, and it is only let go when the last of them calls release_capture.
+        """
+        if self.holders == 0:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        self.holders += 1
+        return True
+
+    def release_capture(self):
+        if self.holders == 0:
+            return
+        self.holders -= 1
+        if self.holders == 0:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self.holders:
+            self.holders = 0
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.map.close()
+        os.close(self.fd)
+
+
+class FrameRings:
+    """
+        The rings this worker has mapped, one per headset.
+    """
+
+    def __init__(self, directory: str = RING_DIR, max_age: float = MAX_AGE_S):
+        self.directory = directory
+        self.max_age = max_age
+        self.rings = {}
+
+    def get(self, serial: str) -> FrameRing:
+        ring = self.rings.get(serial)
+        if ring is None:
+            ring = self.rings[serial] = FrameRing(serial, self.directory)
+        return ring
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
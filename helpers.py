@@ -1,11 +1,14 @@
 import asyncio
+import logging
 import os
 import time
 
 from ppadb.client import Client as AdbClient
 from ppadb.device import Device
 
+import apk_install
 from models_pydantic import Devices
+from tracing import traced
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 HOME_APP_VERSION = "0.1"
@@ -55,7 +58,7 @@ def process_devices(client: AdbClient, payload: Devices):
     return client.devices()
 
 
-def launch_app(device, app_name, d_type: bool = False, command: str = None):
+def launch_app(device, app_name, d_type: bool = False, command: str = None, package: str = None):
     """
         Launches an app on the specified device based on the device type and application name.
 
@@ -63,12 +66,16 @@ def launch_app(device, app_name, d_type: bool = False, command: str = None):
       :param app_name: the application name, ie: com.simu-launch.calculator
       :param d_type: the device type, True = Quest, False = Android
       :param command: the command
+      :param package: the package name read from the APK (see apk_manifest.py), used over app_name when known, in
+        which case command is the activity to start
       """
 
-    if ".apk" in app_name:
+    if package:
+        app_name = package
+    elif ".apk" in app_name:
         app_name = app_name[:-4]
 
-    if d_type == 1:
+    if d_type == 1 or (package and command):
         command = "am start -n " + app_name + "/" + command
     elif d_type == 2:
         command = "am start -n " + app_name
@@ -93,9 +100,54 @@ def home_app_installed(device: Device):
     return "Unable to find" not in home_app_installed_info
 
 
+SCREEN_OFF_TIMEOUT_MS = 60000 * 60 * 4  # 4 hours
+HOME_APP_PACKAGE = "com.TrajectoryTheatre.SimuLaunchHome"
+
+# the configuration last applied to each device by connect_actions, so reconnecting only changes what differs
+applied_configs = {}
+
+
+def desired_config(volume: int) -> dict:
+    config = {"volume": volume, "screen_off_timeout": SCREEN_OFF_TIMEOUT_MS}
+    if HOME_APP_ENABLED:
+        config["home_app_version"] = HOME_APP_VERSION
+    return config
+
+
+def config_commands(desired: dict, applied: dict) -> list:
+    """
+        The shell commands bringing a device from its applied configuration to the desired one, only for what differs.
+        The home app's version can't be set by a shell command, so for it the installed version is asked for instead.
+    """
+    commands = []
+    if "volume" in desired and desired["volume"] != applied.get("volume"):
+        commands.append(f"cmd media_session volume --stream 3 --set {desired['volume']}")
+    if "screen_off_timeout" in desired and desired["screen_off_timeout"] != applied.get("screen_off_timeout"):
+        commands.append(f"settings put system screen_off_timeout {desired['screen_off_timeout']}")
+    if "home_app_version" in desired and desired["home_app_version"] != applied.get("home_app_version"):
+        commands.append(f"dumpsys package {HOME_APP_PACKAGE} | grep versionName")
+    return commands
+
+
+def record_applied(serial: str, **values):
+    """
+        Notes settings changed on a device outside connect_actions, ie: the volume from /volume.
+    """
+    applied_configs.setdefault(serial, {}).update(values)
+
+
+def forget_applied_config(serial: str):
+    """
+        Forgets what was applied to a device, ie: once it has rebooted and lost its settings.
+    """
+    applied_configs.pop(serial, None)
+
+
+@traced("connect_actions", "adb")
 def connect_actions(device: Device = None, volume: int = None, ):
     """
-        Applies any actions defined here to a device on initial connection.
+        Applies any actions defined here to a device on initial connection. Only the settings that differ from what was
+        last applied to the device are sent, all in one shell call.
 
     :param device: the Device object for ppadb.
     :param volume: the volume to set on the device.
@@ -104,35 +156,37 @@ def connect_actions(device: Device = None, volume: int = None, ):
         if device is None:
             raise RuntimeError("No device present!")
 
-        from main import logging
-        logging.info("Performing initial connection setup..")
-
-        device.shell(f'cmd media_session volume --stream 3 --set {str(volume)}')
-
-        logging.info(f'Device volume set to {volume}!')
+        desired = desired_config(volume)
+        applied = applied_configs.get(device.serial, {})
+        commands = config_commands(desired, applied)
+        if not commands:
+            logging.info(f"Device {device.serial} already set up")
+            return
 
-        timeout_hours = 4
-        timeout = 60000 * 60 * timeout_hours  # 4 hours
-        device.shell(f'settings put system screen_off_timeout {timeout}')
-        logging.info(f'Device screen timout set to {timeout_hours} hours!')
+        logging.info(f"Performing connection setup on {device.serial}: {len(commands)} change(s)")
+        output = device.shell("; ".join(commands))
+        done = {key: value for key, value in desired.items() if key != "home_app_version"}
 
-        if HOME_APP_ENABLED:
-            if not home_app_installed(device):
+        if "home_app_version" in desired and desired["home_app_version"] != applied.get("home_app_version"):
+            installed = [line for line in output.splitlines() if "versionName=" in line]
+            if not installed:
                 logging.info("Home app not installed on device. Installing now..")
-                device.install("apks/" + HOME_APP_APK)
-
-            if HOME_APP_VERSION not in device.shell(
-                    "dumpsys package com.TrajectoryTheatre.SimuLaunchHome | grep versionName"):
+                apk_install.install(device, "apks/" + HOME_APP_APK)
+            elif HOME_APP_VERSION not in installed[0]:
                 logging.info("Installed Home app isn't the latest version. Updating now..")
-                device.install("apks/" + HOME_APP_APK)
+                apk_install.install(device, "apks/" + HOME_APP_APK)
 
-            device.shell("am start -n com.TrajectoryTheatre.SimuLaunchHome/com.unity3d.player.UnityPlayerActivity")
+            device.shell(f"am start -n {HOME_APP_PACKAGE}/com.unity3d.player.UnityPlayerActivity")
             logging.info("Launched home app!")
-            logging.info(f"Connect actions complete for {device.serial}")
+            done["home_app_version"] = HOME_APP_VERSION
+
+        record_applied(device.serial, **done)
+        logging.info(f"Connect actions complete for {device.serial}")
     except RuntimeError as e:
         return {"success": False, "error": "An error occured: " + e.__str__()}
 
 
+@traced("check_alive", "adb")
 async def check_alive(device, client: AdbClient):
     device_serial = device.serial
     if "." not in device_serial:
@@ -146,10 +200,8 @@ async def check_alive(device, client: AdbClient):
             return True
     except RuntimeError as e:
         err = e.__str__()
-        from main import logging
         logging.info("issue disconnecting disconnected wifi device (caution): " + err)
 
-    from main import logging
     logging.info(f'Device {device_serial} has failed to be pinged')
 
     return False
@@ -0,0 +1,261 @@
+"""
+The screencap -> thumbnail pipeline behind /device-screen.
+
+Each stage is its own function so it can be timed on its own (see benchmarks/bench_image_pipeline.py) and so new
+approaches (raw framebuffer, jpeg, hashing unchanged frames) can be compared stage by stage.
+
+ImageWorkerPool runs the pipeline away from the event loop: the screencap is an async subprocess and the decode /
+resize / encode work happens in a process pool, so producing thumbnails never holds up start/stop requests.
+
+OpenCV and NumPy are only imported once the first screencap is processed. They are most of the server's memory and a
+good part of its startup time, and plenty of venues never turn screenshots on.
+"""
+import asyncio
+import base64
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import frame_ring
+from adb_layer import adb_image_async, NoEndPointException
+from scheduler import Priority, CommandDropped
+from tracing import span, run_in_executor
+
+
+cv2 = None
+np = None
+
+
+def load_opencv():
+    global cv2, np
+    if cv2 is None:
+        with span("import opencv", "image"):
+            import cv2 as _cv2
+            import numpy as _np
+        cv2, np = _cv2, _np
+    return cv2
+
+
+def normalise_line_endings(raw: bytes) -> bytes:
+    """
+        Older adb shells translate \\n to \\r\\n which corrupts the png. Byte 5 of a png header is \\n, so if it has
+        become \\r the whole payload needs putting back.
+    """
+    if raw and len(raw) > 5 and raw[5] == 0x0d:
+        return raw.replace(b'\r\n', b'\n')
+    return raw
+
+
+def decode(raw: bytes):
+    load_opencv()
+    with span("imdecode", "image", bytes=len(raw)):
+        try:
+            return cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+        except cv2.error:
+            return None
+
+
+def crop_left_eye(image):
+    """
+        Quest screencaps contain both eyes side by side, we only show the left one.
+    """
+    return image[0: image.shape[0], 0: int(image.shape[1] * 0.5)]
+
+
+def resize_to_height(image, height: int):
+    width = int(image.shape[1] / image.shape[0] * height)
+    load_opencv()
+    with span("resize", "image"):
+        return cv2.resize(image, (width, height))
+
+
+def encode_png(image):
+    load_opencv()
+    with span("imencode", "image"):
+        _, encoded_img = cv2.imencode(".png", image)
+    return encoded_img
+
+
+def encode_jpeg(image, quality: int = 70) -> bytes:
+    load_opencv()
+    with span("imencode jpeg", "image"):
+        _, encoded_img = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded_img.tobytes()
+
+
+def png_to_jpeg(png: bytes, quality: int = 70) -> bytes:
+    """
+        Re-encodes a thumbnail as a (much smaller) JPEG, for screen_archive.py. None if it could not be decoded.
+    """
+    image = decode(png)
+    return None if image is None else encode_jpeg(image, quality)
+
+
+def to_base64(encoded_img) -> str:
+    return base64.b64encode(encoded_img).decode("utf-8")
+
+
+def process_screencap(raw: bytes, height: int):
+    """
+        Turns a raw `screencap -p` payload into a base64 png thumbnail of the given height.
+
+    :param raw: the bytes returned by screencap
+    :param height: the height in pixels of the thumbnail, the width follows the aspect ratio
+    :return: the base64 encoded png, or None if the screencap could not be decoded
+    """
+    if not raw:
+        return None
+    image = decode(normalise_line_endings(raw))
+    if image is None:
+        return None
+    image = resize_to_height(crop_left_eye(image), height)
+    return to_base64(encode_png(image))
+
+
+class ImageWorkerPool:
+    """
+        Produces thumbnails with bounded work and load-shedding:
+
+        - requests for a device that already has a thumbnail being made join that job instead of queueing another
+          screencap (the browser polls every refresh, so a queued job would be stale by the time it ran anyway)
+        - at most max_pending devices are worked on at once, beyond that requests are dropped (None is returned and the
+          page keeps showing the previous frame) rather than queueing up behind each other
+        - with several uvicorn workers and SIMU_FRAME_RING=1, frames are shared between them through frame_ring.py:
+          a recent enough frame from any worker is served as it is, and only one worker captures a headset at a time
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None, capture_timeout: float = None, scheduler=None,
+                 frame_rings: frame_ring.FrameRings = None):
+        """
+        :param workers: processes decoding/encoding images. 0 runs them on a thread instead, which avoids the extra
+            memory of worker processes on small Pis. Defaults to SIMU_IMAGE_WORKERS or cpu count - 1.
+        :param max_pending: how many thumbnails can be in progress at once, defaults to SIMU_IMAGE_MAX_PENDING or 8.
+        :param capture_timeout: seconds before a screencap is abandoned.
+        :param scheduler: a DeviceScheduler to run screencaps through at thumbnail priority, so they give way to
+            control commands for the same device.
+        :param frame_rings: shares frames with the other workers, defaults to doing so if SIMU_FRAME_RING=1
+        """
+        if workers is None:
+            workers = int(os.environ.get("SIMU_IMAGE_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+        if max_pending is None:
+            max_pending = int(os.environ.get("SIMU_IMAGE_MAX_PENDING", 8))
+        self.workers = workers
+        self.max_pending = max_pending
+        self.capture_timeout = capture_timeout or 8
+        self.scheduler = scheduler
+        self.frame_rings = frame_rings if frame_rings is not None else (
+            frame_ring.FrameRings() if frame_ring.enabled() else None
+        )
+        self._executor = None
+        self._in_progress = {}
+        self.stats = {"produced": 0, "coalesced": 0, "shed": 0, "failed": 0, "shared": 0}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.workers:
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix="images")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.frame_rings is not None:
+            self.frame_rings.close()
+
+    async def thumbnail(self, device_serial: str, height: int):
+        """
+            A base64 png thumbnail of the device's screen, or None if it could not be made (or was shed).
+        """
+        if self.frame_rings is not None:
+            frame = self.frame_rings.get(device_serial).latest(self.frame_rings.max_age)
+            if frame is not None and frame.height == height:
+                self.stats["shared"] += 1
+                return frame.payload.decode()
+
+        key = (device_serial, height)
+        job = self._in_progress.get(key)
+        if job is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(job)
+
+        if len(self._in_progress) >= self.max_pending:
+            self.stats["shed"] += 1
+            return None
+
+        job = asyncio.ensure_future(self._produce(device_serial, height))
+        self._in_progress[key] = job
+        job.add_done_callback(lambda _: self._in_progress.pop(key, None))
+        return await asyncio.shield(job)
+
+    async def _produce(self, device_serial: str, height: int):
+        if self.frame_rings is None:
+            return await self._capture(device_serial, height)
+        ring = self.frame_rings.get(device_serial)
+        if not ring.try_capture():
+            return await self._wait_for_frame(ring, height)
+        try:
+            image = await self._capture(device_serial, height)
+            if image is not None:
+                ring.publish(image.encode(), height)
+            return image
+        finally:
+            ring.release_capture()
+
+    async def _wait_for_frame(self, ring: frame_ring.FrameRing, height: int):
+        """
+            Another worker is capturing the headset, its frame is waited for rather than capturing it again.
+        """
+        sequence = ring.latest_sequence()
+        deadline = time.monotonic() + self.capture_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            if ring.latest_sequence() != sequence:
+                break
+            if ring.try_capture():
+                # the other worker gave up without a frame
+                ring.release_capture()
+                break
+        frame = ring.latest()
+        if frame is None or frame.height != height:
+            return None
+        self.stats["shared"] += 1
+        return frame.payload.decode()
+
+    async def _capture(self, device_serial: str, height: int):
+        try:
+            if self.scheduler is not None:
+                raw = await self.scheduler.submit(
+                    device_serial, Priority.THUMBNAIL, adb_image_async, device_serial, timeout=self.capture_timeout
+                )
+            else:
+                raw = await adb_image_async(device_serial, timeout=self.capture_timeout)
+        except CommandDropped:
+            self.stats["shed"] += 1
+            return None
+        except NoEndPointException:
+            raw = None
+        if not raw:
+            self.stats["failed"] += 1
+            return None
+
+        with span("process_screencap", "image", serial=device_serial, bytes=len(raw)):
+            executor = self.executor
+            try:
+                image = await run_in_executor(executor, process_screencap, raw, height)
+            except BrokenProcessPool:
+                # other captures sent to the same pool may have replaced it already
+                if self._executor is executor:
+                    logging.warning("Image worker pool broke, starting a new one")
+                    # its management thread and any workers still alive would otherwise be left behind
+                    executor.shutdown(wait=False)
+                    self._executor = None
+                image = None
+
+        self.stats["failed" if image is None else "produced"] += 1
+        return image
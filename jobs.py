@@ -0,0 +1,313 @@
+"""
+Long running fleet operations (installs, onboarding) as jobs.
+
+The endpoint starting one creates the job and returns its id straight away, the work carries on in the background and
+its state is kept in the database, per device:
+
+    queued -> running -> done | failed
+
+so it can be followed from /jobs/{id} (or streamed from /jobs/{id}/stream) and still be there after a restart. Jobs
+that were unfinished when the server stopped are picked up again on startup, skipping the devices already done.
+
+With several workers on one database each job is run by one of them only: the worker running a job holds a lease on it
+("job:<id>" in the shared state backend, renewed while it runs), and a worker resuming jobs leaves those another holds.
+A job whose worker died is taken over once its lease has expired, by the next resume. A renewal that fails (ie: the
+database is locked) is tried again while the lease lasts, and a worker that lost the lease all the same stops the job,
+so it never starts more device work alongside the worker taking it over.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+
+from sql_app import crud
+from state_backend import NODE_ID, LEASE_TTL_S
+
+FINISHED = ("done", "failed")
+
+
+def job_to_dict(job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "message": job.message,
+        "finished": job.status in FINISHED,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "devices": [
+            {"serial": device.serial, "status": device.status, "message": device.message, "progress": device.progress}
+            for device in job.devices
+        ],
+    }
+
+
+class JobContext:
+    """
+        What a job handler gets: the job's parameters and ways to report how it is going.
+    """
+
+    def __init__(self, queue: "JobQueue", job_id: int, params: dict, devices: dict):
+        self.queue = queue
+        self.id = job_id
+        self.params = params
+        self.devices = devices
+
+    def update(self, serial: str, status: str, message: str = None, progress: int = None):
+        self.devices[serial] = status
+        self.queue.write(crud.update_job_device, self.id, serial, status, message, progress)
+
+    def message(self, text: str):
+        self.queue.write(crud.update_job, self.id, "running", text)
+
+    def transfer_progress(self, serial: str):
+        """
+            A progress(bytes sent, total bytes) callback for sending files to a device from another thread. Shows the
+            percentage and speed as the device's message, at most once a second.
+        """
+        loop = asyncio.get_running_loop()
+        started = reported = time.perf_counter()
+
+        def progress(sent: int, total: int):
+            nonlocal reported
+            now = time.perf_counter()
+            if now - reported < 1 or sent >= total:
+                return
+            reported = now
+            rate = sent / 1024 / 1024 / max(now - started, 0.001)
+            loop.call_soon_threadsafe(
+                self.update, serial, "running", f"{sent * 100 // total}% at {rate:.1f}MB/s", sent * 100 // total
+            )
+
+        return progress
+
+    async def each_device(self, func):
+        """
+            Runs func(serial) for every device not already done, all at once. Whatever it returns becomes the device's
+            message, an exception marks the device as failed.
+        """
+
+        async def run(serial):
+            self.update(serial, "running")
+            try:
+                outcome = await func(serial)
+            except Exception as e:
+                logging.info(f"Job {self.id} failed on {serial}: {e}")
+                self.update(serial, "failed", str(e))
+                return
+            self.update(serial, "done", str(outcome or ""), 100)
+
+        await asyncio.gather(*[run(serial) for serial, status in self.devices.items() if status != "done"])
+
+
+class JobQueue:
+    def __init__(self, session_factory, workers: int = None, state=None, owner: str = NODE_ID,
+                 lease_ttl: float = LEASE_TTL_S):
+        """
+        :param session_factory: makes database sessions, ie: SessionLocal
+        :param workers: how many jobs run at once, further jobs wait their turn. Defaults to SIMU_JOB_WORKERS or 4.
+        :param state: the StateBackend jobs are leased in, None when this is the only process running jobs
+        :param owner: the name this queue holds job leases under
+        :param lease_ttl: seconds a job's lease lasts if its worker stops renewing it
+        """
+        self.session_factory = session_factory
+        self.workers = workers or int(os.environ.get("SIMU_JOB_WORKERS", 4))
+        self.state = state
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.handlers = {}
+        # jobs this queue has started and not finished, never started twice
+        self.running = set()
+        # per event loop, the semaphore limiting how many jobs run at once on it
+        self._slots = weakref.WeakKeyDictionary()
+
+    def handler(self, kind: str):
+        """
+            Registers the coroutine function running jobs of this kind, it is given a JobContext.
+        """
+
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+
+        return decorator
+
+    def write(self, func, *args):
+        db = self.session_factory()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+
+    def submit(self, kind: str, params: dict, serials: list) -> dict:
+        """
+            Stores a new job and starts it in the background.
+
+        :return: the job, as returned by /jobs/{id}
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"No handler for {kind} jobs")
+        db = self.session_factory()
+        try:
+            job = crud.create_job(db, kind, params, serials)
+            result = job_to_dict(job)
+        finally:
+            db.close()
+        self._start(result["id"])
+        return result
+
+    async def resume(self):
+        """
+            Restarts the jobs that were queued or running when the server last stopped, or whose worker died, other
+            than those another worker holds the lease on.
+
+        :return: the ids of the jobs restarted
+        """
+        db = self.session_factory()
+        try:
+            unfinished = [job.id for job in crud.get_unfinished_jobs(db) if job.id not in self.running]
+        finally:
+            db.close()
+        resumed = []
+        for job_id in unfinished:
+            if await self._claim(job_id):
+                logging.info(f"Resuming job {job_id}")
+                self._start(job_id, claimed=True)
+                resumed.append(job_id)
+        return resumed
+
+    def get(self, job_id: int):
+        db = self.session_factory()
+        try:
+            job = crud.get_job(db, job_id)
+            return job_to_dict(job) if job else None
+        finally:
+            db.close()
+
+    def recent(self, limit: int = 20):
+        db = self.session_factory()
+        try:
+            return [job_to_dict(job) for job in crud.get_recent_jobs(db, limit)]
+        finally:
+            db.close()
+
+    async def stream(self, job_id: int, interval: float = 0.5):
+        """
+            Server-sent events with the job's state every time it changes, ending once it has finished.
+        """
+        last = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                yield f"data: {json.dumps({'id': job_id, 'error': 'No such job'})}\n\n"
+                return
+            body = json.dumps(job)
+            if body != last:
+                yield f"data: {body}\n\n"
+                last = body
+            if job["finished"]:
+                return
+            await asyncio.sleep(interval)
+
+    def _start(self, job_id: int, claimed: bool = False):
+        self.running.add(job_id)
+        task = asyncio.ensure_future(self._run(job_id, claimed))
+        task.add_done_callback(self._log_crash)
+        task.add_done_callback(lambda _: self.running.discard(job_id))
+        return task
+
+    async def _claim(self, job_id: int) -> bool:
+        """
+            Takes or renews the lease on a job, on a thread as the backend may wait on other workers.
+
+        :return: True if this queue may run it
+        """
+        if self.state is None:
+            return True
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.state.acquire_lease, f"job:{job_id}", self.owner, self.lease_ttl
+        )
+
+    async def _keep_claim(self, job_id: int, work: asyncio.Future):
+        """
+            Renews the lease on a job while it runs, cancelling the work once the lease is lost.
+
+        :param work: the task running the job
+        """
+        renewed = time.monotonic()
+        wait = self.lease_ttl / 3
+        while not work.done():
+            await asyncio.sleep(wait)
+            try:
+                held = await self._claim(job_id)
+            except Exception as e:
+                logging.info(f"Renewing the lease on job {job_id} failed: {e}")
+                held = None
+            if held:
+                renewed = time.monotonic()
+                wait = self.lease_ttl / 3
+                continue
+            left = renewed + self.lease_ttl - time.monotonic()
+            if held is False or left <= 0:
+                logging.warning(f"Lost the lease on job {job_id}, stopping it")
+                work.cancel()
+                return
+            # try again before the lease runs out
+            wait = min(self.lease_ttl / 10, left)
+
+    @staticmethod
+    def _log_crash(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logging.info(f"Job runner crashed: {task.exception()}")
+
+    def _get_slots(self):
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(self.workers)
+        return slots
+
+    async def _run(self, job_id: int, claimed: bool = False):
+        if not claimed and not await self._claim(job_id):
+            return
+        if self.state is None:
+            return await self._run_claimed(job_id)
+        work = asyncio.ensure_future(self._run_claimed(job_id))
+        keep_claim = asyncio.ensure_future(self._keep_claim(job_id, work))
+        try:
+            await asyncio.wait([work])
+        finally:
+            work.cancel()
+            keep_claim.cancel()
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.state.release_lease, f"job:{job_id}", self.owner
+            )
+        if not work.cancelled():
+            work.result()
+
+    async def _run_claimed(self, job_id: int):
+        async with self._get_slots():
+            db = self.session_factory()
+            try:
+                job = crud.get_job(db, job_id)
+                kind, params = job.kind, json.loads(job.params or "{}")
+                devices = {device.serial: device.status for device in job.devices}
+                job.status = "running"
+                db.commit()
+            finally:
+                db.close()
+
+            context = JobContext(self, job_id, params, devices)
+            try:
+                message = await self.handlers[kind](context)
+            except Exception as e:
+                logging.info(f"Job {job_id} ({kind}) failed: {e}")
+                self.write(crud.update_job, job_id, "failed", str(e))
+                return
+
+            failed = [serial for serial, status in context.devices.items() if status == "failed"]
+            if failed:
+                message = message or f"Failed on {len(failed)} of {len(context.devices)} devices"
+            self.write(crud.update_job, job_id, "failed" if failed else "done", message)
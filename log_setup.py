@@ -0,0 +1,169 @@
+"""
+Logging that never holds up the event loop.
+
+Records are put on a queue by the code logging them and written to the console and to the log file by a background
+thread, so a slow SD card, or rotating the log file, only ever delays that thread. Should the queue ever fill up,
+records are dropped (and counted) rather than waited on.
+
+The log file holds one JSON object per line, carrying the headset serial and the action when the record was logged
+while working on one (see log_context, the DeviceScheduler sets them for every adb command), so a headset's history can
+be pulled out with grep or jq. Its size is capped for flash storage: SIMU_LOG_MAX_BYTES per file (default 512KB),
+SIMU_LOG_BACKUPS old files kept (default 4). SIMU_LOG_FILE moves it (default api.log) and SIMU_LOG_FORMAT=text writes
+the old plain text lines instead.
+"""
+import atexit
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = "%(asctime)s - %(module)s - %(funcName)s - line:%(lineno)d - %(levelname)s - %(message)s"
+QUEUE_SIZE = 10000
+
+_serial = contextvars.ContextVar("simu_log_serial", default=None)
+_action = contextvars.ContextVar("simu_log_action", default=None)
+_listeners = {}
+
+
+@contextmanager
+def log_context(serial: str = None, action: str = None):
+    """
+        Tags everything logged within, including from threads started through tracing.run_in_executor, with the
+        headset and what is being done to it.
+    """
+    tokens = []
+    if serial is not None:
+        tokens.append((_serial, _serial.set(serial)))
+    if action is not None:
+        tokens.append((_action, _action.set(action)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+        Copies the log context onto records as they are made, while still in the context that logged them. Values
+        given explicitly, ie: logging.info(..., extra={"serial": serial}), are kept.
+    """
+
+    def filter(self, record):
+        if getattr(record, "serial", None) is None:
+            record.serial = _serial.get()
+        if getattr(record, "action", None) is None:
+            record.action = _action.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage(),
+            "serial": getattr(record, "serial", None),
+            "action": getattr(record, "action", None),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps({key: value for key, value in entry.items() if value is not None}, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+        A QueueHandler that drops records when the queue is full rather than raising.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formats the message now, so arguments that change later (or can't cross threads) are not a problem
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(logger: logging.Logger = None, log_file: str = None, max_bytes: int = None, backups: int = None,
+                  json_lines: bool = None, console: bool = True) -> DroppingQueueHandler:
+    """
+        Sends a logger's records through a queue to a background writer. Calling it again replaces the earlier setup.
+
+    :param logger: defaults to the root logger
+    :param log_file: defaults to SIMU_LOG_FILE or api.log, "" for no file
+    :param max_bytes: size a log file is rotated at, defaults to SIMU_LOG_MAX_BYTES or 512KB
+    :param backups: rotated files kept, defaults to SIMU_LOG_BACKUPS or 4
+    :param json_lines: JSON or plain text in the log file, defaults to JSON unless SIMU_LOG_FORMAT=text
+    :param console: also write plain text to the console
+    :return: the handler records are queued through, its dropped count says how many were lost
+    """
+    logger = logger if logger is not None else logging.getLogger()
+    log_file = log_file if log_file is not None else os.environ.get("SIMU_LOG_FILE", "api.log")
+    max_bytes = max_bytes or int(os.environ.get("SIMU_LOG_MAX_BYTES", 512 * 1024))
+    backups = backups if backups is not None else int(os.environ.get("SIMU_LOG_BACKUPS", 4))
+    if json_lines is None:
+        json_lines = os.environ.get("SIMU_LOG_FORMAT", "json") != "text"
+
+    stop_logging(logger)
+    handlers = []
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(console_handler)
+    if log_file:
+        file_handler = RotatingFileHandler(log_file, mode="a", maxBytes=max_bytes, backupCount=backups, delay=True)
+        file_handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners[logger.name] = (listener, queue_handler)
+    logger.addHandler(queue_handler)
+    return queue_handler
+
+
+def stop_logging(logger: logging.Logger = None):
+    """
+        Writes out whatever is still queued and detaches the background writer.
+    """
+    logger = logger if logger is not None else logging.getLogger()
+    listener, queue_handler = _listeners.pop(logger.name, (None, None))
+    if listener is None:
+        return
+    logger.removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+@atexit.register
+def _flush_at_exit():
+    for name in list(_listeners):
+        stop_logging(logging.getLogger(name) if name != "root" else logging.getLogger())
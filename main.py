@@ -1,62 +1,74 @@
 import asyncio
-import base64
 import datetime
+import hashlib
 import json
-import multiprocessing
 import subprocess
 import os
 import platform
+import tempfile
 import time
 from collections import Counter
 from functools import partial, wraps
-from logging.handlers import RotatingFileHandler
-from multiprocessing import Process, Pool, cpu_count
+from typing import Dict, List
 
-import cv2
-import numpy as np
 import logging
-from fastapi import FastAPI, UploadFile, File, Form, Depends
+from fastapi import FastAPI, UploadFile, File, Form, Depends, Body, Query
 from fastapi.encoders import jsonable_encoder
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
-from fastapi_cache.decorator import cache
 from fastapi_utils.tasks import repeat_every
-from ppadb import InstallError
 from ppadb.client import Client as AdbClient
 from ppadb.client_async import ClientAsync as AdbClientAsync
 from ppadb.device import Device
 from ppadb.device_async import DeviceAsync
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from starlette.background import BackgroundTasks
 from starlette.requests import Request
-from starlette.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, Response, StreamingResponse, FileResponse
 from starlette.templating import Jinja2Templates
 
+import log_setup
+import apk_install
+import apk_manifest
+import apk_pull
+import obb_sync
+import state_backend
+import tracing
+from tracing import span, traced
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-ch = logging.StreamHandler()
-
-fh = RotatingFileHandler("api.log",mode="a",maxBytes = 100*1024, backupCount = 3)
-formatter = logging.Formatter(
-    "%(asctime)s - %(module)s - %(funcName)s - line:%(lineno)d - %(levelname)s - %(message)s"
-)
-
-ch.setFormatter(formatter)
-fh.setFormatter(formatter)
-logger.addHandler(ch) #Exporting logs to the screen
-logger.addHandler(fh) #Exporting logs to a file
-
-from adb_layer import adb_image
+# to the screen and to api.log, from a background thread so a slow SD card never stalls a request, see log_setup.py
+log_handler = log_setup.setup_logging(logger)
+
+# SIMU_LOW_MEMORY=1 is for Pi Zeros and small Pis: thumbnails are made on a thread rather than in worker processes and
+# fewer threads wait on adb. Any of the individual settings can still be given explicitly.
+if os.environ.get("SIMU_LOW_MEMORY") == "1":
+    os.environ.setdefault("SIMU_IMAGE_WORKERS", "0")
+    os.environ.setdefault("SIMU_ADB_THREADS", "8")
+    os.environ.setdefault("SIMU_JOB_WORKERS", "2")
+
+from image_pipeline import ImageWorkerPool
+from scheduler import scheduler, Priority
+from fleet_status import FleetStatus
+from federation import Federation, file_sha256
+from jobs import JobQueue, JobContext
+from onboarding import Onboarding
+from enrollment import DeviceTracker
+from reconnect import ReconnectSupervisor, RECONNECT_INTERVAL_S
+from reconcile import Reconciler, RECONCILE_INTERVAL_S
+from snapshots import Snapshot
+from card_fragments import FragmentCache
+from screen_archive import ScreenArchive
+from static_assets import StaticAssets, AssetFiles
 from helpers import (
     launch_app,
     save_file,
     process_devices,
     connect_actions,
     HOME_APP_APK,
-    home_app_installed, HOME_APP_ENABLED, check_alive, wait_host_port,
+    home_app_installed, HOME_APP_ENABLED, check_alive, record_applied,
 )
-from models_pydantic import Volume, Devices, Experience, NewExperience, StartExperience
+from models_pydantic import Volume, Devices, Experience, NewExperience, StartExperience, FleetProfile, FolderSync
 from sql_app import models, crud
 from sql_app.crud import (
     get_all_apk_details,
@@ -66,17 +78,21 @@ from sql_app.crud import (
     crud_defaults,
 )
 from sql_app.database import engine, SessionLocal
-from sql_app.schemas import APKDetailsCreate, APKDetailsBase
+from sql_app.schemas import APKDetailsCreate, APKDetailsBase, APKDetails
 
-models.Base.metadata.create_all(bind=engine)
+tracing.instrument_engine(engine)
+tracing.instrument_ppadb()
 
 app = FastAPI()
+app.add_middleware(tracing.TraceMiddleware)
 location = "/home/simu-launch/" if "Linux" in platform.system().lower() else ""
-app.mount("/static", StaticFiles(directory=location + "static"), name="static")
+static_assets = StaticAssets(location + "static")
+app.mount("/static", AssetFiles(static_assets), name="static")
 templates = Jinja2Templates(directory=location + "templates")
+templates.env.globals["static_url"] = static_assets.url
 
-simu_application_name = ""
-global_volume = 10
+# shared between workers/nodes, see state_backend.py
+state = state_backend.from_url()
 
 screenshots_enabled: int = 0
 manual_screenshots_enabled: int = 0
@@ -101,9 +117,29 @@ defaults = {
     "screenshots_enabled": screenshots_enabled,
     "manual_screenshots_enabled": manual_screenshots_enabled,
 }
-crud_defaults(SessionLocal(), defaults)
 
-FastAPICache.init(InMemoryBackend())
+
+@app.on_event("startup")
+def init_db():
+    """
+        Creates any missing tables and reads the settings. Done at startup rather than on import so the server is
+        listening sooner after a Pi boots, and must stay the first startup hook as the others use the database.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    current_defaults()
+
+
+def current_defaults():
+    """
+        Settings can be changed through another worker, so pages re-read them rather than trusting this process's copy.
+    """
+    db = SessionLocal()
+    try:
+        crud_defaults(db, defaults)
+    finally:
+        db.close()
+    return defaults
+
 
 def get_db():
     db = SessionLocal()
@@ -115,14 +151,77 @@ def get_db():
 
 BASE_PORT = 5555
 
-client: AdbClient = AdbClient(host="127.0.0.1", port=5037)
-client_async: AdbClientAsync = AdbClientAsync(host="127.0.0.1", port=5037)
+# ANDROID_ADB_SERVER_PORT is the variable the adb binary itself uses, so both always talk to the same server
+ADB_HOST = os.environ.get("ADB_SERVER_HOST", "127.0.0.1")
+ADB_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+
+client: AdbClient = AdbClient(host=ADB_HOST, port=ADB_PORT)
+client_async: AdbClientAsync = AdbClientAsync(host=ADB_HOST, port=ADB_PORT)
+
+# other simu-launch nodes this one fronts, see federation.py
+federation = Federation()
+
+# installs and onboarding, see jobs.py
+jobs = JobQueue(SessionLocal, state=state)
+
+
+@app.on_event("startup")
+@repeat_every(seconds=state_backend.LEASE_TTL_S)
+async def resume_jobs():
+    """
+        Carries on the jobs left unfinished by the last run, or by a worker that died, once no other worker holds them.
+    """
+    await jobs.resume()
+
+
+def read_missing_manifests():
+    """
+        Fills in the manifest details of experiences uploaded before they were read at upload.
+    """
+    db = SessionLocal()
+    try:
+        for item in get_all_apk_details(db, limit=None):
+            path = os.path.join("apks", item.apk_name or "")
+            if item.package_name is None and os.path.isfile(path):
+                try:
+                    crud.set_apk_manifest(db, item, apk_manifest.read_apk(path))
+                except ValueError as e:
+                    logging.info(f"Could not read the manifest of {item.apk_name}: {e}")
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+async def backfill_apk_manifests():
+    in_background(asyncio.get_running_loop().run_in_executor(None, read_missing_manifests))
+
+
+@app.on_event("startup")
+async def build_static_assets():
+    """
+        Compresses the static files in the background, so the first page load after an update doesn't wait for it.
+    """
+    in_background(asyncio.get_running_loop().run_in_executor(None, static_assets.build))
 
 
 def is_wireless(serial):
     return '.' in serial
 
 
+def in_background(awaitable):
+    """
+        Runs an awaitable without waiting for it, logging rather than losing any error it raises.
+    """
+
+    def log_failure(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logging.info(f"Background task failed: {task.exception()}")
+
+    task = asyncio.ensure_future(awaitable)
+    task.add_done_callback(log_failure)
+    return task
+
+
 def shell_command(device_id: str, command):
     outcome = subprocess.run([f"adb", '-s', f"{device_id } '{command}'"], stdout=subprocess.PIPE).stdout.decode('ascii')
     return outcome
@@ -137,14 +236,18 @@ async def wake():
     my_devices = [device for device in my_devices if is_wireless(device.serial)]
     count = 0
     devices_count = len(my_devices)
+    leased = await tracing.run_in_executor(None, state.leased, [device.serial for device in my_devices])
 
     for device in my_devices:
         count += 1
+        if device.serial not in leased:
+            continue
         if not await check_alive(device, client):
             continue
-        screen_state = subprocess.run([f"adb", '-s', device.serial, "shell", "dumpsys",
-                                  "power", "|", 'grep', "\'Display Power: state=OFF\'"],
-                                 stdout=subprocess.PIPE).stdout.decode('ascii')
+        with span("dumpsys power", "subprocess", serial=device.serial):
+            screen_state = subprocess.run([f"adb", '-s', device.serial, "shell", "dumpsys",
+                                      "power", "|", 'grep', "\'Display Power: state=OFF\'"],
+                                     stdout=subprocess.PIPE).stdout.decode('ascii')
 
         screen_state_off = len(screen_state) > 0
         if screen_state_off:
@@ -155,8 +258,10 @@ async def wake():
             logging.info(f'{count}/{devices_count} Screen already on with device {device.serial}')
 
 
+@traced("scan_devices", "adb")
 async def scan_devices():
-    outcome = subprocess.run(["adb", "devices"], stdout=subprocess.PIPE).stdout.decode('ascii')
+    with span("adb devices", "subprocess"):
+        outcome = subprocess.run(["adb", "devices"], stdout=subprocess.PIPE).stdout.decode('ascii')
     alive = [serial.split('\t')[0] for serial in outcome.splitlines()[1:] if 'offline' not in serial and serial]
     my_devices = [client.device(serial) for serial in alive]
     return my_devices
@@ -188,50 +293,117 @@ async def settings(screen_updates: int = Form(...), db: Session = Depends(get_db
     return {"success": True}
 
 
+async def _device_info(device: Device, db: Session):
+    device_info = {
+        "message": "",
+        "id": "",
+        "icon": "",
+    }
+    try:
+        serial = str(device.serial)
+        my_device_icon = get_device_decorations(db, serial)
+        device_info["id"] = serial
+        device_info["icon"] = my_device_icon
+        device_info["ip"] = len(serial.split(".")) >= 2
+
+    except RuntimeError as e:
+        return device_info, str(e)
+    try:
+        if await check_alive(device, client):
+            await tracing.run_in_executor(scheduler.executor, device.get_state)
+        elif reconnector.is_down(serial):
+            device_info["message"] = "<small>Wifi issue! Reconnecting automatically...</small>"
+        else:
+            device_info["message"] = f"<small>Wifi issue! Please <button class='btn btn-outline-info' " \
+                                     f"onclick='disconnectSingleDevice(\"{device.serial}\")'>click to remove" \
+                                     f"</button> the device or try and fix the problem.</small>"
+    except RuntimeError as e:
+        if "unauthorized" in str(e):
+            device_info["message"] = "Unauthorised"
+        if "disconnected" in str(e):
+            device_info["message"] = "Disconnected"
+    return device_info, None
+
+
+async def _scan_devices_info():
+    _devices = []
+    errs = []
+
+    db = SessionLocal()
+    try:
+        results = await asyncio.gather(*[_device_info(device, db) for device in await scan_devices()])
+    finally:
+        db.close()
+
+    for device_info, err in results:
+        if err:
+            errs.append(err)
+        _devices.append(device_info)
+
+    return {"devices": _devices, "errs": errs}
+
+
+devices_snapshot = Snapshot(
+    _scan_devices_info,
+    ttl=check_for_new_devices_poll_s,
+    stale_ttl=int(os.environ.get("SIMU_DEVICES_STALE_S", 30)),
+)
+
+
+async def _federated_devices_info():
+    return await federation.devices(await devices_snapshot.get())
+
+
+federated_devices_snapshot = Snapshot(
+    _federated_devices_info,
+    ttl=check_for_new_devices_poll_s,
+    stale_ttl=int(os.environ.get("SIMU_DEVICES_STALE_S", 30)),
+)
+
+
+def invalidate_devices():
+    devices_snapshot.invalidate()
+    federated_devices_snapshot.invalidate()
+
+
 @app.get("/devices")
-@cache(expire=check_for_new_devices_poll_s)
-async def devices(db: Session = Depends(get_db)):
+async def devices(request: Request):
     """
         Gets a list of all devices connected via ADB.
 
+        The list is shared between every caller: only one scan of the devices runs at a time, a slightly old list is
+        served while a new one is gathered, and browsers polling with If-None-Match get a 304 when nothing changed.
+        With peers configured the peers' devices are included, each tagged with the node it belongs to.
+
     :return: a dict object containing a list of devices and any errors.
     """
+    snapshot = federated_devices_snapshot if federation.fans_out(request) else devices_snapshot
+    payload = await snapshot.get()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
 
-    _devices = []
-    errs = []
 
-    device: Device
-    for device in await scan_devices():
-        device_info = {
-            "message": "",
-            "id": "",
-            "icon": "",
-        }
-        try:
-            serial = str(device.serial)
-            my_device_icon = get_device_decorations(db, serial)
-            device_info["id"] = serial
-            device_info["icon"] = my_device_icon
-            device_info["ip"] = len(serial.split(".")) >= 2
+fragment_cache = FragmentCache(templates.env, [f"icons/{icon}.svg" for icon in icons])
 
-        except RuntimeError as e:
-            errs.append(str(e))
-        try:
-            if await check_alive(device, client):
-                device.get_state()
-            else:
-                device_info["message"] = f"<small>Wifi issue! Please <button class='btn btn-outline-info' " \
-                                         f"onclick='disconnectSingleDevice(\"{device.serial}\")'>click to remove" \
-                                         f"</button> the device or try and fix the problem.</small>"
-        except RuntimeError as e:
-            if "unauthorized" in str(e):
-                device_info["message"] = "Unauthorised"
-            if "disconnected" in str(e):
-                device_info["message"] = "Disconnected"
 
-        _devices.append(device_info)
+@app.post("/device-fragments/{view}")
+async def device_fragments(request: Request, view: str, known: Dict[str, str] = Body({})):
+    """
+        The device cards (view=card) or table rows (view=row) a page is missing, rendered on the server.
 
-    return {"devices": _devices, "errs": errs}
+    :param view: card or row
+    :param known: device id -> hash of the fragment the page already shows, those that are unchanged are left out
+    :return: the device ids in order, the fragments that changed with their new hashes, and any errors
+    """
+    snapshot = federated_devices_snapshot if federation.fans_out(request) else devices_snapshot
+    payload = await snapshot.get()
+    try:
+        result = fragment_cache.fragments(view, payload["devices"], known)
+    except ValueError as e:
+        return {"success": False, "error": e.__str__()}
+    return {"success": True, "errs": payload["errs"], **result}
 
 
 @app.get("/d")
@@ -241,10 +413,10 @@ async def devices_page(request: Request):
         "pages/devices_page.html",
         {
             "request": request,
-            "app_name": simu_application_name,
+            "app_name": await tracing.run_in_executor(None, state.get, "app_name", ""),
             "icons": icons,
             "cols": cols,
-            "defaults": defaults,
+            "defaults": current_defaults(),
         },
     )
 
@@ -259,16 +431,14 @@ async def home(request: Request):
     :return: a TemplateResponse object containing the homepage
     """
 
-    global simu_application_name
-
     return templates.TemplateResponse(
         "home-basic.html",
         {
             "request": request,
-            "app_name": simu_application_name,
+            "app_name": await tracing.run_in_executor(None, state.get, "app_name", ""),
             "icons": icons,
             "cols": cols,
-            "defaults": defaults,
+            "defaults": current_defaults(),
         },
     )
 
@@ -283,16 +453,14 @@ async def home(request: Request):
     :return: a TemplateResponse object containing the homepage
     """
 
-    global simu_application_name
-
     return templates.TemplateResponse(
         "home.html",
         {
             "request": request,
-            "app_name": simu_application_name,
+            "app_name": await tracing.run_in_executor(None, state.get, "app_name", ""),
             "icons": icons,
             "cols": cols,
-            "defaults": defaults,
+            "defaults": current_defaults(),
         },
     )
 
@@ -308,25 +476,41 @@ async def experiences(request: Request, db: Session = Depends(get_db)):
     )
 
 
+def _experience_details(db: Session, apk_name: str):
+    item = crud.get_apk_details(db, apk_name=apk_name)
+    if item is None:
+        return None
+    return jsonable_encoder(APKDetails.from_orm(item).dict(exclude={"id"}))
+
+
 @app.post("/start")
-async def start(payload: StartExperience, db: Session = Depends(get_db)):
+async def start(payload: StartExperience, request: Request, db: Session = Depends(get_db)):
     """
-        Starts the experience on all devices through the adb shell commands.
+        Starts the experience on all devices through the adb shell commands. With peers configured each node starts it
+        on its own devices, at the same time.
 
     :param payload: a list of devices which the experience will start on and the experience
+    :param request: the Request object, used to tell if it came from a hub
     :param db: the database dependency
     :return: dictionary of all device serial numbers
     """
-    client_list = process_devices(client, payload)
+    if not federation.fans_out(request):
+        return await _start(payload, db)
+
+    details = _experience_details(db, payload.experience)
+    stage = partial(federation.stage_experience, details=details) if details else None
+    return await federation.fan_out("/start", payload, partial(_start, db=db), before_peer=stage)
 
-    global simu_application_name
+
+async def _start(payload: StartExperience, db: Session):
+    client_list = process_devices(client, payload)
 
     if payload.experience:
-        simu_application_name = payload.experience
+        await tracing.run_in_executor(None, state.set, "app_name", payload.experience)
     else:
         return {"success": False, "error": "No experience specified!"}
 
-    item = jsonable_encoder(crud.get_apk_details(db, apk_name=simu_application_name))
+    item = jsonable_encoder(crud.get_apk_details(db, apk_name=payload.experience))
 
     try:
         if item is None:
@@ -337,22 +521,22 @@ async def start(payload: StartExperience, db: Session = Depends(get_db)):
 
         logging.info(
             "Starting experience "
-            + simu_application_name
+            + payload.experience
             + " on "
             + str(len(client_list))
             + " devices"
         )
 
-        pool = Pool(cpu_count())
         launch_func = partial(
             launch_app,
             app_name=item["apk_name"],
             d_type=item["device_type"],
-            command=item["command"],
+            command=item["launch_activity"] or item["command"],
+            package=item["package_name"],
+        )
+        await asyncio.gather(
+            *[scheduler.submit(device.serial, Priority.CONTROL, launch_func, device) for device in client_list]
         )
-        pool.map(launch_func, client_list)
-        pool.close()
-        pool.join()
     except RuntimeError as e:
         return {"success": False, "error": e.__str__()}
 
@@ -379,8 +563,7 @@ async def upload(
         contents = await file.read()
         save_file(file.filename, contents)
 
-        global simu_application_name
-        simu_application_name = file.filename
+        await tracing.run_in_executor(None, state.set, "app_name", file.filename)
 
         device_type = 0 if command == "android" else 1
 
@@ -390,31 +573,58 @@ async def upload(
             device_type=device_type,
         )
 
-        crud.create_apk_details_item(
+        sha256 = await tracing.run_in_executor(None, lambda: hashlib.sha256(contents).hexdigest())
+        known = crud.get_apk_details_by_sha256(db, sha256)
+        try:
+            if known is not None:
+                manifest = apk_manifest.from_details(known)
+            else:
+                manifest = await tracing.run_in_executor(
+                    None, partial(apk_manifest.read_apk, "apks/" + file.filename, sha256=sha256)
+                )
+        except ValueError as e:
+            # launched the old way, from the filename and the command given
+            logging.info(f"Could not read the manifest of {file.filename}: {e}")
+            manifest = None
+        if manifest is not None:
+            item.device_type = 1 if manifest["is_vr"] else 0
+            item.command = manifest["launch_activity"] or item.command
+
+        db_item = crud.create_apk_details_item(
             db=db, item=APKDetailsCreate.parse_obj(item.dict())
         )
+        if manifest is not None:
+            crud.set_apk_manifest(db, db_item, manifest, sha256)
 
-        return {"success": True}
+        return {"success": True, "manifest": manifest}
     except IOError as e:
         return {"success": False, "error": e.__str__()}
 
 
 @app.post("/load")
-async def load(payload: Experience):
+async def load(payload: Experience, request: Request):
     """
-        Installs the experience on selected or all devices.
+        Installs the experience on selected or all devices. With peers configured the APK is copied to each peer
+        (only if it doesn't already have it) and each node installs it on its own devices.
 
     :param payload: the choice of experience specified by the user
+    :param request: the Request object, used to tell if it came from a hub
     :return: a success dictionary signifying the operation was successful
     """
+    if not federation.fans_out(request) or payload.experience not in os.listdir("apks"):
+        return await _load(payload)
+
+    stage = partial(federation.stage_apk, apk_path="apks/" + payload.experience)
+    return await federation.fan_out("/load", payload, _load, before_peer=stage)
+
 
+async def _load(payload: Experience):
     client_list = process_devices(client, payload)
 
     apk_paths = os.listdir("apks")
     apk_path = "apks/"
 
-    global simu_application_name
-    simu_application_name = payload.experience
+    await tracing.run_in_executor(None, state.set, "app_name", payload.experience)
 
     if payload.experience in apk_paths:
         apk_path += payload.experience
@@ -423,21 +633,73 @@ async def load(payload: Experience):
             "success": False,
             "error": "Cannot find the Experience APK in the directory. Make sure you uploaded it!",
         }
-    errs = []
-    try:
-        for device in client_list:
-            if not await check_alive(device, client):
-                errs.append(f'Problem installing on this device: {device.serial}. Temporarily unavailable')
-                continue
-            logging.info("Installing " + apk_path + " on " + device.serial)
-            p = Process(target=device.install, args=(apk_path,))
-            p.start()
-    except InstallError as e:
-        return {"success": False, "error": e.__str__()}
+    job = jobs.submit("install", {"apk_path": apk_path}, [device.serial for device in client_list])
+    return {"success": True, "device_count": len(client_list), "job_id": job["id"]}
 
-    if errs:
-        return {"success": False, "error": ','.join(errs)}
-    return {"success": True, "device_count": len(client_list)}
+
+@jobs.handler("install")
+async def install_job(job: JobContext):
+    apk_path = job.params["apk_path"]
+
+    async def install_on(serial: str):
+        device = client.device(serial)
+        if device is None or not await check_alive(device, client):
+            raise RuntimeError("Temporarily unavailable")
+        logging.info("Installing " + apk_path + " on " + serial)
+        outcome = await scheduler.submit(
+            serial, Priority.INSTALL, apk_install.install, device, apk_path, job.transfer_progress(serial)
+        )
+        return apk_install.describe(outcome)
+
+    await job.each_device(install_on)
+
+
+@app.post("/sync-folder")
+async def sync_folder(payload: FolderSync):
+    """
+        Copies a folder from obb/ to the selected or all devices, sending only the files they lack or have a different
+        copy of (see obb_sync.py). Runs as a job.
+
+    :param payload: the folder, where it goes on the devices (defaults to /sdcard/Android/obb/<folder>) and optionally
+        a bandwidth cap in MB/s for this sync
+    :return: the job id, see /jobs/{job_id}
+    """
+    local_dir = os.path.join(obb_sync.OBB_DIR, payload.folder)
+    if not payload.folder or os.path.basename(payload.folder) != payload.folder or not os.path.isdir(local_dir):
+        return {"success": False, "error": f"There is no folder {payload.folder} in {obb_sync.OBB_DIR}/"}
+    client_list = process_devices(client, payload)
+    params = {
+        "local_dir": local_dir,
+        "remote_dir": payload.remote_dir or f"/sdcard/Android/obb/{payload.folder}",
+        "mb_per_s": obb_sync.SYNC_MB_PER_S if payload.mb_per_s is None else payload.mb_per_s,
+    }
+    job = jobs.submit("sync", params, [device.serial for device in client_list])
+    return {"success": True, "device_count": len(client_list), "job_id": job["id"]}
+
+
+@jobs.handler("sync")
+async def sync_job(job: JobContext):
+    local_dir, remote_dir = job.params["local_dir"], job.params["remote_dir"]
+    manifest = await tracing.run_in_executor(None, obb_sync.local_manifest, local_dir)
+    # one cap for all the devices together
+    throttle = obb_sync.Throttle(job.params["mb_per_s"] * 1024 * 1024)
+    slots = asyncio.Semaphore(obb_sync.SYNC_CONCURRENCY)
+
+    async def sync_on(serial: str):
+        device = client.device(serial)
+        if device is None or not await check_alive(device, client):
+            raise RuntimeError("Temporarily unavailable")
+        async with slots:
+            outcome = await scheduler.submit(
+                serial, Priority.INSTALL, obb_sync.sync_device, device, local_dir, remote_dir, manifest, throttle,
+                job.transfer_progress(serial),
+            )
+        return (
+            f"{outcome['pushed']} files sent ({outcome['bytes'] / 1024 / 1024:.1f}MB), "
+            f"{outcome['unchanged']} unchanged"
+        )
+
+    await job.each_device(sync_on)
 
 
 @app.post("/remove-remote-experience")
@@ -510,15 +772,24 @@ def launch_home_app(device_id: str):
 
 
 @app.post("/stop")
-async def stop(payload: Experience, db: Session = Depends(get_db)):
+async def stop(payload: Experience, request: Request, db: Session = Depends(get_db)):
     """
-        Stops the experience on all devices through ADB shell commands
+        Stops the experience on all devices through ADB shell commands, across every node when peers are configured.
 
     :param payload: an Experience object containing a list of devices and the experience to stop
+    :param request: the Request object, used to tell if it came from a hub
     :param db: the database dependency
     :return: a dictionary containing the success flag of the operation and any errors
     """
+    if not federation.fans_out(request):
+        return await _stop(payload, db)
+
+    details = _experience_details(db, payload.experience)
+    stage = partial(federation.stage_experience, details=details) if details else None
+    return await federation.fan_out("/stop", payload, partial(_stop, db=db), before_peer=stage)
+
 
+async def _stop(payload: Experience, db: Session):
     client_list = process_devices(client, payload)
 
     if not payload.experience:
@@ -532,17 +803,21 @@ async def stop(payload: Experience, db: Session = Depends(get_db)):
             "error": "No application to stop, make sure there is one running!",
         }
 
-    app_name = (
+    app_name = item["package_name"] or (
         item["apk_name"] if ".apk" not in item["apk_name"] else item["apk_name"][:-4]
     )
 
+    def stop_app(device: Device):
+        logging.info("Stopped experience on device " + device.serial)
+        device.shell("am force-stop " + app_name)
+        launch_home_app(device.serial)
+
+    async def stop_on(device: Device):
+        if await check_alive(device, client):
+            await scheduler.submit(device.serial, Priority.CONTROL, stop_app, device)
+
     try:
-        for device in client_list:
-            logging.info("Stopped experience on device " + device.serial)
-            command = "am force-stop " + app_name
-            if await check_alive(device, client):
-                device.shell(command)
-                launch_home_app(device.serial)
+        await asyncio.gather(*[stop_on(device) for device in client_list])
     except RuntimeError as e:
         return {"success": False, "error": e.__str__()}
 
@@ -559,152 +834,171 @@ async def connect_raw(request: Request):
     :param request: The Request parameter which is used to receive the device data.
     :return: a dictionary containing the success flag of the operation and any errors
     """
-
-    global BASE_PORT
-
     json = await request.json() if len((await request.body()).decode()) > 0 else {}
 
     remote_address = json["remote_address"] if "remote_address" in json else ""
+    device_ip = remote_address or request.client.host
+    logging.info(f"Connect requested for {device_ip}")
 
-    logging.info("json ", json)
-    logging.info("address ", remote_address)
+    try:
+        result = await onboarding.onboard(address=device_ip)
+    except RuntimeError as e:
+        return {"success": False, "error": e.__str__()}
+    await tracing.run_in_executor(None, reconnector.remember, result["serial"])
 
-    if not remote_address:
-        device_ip = request.client.host
-    else:
-        device_ip = remote_address
+    invalidate_devices()
+    return {"success": True, "serial": device_ip}
 
-    try:
-        if not remote_address:
-            os.system("adb -s" + device_ip + " tcpip " + str(BASE_PORT))
 
-        p = multiprocessing.Process(
-            target=client.remote_connect, args=(device_ip, BASE_PORT)
-        )
-        p.start()
+@app.get("/connect/{device_serial}")
+async def connect(device_serial: str):
+    """
+        Connects a device wirelessly to the server on port 5555. After the device is connected, it can be unplugged from
+        the USB.
 
-        p.join(5)
+        This takes a while, so it runs as a job: the job id is returned straight away and the outcome can be followed
+        at /jobs/{job_id}.
 
-        if not p.is_alive():
-            connected_device = Device(client, device_ip)
-            connect_actions(
-                connected_device,
-                global_volume,
-            )
+    :param device_serial: the USB serial of the device
+    :return: a dictionary containing the success flag and the job id
+    """
+    job = jobs.submit("connect", {}, [device_serial])
+    return {"success": True, "job_id": job["id"]}
 
-            logging.info(
-                "Established connection with client " + device_ip + ":" + str(BASE_PORT)
-            )
 
-            return {"success": True, "serial": device_ip}
+def _configure_new_device(serial: str):
+    connect_actions(Device(client, serial), state.get("volume", 10))
 
-        raise RuntimeError(
-            "Could not connect device. Make sure the device is connected on the same router as the server!"
-        )
-    except RuntimeError as e:
+
+onboarding = Onboarding(scheduler, _configure_new_device, port=BASE_PORT)
+
+
+@jobs.handler("connect")
+async def connect_job(job: JobContext):
+    async def connect_device(device_serial: str):
+        def progress(stage, percent, message):
+            job.update(device_serial, "running", message, percent)
+
+        result = await onboarding.onboard(usb_serial=device_serial, progress=progress)
+        await tracing.run_in_executor(None, reconnector.remember, result["serial"])
+        invalidate_devices()
+
+        message = f"successfully added device {result['serial']}."
+        if HOME_APP_ENABLED:
+            device = client.device(result["serial"])
+            if not await tracing.run_in_executor(scheduler.executor, home_app_installed, device):
+                message += (
+                    f" Please note that the home app needed to be installed, so your device wont "
+                    f"appear for a few moments"
+                )
+        return message
+
+    await job.each_device(connect_device)
+
+
+device_tracker = DeviceTracker(ADB_HOST, ADB_PORT)
+
+
+@app.on_event("startup")
+async def start_device_tracker():
+    device_tracker.start()
+
+
+@app.get("/usb-devices")
+async def usb_devices():
+    """
+        The headsets plugged in by USB and their state (device, unauthorized, offline).
+    """
+    try:
+        return {"success": True, "devices": await device_tracker.usb_devices()}
+    except (OSError, RuntimeError) as e:
         return {"success": False, "error": e.__str__()}
 
 
-@app.get("/connect/{device_serial}")
-async def connect(
-    request: Request, device_serial: str, background_tasks: BackgroundTasks
-):
+@app.post("/enroll-usb")
+async def enroll_usb():
     """
-        Connects a device wirelessly to the server on port 5555. After the device is connected, it can be unplugged from
-        the USB.
+        Moves every headset plugged in by USB onto wifi at once, replacing running the activator script per headset.
+        Runs as a job with a status per headset, follow it at /jobs/{job_id}.
 
-    :param background_tasks:
-    :param device_serial:
-    :param request: The Request parameter which is used to receive the device data.
-    :return: a dictionary containing the success flag of the operation and any errors
+    :return: a dictionary containing the success flag, how many headsets are being enrolled and the job id
     """
-    global BASE_PORT
+    try:
+        usb = await device_tracker.usb_devices()
+    except (OSError, RuntimeError) as e:
+        return {"success": False, "error": e.__str__()}
 
-    json = await request.json() if len((await request.body()).decode()) > 0 else {}
+    serials = [serial for serial, device_state in usb.items() if device_state != "offline"]
+    if not serials:
+        return {"success": False, "error": "No headsets are plugged in by USB"}
 
-    remote_address = ""
+    logging.info(f"Enrolling {len(serials)} USB headsets")
+    job = jobs.submit("connect", {}, serials)
+    return {"success": True, "device_count": len(serials), "job_id": job["id"]}
 
-    device: Device = client.device(device_serial)
 
-    logging.info("json ", json)
-    logging.info("address ", remote_address)
-    logging.info("device ", device_serial, device)
+# brings back wifi headsets that dropped off, see reconnect.py
+reconnector = ReconnectSupervisor(device_tracker, scheduler, client, _configure_new_device, state)
 
-    if not remote_address:
-        try:
-            device_ip = device.shell("ip addr show wlan0")
-        except RuntimeError:
-            return {
-                "success": False,
-                "error": "Via a popup box within the headset you have not specified that this "
-                "device can have permission to access the headset. You may need to enable 'USB connect dialogue' via"
-                         "developer options in settings.",
-            }
-        device_ip = device_ip[device_ip.find("inet ") :]
-        device_ip = device_ip[: device_ip.find("/")]
-        device_ip = device_ip[device_ip.find(" ") + 1 :]
-    else:
-        device_ip = remote_address
 
-    try:
-        if not remote_address:
-            os.system("adb -s" + device.serial + " tcpip " + str(BASE_PORT))
+@app.on_event("startup")
+@repeat_every(seconds=RECONNECT_INTERVAL_S)
+async def reconnect_dropped_devices():
+    if await reconnector.check():
+        invalidate_devices()
 
-        p = multiprocessing.Process(
-            target=client.remote_connect, args=(device_ip, BASE_PORT)
-        )
-        p.start()
 
-        p.join(5)
+# keeps the headsets in line with the fleet profile, see reconcile.py
+reconciler = Reconciler(SessionLocal, scheduler, client, state, device_tracker.list_devices)
 
-        if not p.is_alive():
-            cmd = "adb -s " + device.serial + " tcpip " + str(BASE_PORT)
-            os.system(cmd)
 
-        p = multiprocessing.Process(
-            target=client.remote_connect, args=(device_ip, BASE_PORT)
-        )
-        p.start()
+@app.on_event("startup")
+@repeat_every(seconds=RECONCILE_INTERVAL_S)
+async def reconcile_fleet():
+    await reconciler.reconcile()
 
-        p.join(5)
 
-        if not p.is_alive():
-            connected_device = Device(client, device_ip)
+@app.get("/fleet-profile")
+async def get_fleet_profile():
+    """
+        The active fleet profile and, per headset, whether the last pass found it in line and what it did.
+    """
+    return {"success": True, "profile": reconciler.profile(), "devices": reconciler.report}
 
-            background_tasks.add_task(
-                connect_actions,
-                connected_device,
-                global_volume,
-            )
-            connected = await wait_host_port(device_ip, BASE_PORT, duration=5, delay=2)
-
-            if connected:
-                logging.info(
-                    "Established connection with client "
-                    + device_ip
-                    + ":"
-                    + str(BASE_PORT)
-                )
-                message = f"successfully added device {device_ip}."
-                if HOME_APP_ENABLED:
-                    if not home_app_installed(device):
-                        message += (
-                            f" Please note that the home app needed to be installed, so your device wont "
-                            f"appear for a few moments"
-                        )
-                return {"success": True, "serial": device_ip, "message": message}
-            else:
-                return {
-                    "success": False,
-                    "error": "Your device is on a different wifi network",
-                }
 
-        raise RuntimeError(
-            "Could not connect device. Make sure the device is connected on the same router as the server!"
+@app.post("/fleet-profile")
+async def set_fleet_profile(payload: FleetProfile, db: Session = Depends(get_db)):
+    """
+        Declares the state the headsets should be in, replacing any previous profile. The headsets are brought in line
+        straight away and kept that way.
+
+    :param payload: the headsets covered (none for all) and any of the experience to have installed, the volume, the
+        screen timeout in hours and whether the home app should be running
+    :return: a dictionary containing the success flag and the stored profile
+    """
+    if payload.apk_name and payload.apk_name not in os.listdir("apks"):
+        return {"success": False, "error": "Cannot find the Experience APK in the directory. Make sure you uploaded it!"}
+    timeout = int(payload.screen_timeout_hours * 60 * 60 * 1000) if payload.screen_timeout_hours else None
+    try:
+        crud.set_fleet_profile(
+            db, payload.name, payload.devices, payload.apk_name, payload.volume, timeout, payload.home_app
         )
-    except RuntimeError as e:
+    except SQLAlchemyError as e:
         return {"success": False, "error": e.__str__()}
 
+    reconciler.forget()
+    in_background(reconciler.reconcile())
+    return {"success": True, "profile": reconciler.profile()}
+
+
+@app.delete("/fleet-profile")
+async def clear_fleet_profile(db: Session = Depends(get_db)):
+    """
+        Stops keeping the headsets in line with a profile, leaving them as they are.
+    """
+    crud.deactivate_fleet_profiles(db)
+    return {"success": True}
+
 
 @app.post("/disconnect")
 async def disconnect(payload: Devices):
@@ -718,11 +1012,13 @@ async def disconnect(payload: Devices):
     global BASE_PORT
 
     client_list = process_devices(client, payload)
+    invalidate_devices()
 
     try:
         device: Device
         for device in client_list:
             logging.info("Disconnecting device " + device.serial + " from server!")
+            await tracing.run_in_executor(None, reconnector.forget, device.serial)
             working = client.remote_disconnect(device.serial)
             if not working:
                 return {
@@ -814,72 +1110,128 @@ async def screen_grab():
 
 
 @app.post("/volume")
-async def volume(payload: Volume):
+async def volume(payload: Volume, request: Request):
     """
-        Sets the volume of a list of devices.
+        Sets the volume of a list of devices, across every node when peers are configured.
 
     :param volume: a Volume object containing a list of devices and a volume
+    :param request: the Request object, used to tell if it came from a hub
     :return: a dictionary containing the success flag
     """
+    if not federation.fans_out(request):
+        return await _volume(payload)
+    return await federation.fan_out("/volume", payload, _volume)
+
 
+async def _volume(payload: Volume):
     client_list = process_devices(client, payload)
 
-    global global_volume
-    global_volume = payload.volume
+    await tracing.run_in_executor(None, state.set, "volume", payload.volume)
+
+    def set_volume(device: Device):
+        device.shell(f"cmd media_session volume --stream 3 --set {payload.volume}")
+        device.shell(f"media volume --stream 3 --set {payload.volume}")
+        record_applied(device.serial, volume=payload.volume)
 
     fails = []
-    for device in client_list:
+
+    async def set_volume_on(device: Device):
         if await check_alive(device, client):
             try:
-                device.shell(f"cmd media_session volume --stream 3 --set {payload.volume}")
-                device.shell(f"media volume --stream 3 --set {payload.volume}")
+                await scheduler.submit(device.serial, Priority.CONTROL, set_volume, device)
             except RuntimeError as e:
                 fails.append(e)
 
+    await asyncio.gather(*[set_volume_on(device) for device in client_list])
+
     if fails:
         return {"success": False, "fails": str(fails)}
 
     return {"success": True}
 
 
-devices_info = {}
+image_pool = ImageWorkerPool(scheduler=scheduler)
+# what each headset showed, kept from the thumbnails while archiving is on, see screen_archive.py
+screen_archive = ScreenArchive(state=state)
+
+
+@app.on_event("shutdown")
+def stop_image_pool():
+    image_pool.shutdown()
+    scheduler.shutdown()
+    federation.shutdown()
+    device_tracker.stop()
+    screen_archive.shutdown()
+    state.close()
 
 
 async def check_image(device_serial, refresh_ms, size):
-    if await check_alive(client.device(device_serial), client):
-        pass
-    img = adb_image(device_serial)
+    image = await image_pool.thumbnail(device_serial, defaults["screen_height"])
+    if image and await screen_archive.is_enabled():
+        in_background(screen_archive.record(device_serial, image, image_pool.executor))
+    return image
 
-    if img and len(img) > 5 and img[5] == 0x0d:
-        img = img.replace(b'\r\n', b'\n')
 
+@app.post("/screen-archive/start")
+async def screen_archive_start():
+    """
+        Starts keeping the thumbnails of every headset, for a time-lapse of the session afterwards.
+    """
+    await tracing.run_in_executor(None, screen_archive.switch, True)
+    return {"success": True}
 
-    _image = None
-    try:
-        _image = cv2.imdecode(np.frombuffer(img, np.uint8), cv2.IMREAD_COLOR)
-    except cv2.error:
-        return None
 
-    if _image is None:
-        return None
+@app.post("/screen-archive/stop")
+async def screen_archive_stop():
+    await tracing.run_in_executor(None, screen_archive.switch, False)
+    return {"success": True}
 
-    _image = _image[0: _image.shape[0], 0 : int(_image.shape[1] * 0.5)]
 
-    height = _image.shape[0]
-    width = int(_image.shape[1] / height * defaults["screen_height"])
-    height = defaults["screen_height"]
+@app.get("/screen-archive")
+async def screen_archive_summary():
+    """
+        Whether archiving is on, the disk space used and per headset how many frames are kept and from when to when.
+    """
+    return await tracing.run_in_executor(screen_archive.executor, screen_archive.summary)
+
 
-    dsize = (width, height)
-    image = cv2.resize(_image, dsize)
+@app.get("/screen-archive/export")
+async def screen_archive_export(
+    devices: List[str] = Query(...), start: float = None, end: float = None, fps: float = 10, grid: bool = False
+):
+    """
+        A time-lapse .avi of what the headsets showed.
 
-    _, encoded_img = cv2.imencode(".png", image)
-    return base64.b64encode(encoded_img).decode("utf-8")
+    :param devices: the headsets, several are shown side by side in a grid
+    :param start: unix time to start from, defaults to the start of the archive
+    :param end: unix time to end at, defaults to now
+    :param fps: frames per second of the video
+    :param grid: a grid even for one headset
+    """
+    fd, path = tempfile.mkstemp(prefix="simu-timelapse-", suffix=".avi")
+    os.close(fd)
+    try:
+        frames = await tracing.run_in_executor(
+            screen_archive.executor, partial(screen_archive.export, path, devices, start, end, fps, grid=grid)
+        )
+    except (OSError, ValueError) as e:
+        os.remove(path)
+        return {"success": False, "error": str(e)}
+    if not frames:
+        os.remove(path)
+        return {"success": False, "error": "Nothing was archived for those headsets then"}
+    return FileResponse(
+        path, media_type="video/x-msvideo", filename="timelapse.avi", background=BackgroundTask(os.remove, path)
+    )
 
 
 @app.get("/device-screen/{refresh_ms}/{size}/{device_serial}")
 async def devicescreen(
     request: Request, refresh_ms: int, size: str, device_serial: str
 ):
+    node = federation.node_for(device_serial)
+    if node and federation.fans_out(request):
+        return await federation.call(node, "GET", f"/device-screen/{refresh_ms}/{size}/{device_serial}")
     try:
         image = await check_image(device_serial, refresh_ms, size)
         if not image:
@@ -892,13 +1244,19 @@ async def devicescreen(
     return {"success": False}
 
 
+def _battery_level(device_serial: str):
+    device: Device = client.device(device_serial)
+    if not device:
+        return "Device does not exist"
+    return device.get_battery_level()
+
+
 @app.get("/battery/{device_serial}")
 async def battery(device_serial: str):
     try:
-        device: Device = client.device(device_serial)
-        if not device:
-            return "Device does not exist"
-        battery_level = device.get_battery_level()
+        battery_level = await scheduler.submit(
+            device_serial, Priority.STATUS, _battery_level, device_serial, key="battery"
+        )
         if str(battery_level) == "null":
             return "?"
         return battery_level
@@ -995,6 +1353,7 @@ async def device_experiences(request: Request, device_serial: str):
     )
 
 
+@traced("get_running_app", "adb")
 async def get_running_app(device: DeviceAsync):
     current_app = await device.shell(
         "dumpsys activity activities | grep ResumedActivity"
@@ -1016,6 +1375,7 @@ async def device_command(
     my_json = await request.json()
     experience = my_json["experience"]
 
+    @traced("get_exp_info", "adb")
     async def get_exp_info(_d: Device):
         my_info: str = await _d.shell(
             f"dumpsys package | grep {experience} | grep Activity"
@@ -1025,16 +1385,24 @@ async def device_command(
             return ""
         return my_info.split(" ")[1]
 
-    if command == "start":
+    async def start_experience(_d: DeviceAsync, info: str = None):
         # https://stackoverflow.com/a/64241561/960471
-        info = await get_exp_info(device)
-        outcome = await device.shell(f"am start -n {info}")
+        if info is None:
+            info = await get_exp_info(_d)
+        return await _d.shell(f"am start -n {info}")
+
+    async def stop_experience(_d: DeviceAsync, package: str):
+        # https://stackoverflow.com/a/56078766/960471
+        outcome = await _d.shell(f"am force-stop {package}")
+        launch_home_app(_d.serial)
+        return outcome
+
+    if command == "start":
+        outcome = await scheduler.submit(device.serial, Priority.CONTROL, start_experience, device)
         return {"success": "Starting" in outcome, "message": outcome}
 
     elif command == "stop":
-        # https://stackoverflow.com/a/56078766/960471
-        await device.shell(f"am force-stop {experience}")
-        launch_home_app(device.serial)
+        await scheduler.submit(device.serial, Priority.CONTROL, stop_experience, device, experience)
         return {"success": True}
     elif command == "copy-details":
         info: str = await device.shell(
@@ -1054,10 +1422,15 @@ async def device_command(
         return {"success": True}
 
     elif command == "stop-some-experience":
-        current_app = await get_running_app(device)
-        if current_app == "com.oculus.shellenv":
+        async def stop_current(_d: DeviceAsync):
+            current_app = await get_running_app(_d)
+            if current_app == "com.oculus.shellenv":
+                return False
+            await _d.shell(f"am force-stop {current_app}")
+            return True
+
+        if not await scheduler.submit(device.serial, Priority.CONTROL, stop_current, device):
             return {"success": True, "outcome": "No app to stop!"}
-        outcome = await device.shell(f"am force-stop {current_app}")
         return {"success": True, "outcome": "Successfully stopped!"}
 
     ########### devices experiences menu
@@ -1068,8 +1441,7 @@ async def device_command(
         for device_serial in my_devices:
             device: DeviceAsync = await client_async.device(device_serial)
             if await check_alive(device, client):
-                outcome = await device.shell(f"am force-stop {experience}")
-                launch_home_app(device.serial)
+                outcome = await scheduler.submit(device.serial, Priority.CONTROL, stop_experience, device, experience)
             else:
                 outcome = 'device(s) has a wifi connection issue'
         return {"success": True, "message": outcome}
@@ -1089,7 +1461,7 @@ async def device_command(
         for device in devices_list:
             device: DeviceAsync = await client_async.device(device)
             if await check_alive(device, client):
-                outcome = await device.shell(f"am start -n {info}")
+                outcome = await scheduler.submit(device.serial, Priority.CONTROL, start_experience, device, info)
 
                 if "Exception" in outcome:
                     errs.append(f"An error occurred at device {device.serial}: \n" + outcome)
@@ -1118,13 +1490,221 @@ async def device_icon(
     icon = json["icon"]
     text = json["text"]
     set_device_icon(db=db, device_id=device_serial, icon=icon, col=col, text=text)
+    invalidate_devices()
     return {"success": True}
 
 
+fleet_status = FleetStatus(client_async, scheduler)
+
+
+@app.get("/fleet-status")
+async def fleet_status_view():
+    """
+        Battery, current app, screen state and volume of every connected device, queried concurrently with a single
+        adb round trip per device. Shared between callers for a few seconds.
+
+    :return: a dictionary of device serial to status, and when it was gathered
+    """
+    return await fleet_status.get()
+
+
 @app.get("/current-experience/{device_serial}")
 async def current_experience(request: Request, device_serial: str):
     device = await client_async.device(device_serial)
     if not await check_alive(device, client):
         return {'current_app': 'DISCONNECTED'}
-    current_app = await get_running_app(device)
+    try:
+        current_app = await scheduler.submit(
+            device_serial, Priority.STATUS, get_running_app, device, key="current-app"
+        )
+    except RuntimeError:
+        return {'current_app': 'BUSY'}
     return {"current_app": current_app}
+
+
+@app.api_route("/apks/{apk_name}", methods=["GET", "HEAD"])
+async def apk_file(request: Request, apk_name: str):
+    """
+        An uploaded APK, for headsets downloading it themselves (see apk_pull.py). Single byte ranges are served so an
+        interrupted download can resume, and the sha256 is the ETag.
+    """
+    path = os.path.join("apks", apk_name)
+    if os.path.basename(apk_name) != apk_name or not os.path.isfile(path):
+        return JSONResponse({"success": False, "error": f"No APK named {apk_name}"}, status_code=404)
+
+    size = os.path.getsize(path)
+    etag = '"' + await tracing.run_in_executor(None, file_sha256, path) + '"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    wanted = None
+    # a resumed download of an APK that has since been replaced gets the whole new one
+    if request.headers.get("if-range", etag) == etag:
+        try:
+            wanted = apk_pull.parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers=dict(headers, **{"Content-Range": f"bytes */{size}"}))
+    first, last = wanted or (0, size - 1)
+    headers["Content-Length"] = str(last - first + 1)
+    if wanted:
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    status_code = 206 if wanted else 200
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=apk_pull.MEDIA_TYPE)
+    return StreamingResponse(
+        apk_pull.file_chunks(path, first, last), status_code=status_code, headers=headers,
+        media_type=apk_pull.MEDIA_TYPE,
+    )
+
+
+@app.get("/federation/apks/{apk_name}")
+async def federation_apk(apk_name: str):
+    """
+        The sha256 of an APK this node has, so a hub can tell whether it needs to send it.
+    """
+    path = os.path.join("apks", os.path.basename(apk_name))
+    if not os.path.isfile(path):
+        return {"sha256": None}
+    return {"sha256": await tracing.run_in_executor(None, file_sha256, path)}
+
+
+@app.put("/federation/apks/{apk_name}")
+async def federation_stage_apk(request: Request, apk_name: str):
+    """
+        Receives an APK from a hub, streamed straight to disk and checked against its X-Simu-Sha256 header.
+    """
+    if os.path.basename(apk_name) != apk_name or not apk_name:
+        return {"success": False, "error": "Invalid APK name"}
+
+    expected = request.headers.get("x-simu-sha256")
+    partial_path = os.path.join("apks", "." + apk_name + ".partial")
+    digest = hashlib.sha256()
+
+    def write(f, data: bytes):
+        digest.update(data)
+        f.write(data)
+
+    try:
+        with open(partial_path, "wb") as f:
+            # written and hashed on a thread a megabyte at a time, a multi-GB APK would hold up every other request
+            buffer = bytearray()
+            async for chunk in request.stream():
+                buffer += chunk
+                if len(buffer) >= 1024 * 1024:
+                    await tracing.run_in_executor(None, write, f, bytes(buffer))
+                    buffer.clear()
+            await tracing.run_in_executor(None, write, f, bytes(buffer))
+    except BaseException:
+        # the hub went away or the disk filled up, don't leave half an APK behind
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    if expected and digest.hexdigest() != expected:
+        os.remove(partial_path)
+        return {"success": False, "error": f"{apk_name} was corrupted on the way, checksum mismatch"}
+    os.replace(partial_path, os.path.join("apks", apk_name))
+    logging.info(f"Received {apk_name} from a hub")
+    return {"success": True, "sha256": digest.hexdigest()}
+
+
+@app.post("/federation/experiences")
+async def federation_experience(payload: APKDetailsBase, db: Session = Depends(get_db)):
+    """
+        Creates or updates an experience's launch details, sent by a hub before it starts/stops it here.
+    """
+    item = crud.get_apk_details(db, apk_name=payload.apk_name)
+    if item is None:
+        crud.create_apk_details_item(db=db, item=APKDetailsCreate.parse_obj(payload.dict()))
+    else:
+        for key, value in payload.dict().items():
+            setattr(item, key, value)
+        db.commit()
+    return {"success": True}
+
+
+@app.get("/jobs")
+async def recent_jobs(limit: int = 20):
+    return {"jobs": jobs.recent(limit)}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: int, node: str = None):
+    """
+        The state of a job and of each device in it.
+
+    :param node: the peer the job runs on, for the jobs of a command fanned out by this hub
+    """
+    if node and node != "local":
+        if node not in federation.peers:
+            return {"success": False, "error": f"{node} is not a peer of this node"}
+        return await federation.call(node, "GET", f"/jobs/{job_id}")
+    job = jobs.get(job_id)
+    if job is None:
+        return {"success": False, "error": f"No job with id {job_id}"}
+    return job
+
+
+@app.get("/jobs/{job_id}/stream")
+async def job_stream(job_id: int):
+    """
+        The job's state as server-sent events, one every time it changes, until it has finished.
+    """
+    return StreamingResponse(jobs.stream(job_id), media_type="text/event-stream")
+
+
+@app.get("/debug/traces")
+async def debug_traces(limit: int = None, summary: bool = False):
+    """
+        The most recently sampled request traces. By default returned in the Chrome trace event format (save as .json
+        and open in chrome://tracing or ui.perfetto.dev), or as a per-request breakdown by category with ?summary=true.
+
+    :param limit: only return the last n traces
+    :param summary: return the time spent per category (adb, db, subprocess, image, pool) instead of every span
+    """
+    traces = tracing.recent_traces(limit)
+    if summary:
+        return {"sample_rate": tracing.sample_rate, "traces": [trace.summary() for trace in traces]}
+    return tracing.chrome_trace(traces)
+
+
+@app.get("/debug/image-pool")
+async def debug_image_pool():
+    return {"workers": image_pool.workers, "max_pending": image_pool.max_pending, **image_pool.stats}
+
+
+@app.get("/debug/fragments")
+async def debug_fragments():
+    return fragment_cache.stats
+
+
+@app.get("/debug/logging")
+async def debug_logging():
+    return {"queued": log_handler.queue.qsize(), "dropped": log_handler.dropped}
+
+
+@app.get("/debug/scheduler")
+async def debug_scheduler():
+    return {"queue_depths": scheduler.queue_depths(), **scheduler.stats}
+
+
+@app.get("/debug/reconnect")
+async def debug_reconnect():
+    """
+        Per wifi headset: whether it is up, how often it has been reconnected and how long that took.
+    """
+    return {"known_devices": await tracing.run_in_executor(None, reconnector.known), "devices": reconnector.stats()}
+
+
+@app.get("/debug/state")
+async def debug_state():
+    return {"node": state_backend.NODE_ID, "backend": state.name, "leases": state.leases()}
+
+
+@app.get("/debug/traces/{trace_id}")
+async def debug_trace(trace_id: int):
+    trace = tracing.get_trace(trace_id)
+    if trace is None:
+        return {"success": False, "error": f"No trace with id {trace_id}, it may have been rotated out"}
+    return tracing.chrome_trace([trace])
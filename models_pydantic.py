@@ -21,3 +21,17 @@ class NewExperience(Devices):
 class StartExperience(Devices):
     experience: str
 
+
+
+class FleetProfile(Devices):
+    name: str = ""
+    apk_name: Optional[str] = None
+    volume: Optional[int] = None
+    screen_timeout_hours: Optional[float] = None
+    home_app: bool = False
+
+
+class FolderSync(Devices):
+    folder: str
+    remote_dir: Optional[str] = None
+    mb_per_s: Optional[float] = None
@@ -0,0 +1,172 @@
+"""
+Copying an experience's OBB or asset folder onto headsets, sending only the files that changed.
+
+A folder kept on the server in obb/<name>/ (SIMU_OBB_DIR) is copied to /sdcard/Android/obb/<name>/ on each headset, or
+to another folder such as /sdcard/Android/data/<package>/files. Between builds usually only some files change, so:
+
+- the local files are hashed (md5, remembered until a file changes)
+- each headset is asked about its copies in one shell call: size and modification time of every file, and the md5 of
+  those it can't be told from those (same size, different time). Pushing keeps the local modification time, so once a
+  file has been copied it is recognised without being read again
+- only missing or different files are pushed
+
+Several headsets are worked on at once (SIMU_SYNC_CONCURRENCY, default 4) and what they are sent together is capped at
+SIMU_SYNC_MB_PER_S (default 10, 0 for no cap) so a sync doesn't take over the venue's wifi. Files on the headset that
+aren't in the local folder are left alone.
+"""
+import hashlib
+import os
+import shlex
+import threading
+import time
+
+from tracing import span
+
+OBB_DIR = os.environ.get("SIMU_OBB_DIR", "obb")
+SYNC_CONCURRENCY = int(os.environ.get("SIMU_SYNC_CONCURRENCY", 4))
+SYNC_MB_PER_S = float(os.environ.get("SIMU_SYNC_MB_PER_S", 10))
+# Quest's adbd takes shell commands of up to 1MB, older headsets less: stay well below
+SCRIPT_CHARS = 60000
+
+_md5s = {}
+
+
+class Throttle:
+    """
+        Caps the bytes per second sent by any number of threads together.
+    """
+
+    def __init__(self, bytes_per_s: float):
+        self.bytes_per_s = bytes_per_s
+        self.lock = threading.Lock()
+        self.next_free = time.monotonic()
+
+    def consume(self, count: int):
+        """
+            Waits until count more bytes may be sent.
+        """
+        if not self.bytes_per_s:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # a short burst after being idle, no more
+            self.next_free = max(self.next_free, now - 0.25) + count / self.bytes_per_s
+            wait = self.next_free - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+def file_md5(path: str) -> str:
+    """
+        The md5 of a file, remembered until the file changes.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if key not in _md5s:
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        _md5s[key] = digest.hexdigest()
+    return _md5s[key]
+
+
+def local_manifest(directory: str) -> dict:
+    """
+        Every file under directory -> {relative path: (size, modification time in whole seconds, md5)}
+    """
+    manifest = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            relative = os.path.relpath(path, directory).replace(os.sep, "/")
+            manifest[relative] = (stat.st_size, int(stat.st_mtime), file_md5(path))
+    return manifest
+
+
+def remote_scripts(remote_dir: str, manifest: dict) -> list:
+    """
+        Shell scripts printing `<index> <size> <mtime> [<md5>]` for every file of the manifest the headset has, the md5
+        only for a file of the right size but another time. As few scripts as fit SCRIPT_CHARS, usually one.
+    """
+    scripts = []
+    prefix = f"cd {shlex.quote(remote_dir)} 2>/dev/null || exit 0; "
+    script = prefix
+    for index, (relative, (size, mtime, _)) in enumerate(sorted(manifest.items())):
+        name = shlex.quote(relative)
+        line = (
+            f"s=$(stat -c '%s %Y' {name} 2>/dev/null) && "
+            f"if [ \"$s\" != '{size} {mtime}' ] && [ \"${{s% *}}\" = {size} ]; "
+            f"then echo \"{index} $s $(md5sum {name} | cut -d' ' -f1)\"; else echo \"{index} $s\"; fi; "
+        )
+        if len(script) + len(line) > SCRIPT_CHARS and script != prefix:
+            scripts.append(script)
+            script = prefix
+        script += line
+    if script != prefix:
+        scripts.append(script)
+    return scripts
+
+
+def changed_files(manifest: dict, remote_output: str) -> list:
+    """
+        The files of the manifest the headset lacks or has a different copy of, from what remote_scripts printed.
+    """
+    names = sorted(manifest)
+    remote = {}
+    for line in remote_output.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and parts[0].isdigit() and int(parts[0]) < len(names):
+            remote[names[int(parts[0])]] = parts[1:]
+    changed = []
+    for relative in names:
+        size, mtime, md5 = manifest[relative]
+        copy = remote.get(relative)
+        if copy is None or copy[0] != str(size):
+            changed.append(relative)
+        elif copy[1] != str(mtime) and (len(copy) < 3 or copy[2] != md5):
+            changed.append(relative)
+    return changed
+
+
+def sync_device(device, local_dir: str, remote_dir: str, manifest: dict, throttle: Throttle = None,
+                progress=None) -> dict:
+    """
+        Brings a headset's copy of a folder in line with the local one. Blocking, run it on a thread.
+
+    :param device: the ppadb Device
+    :param local_dir: the folder on the server
+    :param remote_dir: the folder on the headset
+    :param manifest: local_manifest(local_dir)
+    :param throttle: shared by all the headsets being synced, caps what they are sent together
+    :param progress: called with (bytes sent, bytes to send) as files are pushed, from the syncing thread
+    :return: {"pushed": files, "unchanged": files, "bytes": bytes pushed, "seconds"}
+    """
+    started = time.perf_counter()
+    with span("sync compare", "adb", serial=device.serial, files=len(manifest)):
+        output = "".join(device.shell(script) for script in remote_scripts(remote_dir, manifest))
+    changed = changed_files(manifest, output)
+    total = sum(manifest[relative][0] for relative in changed)
+    done = 0
+    for relative in changed:
+        sent_before, last_sent = done, 0
+
+        def pushed(_, __, sent):
+            nonlocal done, last_sent
+            if throttle is not None:
+                throttle.consume(sent - last_sent)
+            last_sent = sent
+            done = sent_before + sent
+            if progress is not None:
+                progress(done, total)
+
+        with span("sync push", "adb", serial=device.serial, file=relative):
+            device.push(os.path.join(local_dir, relative), f"{remote_dir.rstrip('/')}/{relative}", progress=pushed)
+        done = sent_before + manifest[relative][0]
+    return {
+        "pushed": len(changed),
+        "unchanged": len(manifest) - len(changed),
+        "bytes": total,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,141 @@
+"""
+Getting a headset onto wifi adb, as a pipeline of stages:
+
+    wlan_ip     read the headset's wifi address over USB
+    tcpip       switch its adb daemon to listen on the network
+    connect     `adb connect` to it, retried while the daemon restarts
+    wait_port   make sure the address can actually be reached from here
+    configure   apply the volume/screen timeout/home app (connect_actions)
+
+Every stage is async (subprocesses and sockets, blocking adb calls go through the scheduler's threads) and has its own
+timeout, so any number of headsets can be onboarded at once without stalling the server, and a stuck headset fails at
+the stage it got stuck in instead of holding everything up. Progress is reported after every stage.
+"""
+import asyncio
+import logging
+import os
+import time
+import weakref
+
+from adb_layer import adb_command_async
+from helpers import wait_host_port
+from scheduler import Priority
+from tracing import span
+
+STAGES = ("wlan_ip", "tcpip", "connect", "wait_port", "configure")
+STAGE_TIMEOUTS_S = {"wlan_ip": 8, "tcpip": 10, "connect": 10, "wait_port": 10, "configure": 60}
+TIMEOUT_MESSAGES = {
+    "connect": "Could not connect device. Make sure the device is connected on the same router as the server!",
+    "wait_port": "Your device is on a different wifi network",
+}
+BASE_PORT = 5555
+
+
+class OnboardingError(RuntimeError):
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+
+
+def parse_wlan_ip(output: str):
+    """
+        The address from `ip addr show wlan0`, ie: 'inet 192.168.0.155/24 brd ...' -> 192.168.0.155
+    """
+    for line in output.splitlines():
+        tokens = line.split()
+        if len(tokens) >= 2 and tokens[0] == "inet":
+            return tokens[1].split("/")[0]
+    return None
+
+
+class Onboarding:
+    def __init__(self, scheduler, configure, port: int = BASE_PORT, timeouts: dict = None, concurrency: int = None):
+        """
+        :param scheduler: the DeviceScheduler the configure stage runs through, at control priority
+        :param configure: plain function given the new wifi serial, applies the initial settings
+        :param port: the port headsets listen on once switched to tcpip
+        :param timeouts: seconds allowed per stage, overriding STAGE_TIMEOUTS_S
+        :param concurrency: how many headsets are onboarded at once, defaults to SIMU_ONBOARD_CONCURRENCY or 10
+        """
+        self.scheduler = scheduler
+        self.configure = configure
+        self.port = port
+        self.timeouts = dict(STAGE_TIMEOUTS_S, **(timeouts or {}))
+        self.concurrency = concurrency or int(os.environ.get("SIMU_ONBOARD_CONCURRENCY", 10))
+        # per event loop, the semaphore limiting how many headsets are onboarded at once on it
+        self._slots = weakref.WeakKeyDictionary()
+
+    def _get_slots(self):
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(self.concurrency)
+        return slots
+
+    async def onboard(self, usb_serial: str = None, address: str = None, progress=None) -> dict:
+        """
+            Runs the pipeline for one headset.
+
+        :param usb_serial: the headset's USB serial. It is switched to tcpip and its address looked up unless given.
+        :param address: the headset's wifi address, if already known
+        :param progress: optional function (stage, percent, message) called as each stage completes
+        :return: the new wifi serial and how long each stage took
+        :raises OnboardingError: naming the stage that failed
+        """
+        durations = {}
+
+        async def stage(name, coroutine):
+            started = time.perf_counter()
+            with span(name, "onboarding", serial=usb_serial or address):
+                try:
+                    result = await asyncio.wait_for(coroutine, self.timeouts[name])
+                except asyncio.TimeoutError:
+                    default = f"The headset did not respond ({name} took over {self.timeouts[name]}s)"
+                    raise OnboardingError(name, TIMEOUT_MESSAGES.get(name, default))
+            durations[name] = round(time.perf_counter() - started, 3)
+            if progress is not None:
+                progress(name, int((STAGES.index(name) + 1) / len(STAGES) * 100), f"{name} done")
+            return result
+
+        async with self._get_slots():
+            if address is None:
+                address = await stage("wlan_ip", self._wlan_ip(usb_serial))
+            if usb_serial is not None:
+                await stage("tcpip", self._tcpip(usb_serial))
+            serial = f"{address}:{self.port}"
+            await stage("connect", self._connect(serial))
+            await stage("wait_port", self._wait_port(address))
+            await stage("configure", self.scheduler.submit(serial, Priority.CONTROL, self.configure, serial))
+
+        logging.info(f"Onboarded {usb_serial or address} as {serial} in {sum(durations.values()):.1f}s {durations}")
+        return {"serial": serial, "durations": durations}
+
+    async def _wlan_ip(self, usb_serial: str) -> str:
+        out, err = await adb_command_async(["-s", usb_serial, "shell", "ip addr show wlan0"])
+        if "unauthorized" in err:
+            raise OnboardingError(
+                "wlan_ip",
+                "Via a popup box within the headset you have not specified that this device can have permission to "
+                "access the headset. You may need to enable 'USB connect dialogue' via developer options in settings.",
+            )
+        address = parse_wlan_ip(out)
+        if address is None:
+            raise OnboardingError("wlan_ip", "The headset has no wifi address, is it connected to the wifi?")
+        return address
+
+    async def _tcpip(self, usb_serial: str):
+        out, err = await adb_command_async(["-s", usb_serial, "tcpip", str(self.port)])
+        if "restarting" not in out:
+            raise OnboardingError("tcpip", f"Could not switch the headset to wifi: {(err or out).strip()}")
+
+    async def _connect(self, serial: str):
+        # the daemon takes a moment to restart in tcp mode, so the first attempts are often refused
+        while True:
+            out, _ = await adb_command_async(["connect", serial])
+            if "connected to" in out:
+                return
+            await asyncio.sleep(0.5)
+
+    async def _wait_port(self, address: str):
+        if not await wait_host_port(address, self.port, duration=self.timeouts["wait_port"], delay=0.5):
+            raise OnboardingError("wait_port", "Your device is on a different wifi network")
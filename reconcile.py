@@ -0,0 +1,292 @@
+"""
+Converging the headsets on a fleet profile: the state they should be in, declared once, rather than pressing /load,
+/volume and so on by hand.
+
+A profile (sql_app FleetProfile, set through /fleet-profile) names the headsets it covers (none meaning all of them)
+and any of: an experience to have installed, a volume, a screen timeout and the home app running. Every pass the
+reconciler compares each headset's observed state with the profile and does only what differs, installing a missing
+experience and putting any settings right in one shell call.
+
+Observed state is cached (one compound shell call per headset refreshes it, at most every observe_ttl seconds or after
+the reconciler changed something) and only a few headsets are worked on at once, with installs limited further, so
+converging a full room never floods the wifi. An install a headset refused is not tried again on every pass: each
+further attempt of the same APK on that headset waits twice as long as the one before.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import weakref
+
+from ppadb import InstallError
+
+import apk_install
+from federation import file_sha256
+from helpers import config_commands, record_applied, HOME_APP_APK, HOME_APP_PACKAGE
+from reconnect import backoff_delay
+from scheduler import Priority
+from sql_app import crud
+from tracing import span, run_in_executor
+
+RECONCILE_INTERVAL_S = float(os.environ.get("SIMU_RECONCILE_INTERVAL_S", 60))
+OBSERVE_COMMAND = (
+    "cmd media_session volume --stream 3 --get; settings get system screen_off_timeout; pm list packages; "
+    "dumpsys activity activities | grep mResumedActivity"
+)
+HOME_ACTIVITY = f"{HOME_APP_PACKAGE}/com.unity3d.player.UnityPlayerActivity"
+
+
+def profile_to_dict(profile, package_name: str = None) -> dict:
+    """
+    :param package_name: the package of the profile's experience, as read from its manifest at upload
+    """
+    return {
+        "id": profile.id,
+        "name": profile.name,
+        "devices": json.loads(profile.devices or "[]"),
+        "apk_name": profile.apk_name,
+        "package_name": package_name,
+        "volume": profile.volume,
+        "screen_off_timeout": profile.screen_off_timeout,
+        "home_app": bool(profile.home_app),
+    }
+
+
+def parse_observed(output: str) -> dict:
+    """
+        The output of OBSERVE_COMMAND -> {"volume", "screen_off_timeout", "packages", "resumed"}
+    """
+    observed = {"volume": None, "screen_off_timeout": None, "packages": [], "resumed": None}
+    for line in output.splitlines():
+        line = line.strip()
+        volume = re.match(r"volume is (\d+)", line)
+        if volume:
+            observed["volume"] = int(volume.group(1))
+        elif line.isdigit():
+            observed["screen_off_timeout"] = int(line)
+        elif line.startswith("package:"):
+            observed["packages"].append(line[len("package:"):])
+        elif "mResumedActivity" in line:
+            tokens = [token for token in line.split() if "/" in token]
+            observed["resumed"] = tokens[0] if tokens else None
+    return observed
+
+
+def plan(profile: dict, observed: dict, installed: dict = None, apk_sha256: str = None) -> dict:
+    """
+        What to do to a headset to bring it in line with the profile.
+
+    :param profile: the profile, as from profile_to_dict
+    :param observed: the headset's state, as from parse_observed
+    :param installed: apk name -> sha256 of what the reconciler last installed on the headset
+    :param apk_sha256: sha256 of the profile's experience APK, a different one installed earlier is replaced
+    :return: {"install": [apk names], "shell": [commands]}, both empty when the headset is in line
+    """
+    installed = installed or {}
+    install = []
+    apk_name = profile.get("apk_name")
+    if apk_name:
+        # the file name only says which package it is if the APK wasn't renamed, see apk_manifest.py
+        package = profile.get("package_name") or (apk_name[:-4] if apk_name.endswith(".apk") else apk_name)
+        outdated = apk_name in installed and apk_sha256 is not None and installed[apk_name] != apk_sha256
+        if package not in observed["packages"] or outdated:
+            install.append(apk_name)
+
+    desired = {key: profile[key] for key in ("volume", "screen_off_timeout") if profile.get(key) is not None}
+    shell = config_commands(desired, observed)
+
+    if profile.get("home_app"):
+        if HOME_APP_PACKAGE not in observed["packages"]:
+            install.append(HOME_APP_APK)
+        resumed = observed["resumed"] or ""
+        # only bring the home app up from the system shell, never over an experience someone is in
+        if not resumed.startswith(HOME_APP_PACKAGE) and resumed.startswith("com.oculus."):
+            shell.append(f"am start -n {HOME_ACTIVITY}")
+    return {"install": install, "shell": shell}
+
+
+class _LoopSlots:
+    """
+        The semaphores and lock of one event loop, asyncio's belong to the loop they are used on.
+    """
+
+    def __init__(self, concurrency: int, installs: int):
+        self.devices = asyncio.Semaphore(concurrency)
+        self.installs = asyncio.Semaphore(installs)
+        self.running = asyncio.Lock()
+
+
+class Reconciler:
+    def __init__(self, session_factory, scheduler, client, state, list_devices, concurrency: int = None,
+                 installs: int = None, observe_ttl: float = 300, apk_dir: str = "apks", install_retry_s: float = 300,
+                 install_retry_max_s: float = 6 * 3600):
+        """
+        :param session_factory: makes database sessions, the active profile is read from there
+        :param scheduler: the DeviceScheduler, observing runs at status priority and changes at install priority
+        :param client: the ppadb client
+        :param state: the StateBackend, only leased headsets are reconciled
+        :param list_devices: coroutine function returning {serial: adb state}, ie: DeviceTracker.list_devices
+        :param concurrency: headsets worked on at once, defaults to SIMU_RECONCILE_CONCURRENCY or 4
+        :param installs: installs at once, defaults to SIMU_RECONCILE_INSTALLS or 1
+        :param observe_ttl: seconds a headset's observed state is trusted for
+        :param apk_dir: where the experience APKs are
+        :param install_retry_s: seconds before trying a failed install again, doubled after every further failure
+        :param install_retry_max_s: longest wait between attempts of a failing install
+        """
+        self.session_factory = session_factory
+        self.scheduler = scheduler
+        self.client = client
+        self.state = state
+        self.list_devices = list_devices
+        self.concurrency = concurrency or int(os.environ.get("SIMU_RECONCILE_CONCURRENCY", 4))
+        self.installs = installs or int(os.environ.get("SIMU_RECONCILE_INSTALLS", 1))
+        self.observe_ttl = observe_ttl
+        self.apk_dir = apk_dir
+        self.install_retry_s = install_retry_s
+        self.install_retry_max_s = install_retry_max_s
+        self.observed = {}
+        self.installed = {}
+        # (serial, apk name, sha256) -> (failed attempts, monotonic time of the next attempt)
+        self.install_failures = {}
+        self.report = {}
+        self._loops = weakref.WeakKeyDictionary()
+
+    def _loop_slots(self) -> _LoopSlots:
+        loop = asyncio.get_running_loop()
+        slots = self._loops.get(loop)
+        if slots is None:
+            slots = self._loops[loop] = _LoopSlots(self.concurrency, self.installs)
+        return slots
+
+    def profile(self):
+        db = self.session_factory()
+        try:
+            profile = crud.get_active_fleet_profile(db)
+            if profile is None:
+                return None
+            item = crud.get_apk_details(db, apk_name=profile.apk_name) if profile.apk_name else None
+            return profile_to_dict(profile, item.package_name if item else None)
+        finally:
+            db.close()
+
+    def forget(self, serial: str = None):
+        """
+            Drops cached observations, for one headset or all of them, so they are looked at again on the next pass.
+        """
+        if serial is None:
+            self.observed.clear()
+        else:
+            self.observed.pop(serial, None)
+
+    async def reconcile(self) -> dict:
+        """
+            One pass: brings every headset the active profile covers in line with it. Passes don't overlap, a pass
+            asked for while one is running just waits for it.
+
+        :return: per headset, whether it was in line and what was done
+        """
+        slots = self._loop_slots()
+        if slots.running.locked():
+            async with slots.running:
+                return self.report
+        async with slots.running:
+            profile = self.profile()
+            if profile is None:
+                self.report = {}
+                return self.report
+
+            try:
+                connected = await self.list_devices()
+            except (OSError, RuntimeError) as e:
+                logging.info(f"Reconcile skipped, adb server unavailable: {e}")
+                return self.report
+            serials = [serial for serial, device_state in connected.items() if device_state == "device"]
+            if profile["devices"]:
+                serials = [serial for serial in serials if serial in profile["devices"]]
+
+            apk_sha256 = None
+            if profile["apk_name"] and os.path.exists(os.path.join(self.apk_dir, profile["apk_name"])):
+                apk_sha256 = await run_in_executor(
+                    self.scheduler.executor, file_sha256, os.path.join(self.apk_dir, profile["apk_name"])
+                )
+
+            async def run(serial):
+                async with slots.devices:
+                    return serial, await self._reconcile_device(serial, profile, apk_sha256)
+
+            serials = await run_in_executor(None, self.state.leased, serials)
+            self.report = dict(await asyncio.gather(*[run(serial) for serial in serials]))
+            changed = [serial for serial, outcome in self.report.items() if outcome["actions"]]
+            if changed:
+                logging.info(f"Reconciled {len(changed)} of {len(serials)} headsets with profile {profile['name']!r}")
+            return self.report
+
+    async def _observe(self, serial: str, device) -> dict:
+        cached = self.observed.get(serial)
+        if cached is not None and time.monotonic() - cached[0] < self.observe_ttl:
+            return cached[1]
+        output = await self.scheduler.submit(serial, Priority.STATUS, device.shell, OBSERVE_COMMAND, key="observe")
+        observed = parse_observed(output)
+        self.observed[serial] = (time.monotonic(), observed)
+        return observed
+
+    async def _reconcile_device(self, serial: str, profile: dict, apk_sha256: str) -> dict:
+        outcome = {"in_line": True, "actions": [], "error": None}
+        try:
+            device = self.client.device(serial)
+            if device is None:
+                raise RuntimeError("not connected")
+            observed = await self._observe(serial, device)
+            todo = plan(profile, observed, self.installed.get(serial), apk_sha256)
+            if not todo["install"] and not todo["shell"]:
+                return outcome
+
+            outcome["in_line"] = False
+            with span("reconcile", "fleet", serial=serial):
+                for apk_name in todo["install"]:
+                    sha256 = apk_sha256 if apk_name == profile["apk_name"] else None
+                    if await self._install(serial, device, apk_name, sha256, outcome) and sha256 is not None:
+                        self.installed.setdefault(serial, {})[apk_name] = sha256
+                if todo["shell"]:
+                    await self.scheduler.submit(serial, Priority.INSTALL, device.shell, "; ".join(todo["shell"]))
+                    outcome["actions"].extend(todo["shell"])
+                    record_applied(serial, **{
+                        key: profile[key] for key in ("volume", "screen_off_timeout") if profile[key] is not None
+                    })
+        except (RuntimeError, OSError) as e:
+            outcome["error"] = str(e)
+        finally:
+            if outcome["actions"]:
+                self.forget(serial)
+        return outcome
+
+    async def _install(self, serial: str, device, apk_name: str, sha256: str, outcome: dict) -> bool:
+        """
+            Installs an APK on a headset, unless the same one failed there too recently.
+
+        :return: whether it was installed, if not why is the outcome's error
+        """
+        key = (serial, apk_name, sha256)
+        failures, next_attempt = self.install_failures.get(key, (0, 0.0))
+        if time.monotonic() < next_attempt:
+            outcome["error"] = (
+                f"{apk_name} failed to install {failures} times, next try in {next_attempt - time.monotonic():.0f}s"
+            )
+            return False
+        try:
+            async with self._loop_slots().installs:
+                await self.scheduler.submit(
+                    serial, Priority.INSTALL, apk_install.install, device, os.path.join(self.apk_dir, apk_name)
+                )
+        except (InstallError, OSError, RuntimeError) as e:
+            failures += 1
+            delay = backoff_delay(failures, self.install_retry_s, self.install_retry_max_s, 0.1)
+            self.install_failures[key] = (failures, time.monotonic() + delay)
+            logging.info(f"Installing {apk_name} on {serial} failed ({failures} times), next try in {delay:.0f}s: {e}")
+            outcome["error"] = str(e)
+            return False
+        self.install_failures.pop(key, None)
+        outcome["actions"].append(f"installed {apk_name}")
+        return True
@@ -0,0 +1,208 @@
+"""
+Reconnecting headsets whose wifi dropped, without anyone having to remove and re-add them.
+
+Every wifi headset seen by adb is remembered (in a set in the shared state, so it survives restarts and workers
+remembering and forgetting headsets at once don't undo each other). Each check the supervisor
+looks at every remembered headset: one that has dropped out of adb (or whose port stops answering for
+attempts_before_removing_dead_device checks in a row) is reconnected (remote_connect), retrying with exponential
+backoff plus jitter so a room full of headsets coming back after a router restart doesn't all retry in lockstep.
+
+When a headset comes back its boot id is compared with the one it had before. Only if it has rebooted (so its volume
+and screen timeout are back to defaults) are the connect actions applied again, a wifi blip needs nothing redone.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+
+from helpers import wait_host_port, device_maybe_dead, attempts_before_removing_dead_device, forget_applied_config
+from scheduler import Priority
+from tracing import span, run_in_executor
+
+RECONNECT_INTERVAL_S = float(os.environ.get("SIMU_RECONNECT_INTERVAL_S", 5))
+KNOWN_DEVICES = "known_devices"
+BOOT_ID_COMMAND = "cat /proc/sys/kernel/random/boot_id"
+
+
+def backoff_delay(failures: int, base: float, maximum: float, jitter: float) -> float:
+    """
+        Seconds to wait before the next attempt: base * 2^(failures - 1), capped at maximum, +/- jitter (a fraction).
+    """
+    delay = min(maximum, base * 2 ** max(0, failures - 1))
+    return delay * (1 + random.uniform(-jitter, jitter))
+
+
+class DeviceHealth:
+    def __init__(self, serial: str):
+        self.serial = serial
+        self.boot_id = None
+        self.down_since = None
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.reconnections = 0
+        self.recovery_times = []
+
+    def to_dict(self):
+        return {
+            "serial": self.serial,
+            "status": "down" if self.down_since else "up",
+            "down_for_s": round(time.monotonic() - self.down_since, 1) if self.down_since else 0,
+            "failed_attempts": self.failures,
+            "next_attempt_in_s": round(max(0.0, self.next_attempt - time.monotonic()), 1) if self.down_since else None,
+            "reconnections": self.reconnections,
+            "last_recovery_s": self.recovery_times[-1] if self.recovery_times else None,
+            "mean_recovery_s": round(sum(self.recovery_times) / len(self.recovery_times), 2)
+            if self.recovery_times else None,
+        }
+
+
+class ReconnectSupervisor:
+    def __init__(self, tracker, scheduler, client, configure, state, base_delay=2.0, max_delay=120.0, jitter=0.3):
+        """
+        :param tracker: the DeviceTracker, for what adb currently has connected
+        :param scheduler: the DeviceScheduler, boot id checks and connect actions go through it
+        :param client: the ppadb client
+        :param configure: plain function given a serial, re-applies the connect actions
+        :param state: the StateBackend, remembered headsets are kept there and only leased headsets are looked after
+        :param base_delay: seconds before the first retry, doubled after every failed attempt
+        :param max_delay: longest wait between attempts
+        :param jitter: fraction each wait is randomly varied by
+        """
+        self.tracker = tracker
+        self.scheduler = scheduler
+        self.client = client
+        self.configure = configure
+        self.state = state
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.health = {}
+        # remembered before they were kept as a set, as a list value under the same name
+        for serial in state.get(KNOWN_DEVICES) or []:
+            state.add_member(KNOWN_DEVICES, serial)
+        state.delete(KNOWN_DEVICES)
+
+    # these block on the state backend, from the event loop run them on a thread
+
+    def known(self):
+        return self.state.members(KNOWN_DEVICES)
+
+    def remember(self, serial: str):
+        self.state.add_member(KNOWN_DEVICES, serial)
+
+    def forget(self, serial: str):
+        """
+            Stops looking after a headset, ie: once it has been deliberately disconnected.
+        """
+        self.state.remove_member(KNOWN_DEVICES, serial)
+        self.health.pop(serial, None)
+        device_maybe_dead.pop(serial, None)
+        forget_applied_config(serial)
+
+    def stats(self):
+        return {serial: health.to_dict() for serial, health in self.health.items()}
+
+    async def check(self):
+        """
+            One pass over every remembered headset, run every RECONNECT_INTERVAL_S.
+
+        :return: the headsets that dropped off or came back during this pass
+        """
+        try:
+            connected = await self.tracker.list_devices()
+        except (OSError, RuntimeError) as e:
+            logging.info(f"Reconnect check skipped, adb server unavailable: {e}")
+            return []
+
+        def leased_known():
+            for serial, device_state in connected.items():
+                if ":" in serial and device_state == "device":
+                    self.remember(serial)
+            return self.state.leased(self.known())
+
+        # the state backend blocks, on sqlite's locks or redis' round trips
+        serials = await run_in_executor(None, leased_known)
+        before = {serial: self.is_down(serial) for serial in serials}
+        await asyncio.gather(*[self._check_device(serial, connected.get(serial)) for serial in serials])
+        return [serial for serial in serials if self.is_down(serial) != before[serial]]
+
+    def is_down(self, serial: str) -> bool:
+        health = self.health.get(serial)
+        return health is not None and health.down_since is not None
+
+    async def _check_device(self, serial: str, device_state: str):
+        health = self.health.setdefault(serial, DeviceHealth(serial))
+
+        if health.down_since is None:
+            if device_state == "device" and await self._reachable(serial):
+                device_maybe_dead.pop(serial, None)
+                if health.boot_id is None:
+                    health.boot_id = await self._boot_id(serial)
+                return
+            device_maybe_dead[serial] = device_maybe_dead.get(serial, 0) + 1
+            if device_state == "device" and device_maybe_dead[serial] < attempts_before_removing_dead_device:
+                return
+            logging.info(f"{serial} has dropped off the wifi, reconnecting")
+            health.down_since = time.monotonic()
+            health.next_attempt = 0.0
+
+        if time.monotonic() < health.next_attempt:
+            return
+        if await self._reconnect(serial, device_state):
+            await self._recovered(health)
+        else:
+            health.failures += 1
+            health.next_attempt = time.monotonic() + backoff_delay(
+                health.failures, self.base_delay, self.max_delay, self.jitter
+            )
+
+    async def _reachable(self, serial: str) -> bool:
+        host, _, port = serial.partition(":")
+        return await wait_host_port(host, int(port or 5555), duration=1, delay=0)
+
+    async def _reconnect(self, serial: str, device_state: str) -> bool:
+        host, _, port = serial.partition(":")
+
+        def connect():
+            if device_state is not None:
+                # adb keeps stale 'offline' entries around, which stop it connecting again
+                self.client.remote_disconnect(host, int(port))
+            return self.client.remote_connect(host, int(port))
+
+        with span("reconnect", "adb", serial=serial):
+            try:
+                connected = await run_in_executor(self.scheduler.executor, connect)
+            except RuntimeError as e:
+                logging.info(f"Reconnecting {serial} failed: {e}")
+                return False
+        return connected and await self._reachable(serial)
+
+    async def _boot_id(self, serial: str):
+        try:
+            device = self.client.device(serial)
+            if device is None:
+                return None
+            output = await self.scheduler.submit(serial, Priority.STATUS, device.shell, BOOT_ID_COMMAND, key="boot-id")
+        except RuntimeError:
+            return None
+        return output.strip() or None
+
+    async def _recovered(self, health: DeviceHealth):
+        took = round(time.monotonic() - health.down_since, 2)
+        health.recovery_times = (health.recovery_times + [took])[-20:]
+        health.reconnections += 1
+        health.down_since = None
+        health.failures = 0
+        device_maybe_dead.pop(health.serial, None)
+
+        boot_id = await self._boot_id(health.serial)
+        rebooted = boot_id is None or health.boot_id is None or boot_id != health.boot_id
+        health.boot_id = boot_id
+        logging.info(f"{health.serial} reconnected after {took}s{', it rebooted so reapplying settings' if rebooted else ''}")
+        if rebooted:
+            forget_applied_config(health.serial)
+            try:
+                await self.scheduler.submit(health.serial, Priority.CONTROL, self.configure, health.serial)
+            except RuntimeError as e:
+                logging.info(f"Could not reapply settings on {health.serial}: {e}")
@@ -0,0 +1,187 @@
+"""
+Per-device command scheduling.
+
+Every headset gets its own serial queue so commands to one device never interleave, and the queue is ordered by
+priority so a /stop is never stuck behind a pile of screenshot and battery polls:
+
+    CONTROL > INSTALL > STATUS > THUMBNAIL
+
+While a control command is queued or running for a device, status and thumbnail work for that device is dropped
+(CommandDropped is raised, which callers already treat like any other RuntimeError from adb). Status polls that ask the
+same question (the same key) while one is already queued share its result rather than queueing again.
+
+Plain functions (ppadb's blocking calls) are run on a thread pool, coroutine functions are awaited directly.
+"""
+import asyncio
+import enum
+import heapq
+import inspect
+import itertools
+import logging
+import os
+import weakref
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from log_setup import log_context
+from tracing import span, run_in_executor
+
+
+class Priority(enum.IntEnum):
+    CONTROL = 0
+    INSTALL = 1
+    STATUS = 2
+    THUMBNAIL = 3
+
+
+class CommandDropped(RuntimeError):
+    pass
+
+
+class _Job:
+    def __init__(self, priority: Priority, order: int, func, args, kwargs, key, future):
+        self.priority = priority
+        self.order = order
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = future
+
+    def __lt__(self, other):
+        return (self.priority, self.order) < (other.priority, other.order)
+
+
+class _LoopQueues:
+    """
+        The queues of one event loop: their futures and tasks belong to it. The server only ever has the one, the test
+        client runs each request on a loop of its own.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.running = {}
+        self.keyed = {}
+        self.control = Counter()
+
+
+class DeviceScheduler:
+    def __init__(self, threads: int = None):
+        """
+        :param threads: size of the thread pool blocking adb calls run on, defaults to SIMU_ADB_THREADS or 32.
+        """
+        self.threads = threads or int(os.environ.get("SIMU_ADB_THREADS", 32))
+        self._executor = None
+        self._loops = weakref.WeakKeyDictionary()
+        self._order = itertools.count()
+        self.stats = Counter()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="adb")
+        return self._executor
+
+    def _loop_queues(self) -> _LoopQueues:
+        loop = asyncio.get_running_loop()
+        queues = self._loops.get(loop)
+        if queues is None:
+            queues = self._loops[loop] = _LoopQueues()
+        return queues
+
+    async def submit(self, device_serial: str, priority: Priority, func, *args, key: str = None, **kwargs):
+        """
+            Queues func(*args, **kwargs) for the device and waits for its result.
+
+        :param device_serial: the device the command is for, commands to the same device run one at a time
+        :param priority: the Priority class of the command
+        :param func: a plain function (run on a thread) or a coroutine function
+        :param key: status/thumbnail commands with the same key share one queued job
+        :raises CommandDropped: if low priority work was dropped because a control command is pending
+        """
+        state = self._loop_queues()
+
+        if priority >= Priority.STATUS and state.control[device_serial]:
+            self.stats["dropped"] += 1
+            raise CommandDropped(f"{device_serial} is busy with a control command")
+
+        if key is not None:
+            existing = state.keyed.get((device_serial, key))
+            if existing is not None and not existing.done():
+                self.stats["coalesced"] += 1
+                return await asyncio.shield(existing)
+
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(priority, next(self._order), func, args, kwargs, key, future)
+        if key is not None:
+            state.keyed[(device_serial, key)] = future
+        if priority == Priority.CONTROL:
+            state.control[device_serial] += 1
+            self._drop_low_priority(state, device_serial)
+
+        heapq.heappush(state.queues.setdefault(device_serial, []), job)
+        self.stats["submitted"] += 1
+        if device_serial not in state.running:
+            state.running[device_serial] = asyncio.ensure_future(self._drain(state, device_serial))
+
+        return await asyncio.shield(future)
+
+    def _drop_low_priority(self, state: _LoopQueues, device_serial: str):
+        for job in state.queues.get(device_serial, []):
+            if job.priority >= Priority.STATUS and not job.future.done():
+                job.future.set_exception(CommandDropped(f"{device_serial} is busy with a control command"))
+                # nobody may be waiting any more (shielded), stop asyncio warning about it
+                job.future.exception()
+                self.stats["dropped"] += 1
+
+    async def _drain(self, state: _LoopQueues, device_serial: str):
+        queue = state.queues[device_serial]
+        try:
+            while queue:
+                job = heapq.heappop(queue)
+                try:
+                    if job.future.done():
+                        continue
+                    await self._run(device_serial, job)
+                finally:
+                    if job.priority == Priority.CONTROL:
+                        state.control[device_serial] -= 1
+                    if job.key is not None and state.keyed.get((device_serial, job.key)) is job.future:
+                        del state.keyed[(device_serial, job.key)]
+        finally:
+            state.running.pop(device_serial, None)
+
+    async def _run(self, device_serial: str, job: _Job):
+        name = getattr(job.func, "__name__", "command")
+        with span(name, "adb", serial=device_serial, priority=job.priority.name), \
+                log_context(serial=device_serial, action=job.key or name):
+            try:
+                if inspect.iscoroutinefunction(job.func):
+                    result = await job.func(*job.args, **job.kwargs)
+                else:
+                    result = await run_in_executor(self.executor, lambda: job.func(*job.args, **job.kwargs))
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                    job.future.exception()
+                self.stats["failed"] += 1
+                logging.info(f"{job.priority.name} command on {device_serial} failed: {e}")
+                return
+        if not job.future.done():
+            job.future.set_result(result)
+        self.stats["completed"] += 1
+
+    def queue_depths(self):
+        depths = Counter()
+        for state in list(self._loops.values()):
+            for serial, queue in state.queues.items():
+                depths[serial] += len(queue)
+        return {serial: depth for serial, depth in depths.items() if depth}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+scheduler = DeviceScheduler()
@@ -0,0 +1,467 @@
+"""
+A record of what each headset showed during a session, kept from the thumbnails the pages already ask for.
+
+While archiving is on (SIMU_ARCHIVE=1, or /screen-archive/start) the thumbnails made for /device-screen are kept as
+small JPEGs: at most one every SIMU_ARCHIVE_INTERVAL_S seconds per headset (default 2), and only when the screen
+changed. No extra screencaps are taken. Per headset (the serial url-quoted) the archive holds segments of:
+
+    <serial>/<first frame ms>.seg   the JPEGs, one after the other, only ever appended to
+    <serial>/<first frame ms>.idx   INDEX_RECORD per frame: its time, offset and length in the .seg
+
+A new segment is started every SEGMENT_BYTES. The whole archive is kept under SIMU_ARCHIVE_BUDGET_MB (default 512) by
+deleting the oldest segments first, whichever headset they belong to.
+
+Every uvicorn worker records into the same archive. Whether archiving is on is kept in the shared state backend, so
+/screen-archive/start and /stop switch it for every worker, each reading it again at most every ENABLED_TTL_S.
+Appending and evicting take the archive's lock file exclusively, reading it takes it shared, and each change is counted
+in the lock file: a worker that finds the count moved on since it last looked reads the sizes from disk again rather
+than trusting its own. A frame is not kept if another worker archived one of the headset within the interval, so
+browsers on several workers don't each add the same screen.
+
+export() turns the archive into an MJPEG .avi time-lapse, of one headset or of several side by side in a grid. Frames
+are found through the indexes and read with a seek each, so an export never reads the rest of the archive, and a
+single headset's JPEGs are copied into the video without being decoded.
+"""
+import base64
+import bisect
+import contextlib
+import hashlib
+import math
+import os
+import shutil
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import image_pipeline
+from tracing import run_in_executor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+ARCHIVE_DIR = os.environ.get("SIMU_ARCHIVE_DIR", "screen_archive")
+INDEX_RECORD = struct.Struct("<dII")
+ENABLED_KEY = "screen_archive_enabled"
+ENABLED_TTL_S = 2
+LOCK_NAME = ".lock"
+CHANGES = struct.Struct("<Q")
+SEGMENT_BYTES = 4 * 1024 * 1024
+# JPEG start of frame markers, the ones carrying the image size
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data: bytes) -> tuple:
+    """
+        (width, height) of a JPEG, read from its header.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG")
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            raise ValueError("Corrupt JPEG")
+        marker = data[i + 1]
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5: i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", data[i + 2: i + 4])[0]
+    raise ValueError("No size in JPEG")
+
+
+class AviWriter:
+    """
+        Writes JPEG frames into a Motion JPEG .avi, which every video player understands. The headers are written
+        last, once the frame count is known, so frames never need to be held in memory.
+    """
+    HEADER_BYTES = 12 + 200 + 12
+
+    def __init__(self, f, fps: float):
+        self.f = f
+        self.fps = fps
+        self.size = None
+        self.index = []
+        self.f.write(b"\0" * self.HEADER_BYTES)
+
+    def add(self, jpeg: bytes):
+        if self.size is None:
+            self.size = jpeg_size(jpeg)
+        # offsets are from the 'movi' fourcc
+        self.index.append((self.f.tell() - (self.HEADER_BYTES - 4), len(jpeg)))
+        self.f.write(b"00dc" + struct.pack("<I", len(jpeg)) + jpeg + b"\0" * (len(jpeg) % 2))
+
+    def close(self):
+        movi_end = self.f.tell()
+        self.f.write(b"idx1" + struct.pack("<I", 16 * len(self.index)))
+        for offset, length in self.index:
+            self.f.write(struct.pack("<4sIII", b"00dc", 0x10, offset, length))
+        end = self.f.tell()
+
+        width, height = self.size or (0, 0)
+        frames = len(self.index)
+        largest = max((length for _, length in self.index), default=0)
+        avih = struct.pack(
+            "<14I", int(1000000 / self.fps), int(largest * self.fps), 0, 0x10, frames, 0, 1, largest, width, height,
+            0, 0, 0, 0,
+        )
+        strh = struct.pack(
+            "<4s4sIHHIIIIIIII4h", b"vids", b"MJPG", 0, 0, 0, 0, 1000, int(self.fps * 1000), 0, frames, largest,
+            0xFFFFFFFF, 0, 0, 0, width, height,
+        )
+        strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+        strl = b"strh" + struct.pack("<I", len(strh)) + strh + b"strf" + struct.pack("<I", len(strf)) + strf
+        hdrl = (
+            b"avih" + struct.pack("<I", len(avih)) + avih
+            + b"LIST" + struct.pack("<I", 4 + len(strl)) + b"strl" + strl
+        )
+        header = (
+            b"RIFF" + struct.pack("<I", end - 8) + b"AVI "
+            + b"LIST" + struct.pack("<I", 4 + len(hdrl)) + b"hdrl" + hdrl
+            + b"LIST" + struct.pack("<I", movi_end - (self.HEADER_BYTES - 4)) + b"movi"
+        )
+        assert len(header) == self.HEADER_BYTES
+        self.f.seek(0)
+        self.f.write(header)
+        self.f.seek(end)
+
+
+class ScreenArchive:
+    def __init__(self, directory: str = ARCHIVE_DIR, budget_mb: float = None, interval_s: float = None,
+                 quality: int = 70, segment_bytes: int = SEGMENT_BYTES, state=None):
+        """
+        :param directory: where the archive is kept
+        :param budget_mb: disk space the archive may use, defaults to SIMU_ARCHIVE_BUDGET_MB or 512
+        :param interval_s: least time between two frames of a headset, defaults to SIMU_ARCHIVE_INTERVAL_S or 2
+        :param quality: JPEG quality of the frames
+        :param segment_bytes: size at which a headset's segment is closed and a new one started
+        :param state: the StateBackend archiving is switched on and off in, None when this is the only worker
+        """
+        self.directory = directory
+        self.budget = int((budget_mb or float(os.environ.get("SIMU_ARCHIVE_BUDGET_MB", 512))) * 1024 * 1024)
+        self.interval_s = interval_s if interval_s is not None else float(os.environ.get("SIMU_ARCHIVE_INTERVAL_S", 2))
+        self.quality = quality
+        self.segment_bytes = segment_bytes
+        self.state = state
+        self.enabled = os.environ.get("SIMU_ARCHIVE") == "1"
+        # monotonic time enabled was last read from the state
+        self._enabled_at = None
+        self._executor = None
+        self.segments = None
+        self.used = 0
+        # the change count in the lock file as of when self.segments was last right
+        self._changes = None
+        self._last = {}
+        self.stats = {"recorded": 0, "unchanged": 0, "evicted_segments": 0}
+
+    @property
+    def executor(self):
+        """
+            Appends, evictions and exports all run on this one thread, so they never see each other half done.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="screen-archive")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def switch(self, enabled: bool):
+        """
+            Turns archiving on or off, for every worker. Blocks on the state backend.
+        """
+        self.enabled = enabled
+        if self.state is not None:
+            self.state.set(ENABLED_KEY, enabled)
+            self._enabled_at = time.monotonic()
+
+    def _read_enabled(self) -> bool:
+        if self.state is not None:
+            self._enabled_at = time.monotonic()
+            self.enabled = bool(self.state.get(ENABLED_KEY, self.enabled))
+        return self.enabled
+
+    async def is_enabled(self) -> bool:
+        """
+            Whether archiving is on, as last switched by any worker.
+        """
+        if self.state is not None and (
+            self._enabled_at is None or time.monotonic() - self._enabled_at > ENABLED_TTL_S
+        ):
+            # not read again by the thumbnails arriving meanwhile
+            self._enabled_at = time.monotonic()
+            return await run_in_executor(None, self._read_enabled)
+        return self.enabled
+
+    def _device_dir(self, serial: str) -> str:
+        return os.path.join(self.directory, quote(serial, safe=""))
+
+    def _path(self, serial: str, segment: dict, extension: str) -> str:
+        return os.path.join(self._device_dir(serial), f"{segment['start']}{extension}")
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive: bool = False):
+        """
+            Holds the archive's lock file, shared with the other workers, with self.segments up to date.
+
+        :param exclusive: to change the archive, rather than read it
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, LOCK_NAME), os.O_RDWR | os.O_CREAT)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            data = os.pread(fd, CHANGES.size, 0)
+            changes = CHANGES.unpack(data)[0] if len(data) == CHANGES.size else 0
+            if changes != self._changes:
+                self.segments = None
+                self._changes = changes
+            self._load()
+            try:
+                yield
+            except BaseException:
+                # it may have been left half changed, read it again next time
+                self.segments = None
+                raise
+            finally:
+                if exclusive:
+                    self._changes = changes + 1
+                    os.pwrite(fd, CHANGES.pack(self._changes), 0)
+        finally:
+            # closing it lets go of the lock
+            os.close(fd)
+
+    def _load(self):
+        """
+            Reads what is already archived (only the sizes and the first and last index records), the first time the
+            archive is used and whenever another worker changed it.
+        """
+        if self.segments is not None:
+            return
+        self.segments = {}
+        self.used = 0
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            device_dir = os.path.join(self.directory, name)
+            if not os.path.isdir(device_dir):
+                continue
+            segments = []
+            for index_name in sorted((n for n in os.listdir(device_dir) if n.endswith(".idx")), key=lambda n: int(n[:-4])):
+                index_path = os.path.join(device_dir, index_name)
+                frames = os.path.getsize(index_path) // INDEX_RECORD.size
+                if frames == 0:
+                    continue
+                with open(index_path, "rb") as f:
+                    first = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))[0]
+                    f.seek((frames - 1) * INDEX_RECORD.size)
+                    last = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))[0]
+                segment_path = index_path[:-4] + ".seg"
+                size = os.path.getsize(index_path) + (os.path.getsize(segment_path) if os.path.exists(segment_path) else 0)
+                segments.append({"start": int(index_name[:-4]), "frames": frames, "bytes": size, "first": first, "last": last})
+                self.used += size
+            if segments:
+                self.segments[unquote(name)] = segments
+
+    async def record(self, serial: str, thumbnail: str, executor=None) -> bool:
+        """
+            Keeps a thumbnail, if archiving is on and the headset's last frame is old enough and different.
+
+        :param serial: the headset
+        :param thumbnail: the base64 png, as from ImageWorkerPool.thumbnail
+        :param executor: where to convert it to JPEG, ie: the image worker pool
+        :return: whether it was kept
+        """
+        if not self.enabled or not thumbnail:
+            return False
+        now = time.time()
+        png = base64.b64decode(thumbnail)
+        digest = hashlib.sha1(png).digest()
+        last = self._last.get(serial)
+        if last is not None and now - last[0] < self.interval_s:
+            return False
+        self._last[serial] = (now, digest)
+        if last is not None and last[1] == digest:
+            self.stats["unchanged"] += 1
+            return False
+
+        jpeg = await run_in_executor(executor, image_pipeline.png_to_jpeg, png, self.quality)
+        if jpeg is None:
+            return False
+        return await run_in_executor(self.executor, self.append, serial, jpeg, now, self.interval_s)
+
+    def append(self, serial: str, jpeg: bytes, timestamp: float, min_gap: float = 0) -> bool:
+        """
+            Adds a frame to the headset's current segment, then makes room if the archive is over budget.
+
+        :param min_gap: seconds, the frame is dropped if the headset's last archived frame (ie: by another worker) is
+            more recent than that
+        :return: whether it was added
+        """
+        with self._locked(exclusive=True):
+            segments = self.segments.get(serial)
+            if min_gap and segments and timestamp - segments[-1]["last"] < min_gap:
+                self.stats["unchanged"] += 1
+                return False
+            self._append(serial, jpeg, timestamp)
+            self._evict()
+        return True
+
+    def _append(self, serial: str, jpeg: bytes, timestamp: float):
+        segments = self.segments.setdefault(serial, [])
+        if not segments or segments[-1]["bytes"] >= self.segment_bytes:
+            os.makedirs(self._device_dir(serial), exist_ok=True)
+            start = int(timestamp * 1000)
+            if segments and start <= segments[-1]["start"]:
+                start = segments[-1]["start"] + 1
+            segments.append({"start": start, "frames": 0, "bytes": 0, "first": timestamp, "last": timestamp})
+        segment = segments[-1]
+        with open(self._path(serial, segment, ".seg"), "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(jpeg)
+        with open(self._path(serial, segment, ".idx"), "ab") as f:
+            f.write(INDEX_RECORD.pack(timestamp, offset, len(jpeg)))
+        segment["frames"] += 1
+        segment["bytes"] += len(jpeg) + INDEX_RECORD.size
+        segment["last"] = timestamp
+        self.used += len(jpeg) + INDEX_RECORD.size
+        self.stats["recorded"] += 1
+
+    def _evict(self):
+        while self.used > self.budget and self.segments:
+            serial = min(self.segments, key=lambda each: self.segments[each][0]["first"])
+            segment = self.segments[serial].pop(0)
+            for extension in (".seg", ".idx"):
+                try:
+                    os.remove(self._path(serial, segment, extension))
+                except FileNotFoundError:
+                    pass
+            self.used -= segment["bytes"]
+            self.stats["evicted_segments"] += 1
+            if not self.segments[serial]:
+                del self.segments[serial]
+                shutil.rmtree(self._device_dir(serial), ignore_errors=True)
+
+    def summary(self) -> dict:
+        self._read_enabled()
+        with self._locked():
+            return self._summary()
+
+    def _summary(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "budget_mb": round(self.budget / 1024 / 1024, 1),
+            "used_mb": round(self.used / 1024 / 1024, 2),
+            "devices": {
+                serial: {
+                    "frames": sum(segment["frames"] for segment in segments),
+                    "first": segments[0]["first"],
+                    "last": segments[-1]["last"],
+                }
+                for serial, segments in self.segments.items()
+            },
+            **self.stats,
+        }
+
+    def frames(self, serial: str, start: float = None, end: float = None) -> list:
+        """
+            The archived frames of a headset between two times, as [(time, segment path, offset, length)].
+        """
+        with self._locked():
+            return self._frames(serial, start, end)
+
+    def _frames(self, serial: str, start: float = None, end: float = None) -> list:
+        start = start if start is not None else 0
+        end = end if end is not None else math.inf
+        frames = []
+        for segment in self.segments.get(serial, []):
+            if segment["last"] < start or segment["first"] > end:
+                continue
+            segment_path = self._path(serial, segment, ".seg")
+            with open(self._path(serial, segment, ".idx"), "rb") as f:
+                records = f.read(segment["frames"] * INDEX_RECORD.size)
+            for timestamp, offset, length in INDEX_RECORD.iter_unpack(records):
+                if start <= timestamp <= end:
+                    frames.append((timestamp, segment_path, offset, length))
+        return frames
+
+    def export(self, path: str, serials: list, start: float = None, end: float = None, fps: float = 10,
+               max_frames: int = 3000, grid: bool = None) -> int:
+        """
+            Writes a time-lapse of the archive to an .avi file.
+
+        :param path: the file to write
+        :param serials: the headsets to include
+        :param start: unix time of the first frame, defaults to the start of the archive
+        :param end: unix time of the last frame, defaults to the end of the archive
+        :param fps: frames per second of the video
+        :param max_frames: longer spans are sampled evenly down to this many frames
+        :param grid: one tile per headset, always the case for more than one headset
+        :return: how many frames were written, 0 meaning nothing was archived then
+        """
+        # no worker may evict the segments while they are read
+        with self._locked():
+            return self._export(path, serials, start, end, fps, max_frames, grid)
+
+    def _export(self, path: str, serials: list, start: float, end: float, fps: float, max_frames: int,
+                grid: bool) -> int:
+        per_device = {serial: self._frames(serial, start, end) for serial in serials}
+        per_device = {serial: frames for serial, frames in per_device.items() if frames}
+        if not per_device:
+            return 0
+        grid = grid or len(per_device) > 1
+        with open(path, "wb") as f:
+            writer = AviWriter(f, fps)
+            if grid:
+                self._write_grid(writer, per_device, max_frames)
+            else:
+                frames = next(iter(per_device.values()))
+                step = max(1, math.ceil(len(frames) / max_frames))
+                for _, segment_path, offset, length in frames[::step]:
+                    writer.add(self._read(segment_path, offset, length))
+            writer.close()
+            return len(writer.index)
+
+    @staticmethod
+    def _read(segment_path: str, offset: int, length: int) -> bytes:
+        with open(segment_path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _write_grid(self, writer: AviWriter, per_device: dict, max_frames: int):
+        """
+            Each frame of the video shows, per headset, the last frame archived by then. Only frames that are shown
+            are read and decoded, and each of them once.
+        """
+        image_pipeline.load_opencv()
+        np = image_pipeline.np
+        first = min(frames[0][0] for frames in per_device.values())
+        last = max(frames[-1][0] for frames in per_device.values())
+        count = min(max_frames, max(len(frames) for frames in per_device.values()))
+        times = [first + (last - first) * i / max(1, count - 1) for i in range(count)]
+
+        sizes = [jpeg_size(self._read(*frames[0][1:])) for frames in per_device.values()]
+        tile_width, tile_height = max(size[0] for size in sizes), max(size[1] for size in sizes)
+        columns = math.ceil(math.sqrt(len(per_device)))
+        rows = math.ceil(len(per_device) / columns)
+        canvas = np.zeros((rows * tile_height, columns * tile_width, 3), np.uint8)
+        frame_times = {serial: [frame[0] for frame in frames] for serial, frames in per_device.items()}
+        shown = {}
+        for moment in times:
+            for tile, (serial, frames) in enumerate(per_device.items()):
+                position = bisect.bisect_right(frame_times[serial], moment) - 1
+                if position < 0 or shown.get(serial) == position:
+                    continue
+                shown[serial] = position
+                image = image_pipeline.decode(self._read(*frames[position][1:]))
+                if image is None:
+                    continue
+                image = image[:tile_height, :tile_width]
+                y, x = (tile // columns) * tile_height, (tile % columns) * tile_width
+                canvas[y: y + tile_height, x: x + tile_width] = 0
+                canvas[y: y + image.shape[0], x: x + image.shape[1]] = image
+            writer.add(image_pipeline.encode_jpeg(canvas, 80))
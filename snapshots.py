@@ -0,0 +1,95 @@
+"""
+Short lived, shared results for the endpoints every open browser polls.
+
+A Snapshot holds the last result of an expensive refresh (scanning the fleet) for a few seconds. Every caller in that
+window is served from memory, and when it expires only one refresh runs at a time: concurrent callers all wait for
+that same refresh instead of each starting their own.
+
+With stale_ttl set, an expired value is still served for that much longer while a refresh runs in the background
+(stale-while-revalidate), so callers only ever wait on a refresh when there is nothing usable at all.
+
+invalidate() starts a new generation: a refresh already running from before it (which may have missed the device just
+connected) is neither kept as the value nor shared with callers arriving after it, they wait for a refresh of their own.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import weakref
+
+
+class Snapshot:
+    def __init__(self, refresh, ttl: float, stale_ttl: float = 0):
+        """
+        :param refresh: coroutine function producing the new value
+        :param ttl: seconds a value is served before it is refreshed
+        :param stale_ttl: seconds after ttl that the old value is still served while refreshing in the background
+        """
+        self.refresh = refresh
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.value = None
+        self.etag = None
+        self.updated_at = 0.0
+        self.generation = 0
+        # per event loop, the refresh running on it and the generation it started in
+        self._refreshing = weakref.WeakKeyDictionary()
+
+    @property
+    def age(self):
+        return time.monotonic() - self.updated_at
+
+    def fresh(self):
+        return self.updated_at > 0 and self.age < self.ttl
+
+    def usable(self):
+        return self.updated_at > 0 and self.age < self.ttl + self.stale_ttl
+
+    def invalidate(self):
+        """
+            Makes the next get() wait for a refresh, ie: after a device has been connected or removed.
+        """
+        self.updated_at = 0.0
+        self.generation += 1
+
+    async def get(self):
+        if self.fresh():
+            return self.value
+        if self.usable():
+            already_refreshing = self._refreshing.get(asyncio.get_running_loop(), (None, None))[1]
+            refreshing = self._start_refresh()
+            if refreshing is not already_refreshing:
+                refreshing.add_done_callback(self._log_background_failure)
+            return self.value
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        generation, refreshing = self._refreshing.get(loop, (None, None))
+        if refreshing is None or generation != self.generation:
+            refreshing = asyncio.ensure_future(self._run_refresh(loop, self.generation))
+            self._refreshing[loop] = (self.generation, refreshing)
+        return refreshing
+
+    async def _run_refresh(self, loop, generation: int):
+        try:
+            value = await self.refresh()
+            if generation == self.generation:
+                self.value = value
+                self.etag = make_etag(value)
+                self.updated_at = time.monotonic()
+            return value
+        finally:
+            if self._refreshing.get(loop, (None, None))[1] is asyncio.current_task():
+                del self._refreshing[loop]
+
+    @staticmethod
+    def _log_background_failure(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logging.info(f"Background refresh failed, still serving the old value: {task.exception()}")
+
+
+def make_etag(value) -> str:
+    body = json.dumps(value, sort_keys=True, default=str).encode()
+    return '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
@@ -1,3 +1,5 @@
+import json
+
 from sqlalchemy.orm import Session
 
 from . import models, schemas
@@ -22,6 +24,21 @@ def create_apk_details_item(db: Session, item: schemas.APKDetailsCreate):
     return db_item
 
 
+def get_apk_details_by_sha256(db: Session, sha256: str):
+    return db.query(models.APKDetails).filter(models.APKDetails.sha256 == sha256, models.APKDetails.package_name != None).first()
+
+
+def set_apk_manifest(db: Session, item: models.APKDetails, manifest: dict, sha256: str = None):
+    item.package_name = manifest["package"]
+    item.version_code = manifest["version_code"]
+    item.launch_activity = manifest["launch_activity"]
+    item.is_vr = manifest["is_vr"]
+    if sha256 is not None:
+        item.sha256 = sha256
+    db.commit()
+    return item
+
+
 def set_device_icon(db: Session, device_id: str, col: str, icon: str, text: str):
     instance = db.query(models.DeviceInfo).filter_by(device_id=device_id).first()
     if not instance:
@@ -58,3 +75,63 @@ def update_settings(db, screen_updates: int):
 def crud_defaults(db: Session, so_far):
     instance = _get_settings(db)
     so_far['screen_updates'] = instance.screen_updates
+
+
+def create_job(db: Session, kind: str, params: dict, serials: list):
+    job = models.Job(kind=kind, params=json.dumps(params), devices=[models.JobDevice(serial=serial) for serial in serials])
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_job(db: Session, job_id: int):
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+
+def get_recent_jobs(db: Session, limit: int = 20):
+    return db.query(models.Job).order_by(models.Job.id.desc()).limit(limit).all()
+
+
+def get_unfinished_jobs(db: Session):
+    return db.query(models.Job).filter(models.Job.status.in_(['queued', 'running'])).order_by(models.Job.id).all()
+
+
+def update_job(db: Session, job_id: int, status: str, message: str = None):
+    job = get_job(db, job_id)
+    job.status = status
+    if message is not None:
+        job.message = message
+    db.commit()
+
+
+def update_job_device(db: Session, job_id: int, serial: str, status: str, message: str = None, progress: int = None):
+    instance = db.query(models.JobDevice).filter_by(job_id=job_id, serial=serial).first()
+    instance.status = status
+    if message is not None:
+        instance.message = message
+    if progress is not None:
+        instance.progress = progress
+    db.commit()
+
+
+def get_active_fleet_profile(db: Session):
+    return db.query(models.FleetProfile).filter(models.FleetProfile.active.is_(True)).order_by(models.FleetProfile.id.desc()).first()
+
+
+def deactivate_fleet_profiles(db: Session):
+    db.query(models.FleetProfile).filter(models.FleetProfile.active.is_(True)).update({"active": False})
+    db.commit()
+
+
+def set_fleet_profile(db: Session, name: str, devices: list, apk_name: str = None, volume: int = None,
+                      screen_off_timeout: int = None, home_app: bool = False):
+    db.query(models.FleetProfile).filter(models.FleetProfile.active.is_(True)).update({"active": False})
+    profile = models.FleetProfile(
+        name=name, devices=json.dumps(devices), apk_name=apk_name, volume=volume,
+        screen_off_timeout=screen_off_timeout, home_app=home_app,
+    )
+    db.add(profile)
+    db.commit()
+    db.refresh(profile)
+    return profile
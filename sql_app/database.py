@@ -6,7 +6,7 @@ from sqlalchemy.orm import sessionmaker
 
 from helpers import BASE_DIR
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///" + os.path.join(BASE_DIR, "sqlLite.db")
+SQLALCHEMY_DATABASE_URL = os.environ.get("SIMU_DATABASE_URL") or "sqlite:///" + os.path.join(BASE_DIR, "sqlLite.db")
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -1,6 +1,8 @@
+import datetime
 import enum
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy.orm import relationship
 from sqlalchemy_utils import ChoiceType
 
 from .database import Base
@@ -20,6 +22,12 @@ class APKDetails(Base):
     apk_name = Column(String, index=True)
     command = Column(String, index=True)
     device_type = Column(ChoiceType(DeviceTypes, impl=Integer()))
+    # read from the APK's manifest, see apk_manifest.py
+    package_name = Column(String, index=True)
+    version_code = Column(Integer)
+    launch_activity = Column(String)
+    is_vr = Column(Boolean)
+    sha256 = Column(String, index=True)
 
 
 class DeviceInfo(Base):
@@ -35,3 +43,40 @@ class Settings(Base):
     __tablename__ = 'settings'
     id = Column(Integer, primary_key=True, index=True)
     screen_updates = Column(Integer, index=True, default=8)
+
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True)
+    status = Column(String, index=True, default='queued')
+    params = Column(String, default='{}')
+    message = Column(String, default='')
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    devices = relationship('JobDevice', back_populates='job', order_by='JobDevice.id', cascade='all, delete-orphan')
+
+
+class JobDevice(Base):
+    __tablename__ = 'job_devices'
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey('jobs.id'), index=True)
+    serial = Column(String, index=True)
+    status = Column(String, default='queued')
+    message = Column(String, default='')
+    progress = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    job = relationship('Job', back_populates='devices')
+
+
+class FleetProfile(Base):
+    __tablename__ = 'fleet_profiles'
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, default='')
+    devices = Column(String, default='[]')
+    apk_name = Column(String, nullable=True)
+    volume = Column(Integer, nullable=True)
+    screen_off_timeout = Column(Integer, nullable=True)
+    home_app = Column(Boolean, default=False)
+    active = Column(Boolean, index=True, default=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -11,6 +11,11 @@ class APKDetailsBase(BaseModel):
     apk_name: str
     command: Optional[str] = None
     device_type: DeviceTypes
+    package_name: Optional[str] = None
+    version_code: Optional[int] = None
+    launch_activity: Optional[str] = None
+    is_vr: Optional[bool] = None
+    sha256: Optional[str] = None
 
 
 class APKDetailsCreate(APKDetailsBase):
@@ -0,0 +1,303 @@
+"""
+Shared state for running simu-launch as several uvicorn workers, or as several hub nodes behind one UI.
+
+Settings that used to be module globals in main.py (the last experience chosen, the fleet volume) live in a
+StateBackend so every worker sees the same values, along with device leases: a worker or node only runs background work
+(waking screens, reconnecting, reconciling) for the headsets it holds the lease for, so two workers never fight over
+the same device.
+
+SIMU_STATE_URL picks the backend:
+
+    memory (default)            a single process, nothing is shared
+    sqlite:///path/state.db     every worker on the same machine (or a shared file system)
+    redis://host:6379/0         anything that speaks the redis protocol, needs the optional `redis` package
+
+SIMU_NODE_ID names this worker in leases, it defaults to hostname:pid.
+"""
+import abc
+import json
+import os
+import platform
+import sqlite3
+import threading
+import time
+
+NODE_ID = os.environ.get("SIMU_NODE_ID") or f"{platform.node()}:{os.getpid()}"
+LEASE_TTL_S = float(os.environ.get("SIMU_LEASE_TTL_S", 90))
+
+
+class StateBackend(abc.ABC):
+    """
+        Values are anything json serialisable. Sets hold strings and are changed a member at a time, so workers
+        adding and removing members at once never undo each other's changes, as read-modify-writes of a value can.
+        Leases are held by an owner (a node id) until they expire or are released, and can only be taken over by
+        another owner once they have expired.
+
+        The methods block (sqlite waits on other workers' locks, redis on the network), from the event loop run them on
+        a thread, ie: run_in_executor(None, state.leased, serials).
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def get(self, key: str, default=None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, key: str, value):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_member(self, key: str, member: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove_member(self, key: str, member: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def members(self, key: str) -> list:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def acquire_lease(self, serial: str, owner: str = NODE_ID, ttl: float = LEASE_TTL_S) -> bool:
+        """
+            Takes or renews the lease on a device.
+
+        :return: True if owner now holds the lease, False if someone else does
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def release_lease(self, serial: str, owner: str = NODE_ID):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def leases(self) -> dict:
+        """
+            Every unexpired lease, as serial -> {"owner": ..., "expires_in": seconds}
+        """
+        raise NotImplementedError
+
+    def leased(self, serials: list, owner: str = NODE_ID, ttl: float = LEASE_TTL_S) -> list:
+        """
+            Takes or renews the lease on each device.
+
+        :return: those of serials owner now holds the lease for
+        """
+        return [serial for serial in serials if self.acquire_lease(serial, owner, ttl)]
+
+    def lease_owner(self, serial: str):
+        lease = self.leases().get(serial)
+        return lease["owner"] if lease else None
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._values = {}
+        self._sets = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        return self._values.get(key, default)
+
+    def set(self, key: str, value):
+        self._values[key] = value
+
+    def delete(self, key: str):
+        self._values.pop(key, None)
+
+    def add_member(self, key: str, member: str):
+        with self._lock:
+            self._sets.setdefault(key, set()).add(member)
+
+    def remove_member(self, key: str, member: str):
+        with self._lock:
+            self._sets.get(key, set()).discard(member)
+
+    def members(self, key: str) -> list:
+        with self._lock:
+            return sorted(self._sets.get(key, ()))
+
+    def acquire_lease(self, serial: str, owner: str = NODE_ID, ttl: float = LEASE_TTL_S) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(serial)
+            if current is not None and current[0] != owner and current[1] > now:
+                return False
+            self._leases[serial] = (owner, now + ttl)
+            return True
+
+    def release_lease(self, serial: str, owner: str = NODE_ID):
+        with self._lock:
+            current = self._leases.get(serial)
+            if current is not None and current[0] == owner:
+                del self._leases[serial]
+
+    def leases(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                serial: {"owner": owner, "expires_in": round(expires - now, 1)}
+                for serial, (owner, expires) in self._leases.items()
+                if expires > now
+            }
+
+
+class SqliteBackend(StateBackend):
+    """
+        Kept in its own file rather than the app database so a busy lease table never locks experience/settings writes.
+        Each thread gets its own connection, sqlite's own locking makes lease takeover atomic between processes.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases (serial TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sets (key TEXT NOT NULL, member TEXT NOT NULL, PRIMARY KEY (key, member))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default=None):
+        row = self._connection().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value):
+        self._connection().execute(
+            "INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def add_member(self, key: str, member: str):
+        self._connection().execute("INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)", (key, member))
+
+    def remove_member(self, key: str, member: str):
+        self._connection().execute("DELETE FROM sets WHERE key = ? AND member = ?", (key, member))
+
+    def members(self, key: str) -> list:
+        rows = self._connection().execute("SELECT member FROM sets WHERE key = ? ORDER BY member", (key,))
+        return [member for member, in rows]
+
+    def acquire_lease(self, serial: str, owner: str = NODE_ID, ttl: float = LEASE_TTL_S) -> bool:
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO leases (serial, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(serial) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+            "WHERE leases.owner = excluded.owner OR leases.expires <= ?",
+            (serial, owner, now + ttl, now),
+        )
+        row = conn.execute("SELECT owner FROM leases WHERE serial = ?", (serial,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, serial: str, owner: str = NODE_ID):
+        self._connection().execute("DELETE FROM leases WHERE serial = ? AND owner = ?", (serial, owner))
+
+    def leases(self) -> dict:
+        now = time.time()
+        rows = self._connection().execute("SELECT serial, owner, expires FROM leases WHERE expires > ?", (now,))
+        return {serial: {"owner": owner, "expires_in": round(expires - now, 1)} for serial, owner, expires in rows}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisBackend(StateBackend):
+    name = "redis"
+
+    # only extend a lease we already own, in one round trip so it can't be lost in between
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str, prefix: str = "simu:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SIMU_STATE_URL is a redis url but the redis package is not installed (pip install redis)")
+        self.prefix = prefix
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str, default=None):
+        value = self.redis.get(self.prefix + "state:" + key)
+        return json.loads(value) if value is not None else default
+
+    def set(self, key: str, value):
+        self.redis.set(self.prefix + "state:" + key, json.dumps(value))
+
+    def delete(self, key: str):
+        self.redis.delete(self.prefix + "state:" + key)
+
+    def add_member(self, key: str, member: str):
+        self.redis.sadd(self.prefix + "set:" + key, member)
+
+    def remove_member(self, key: str, member: str):
+        self.redis.srem(self.prefix + "set:" + key, member)
+
+    def members(self, key: str) -> list:
+        return sorted(self.redis.smembers(self.prefix + "set:" + key))
+
+    def acquire_lease(self, serial: str, owner: str = NODE_ID, ttl: float = LEASE_TTL_S) -> bool:
+        key = self.prefix + "lease:" + serial
+        ttl_ms = int(ttl * 1000)
+        if self.redis.set(key, owner, nx=True, px=ttl_ms):
+            return True
+        return bool(self.redis.eval(self._RENEW, 1, key, owner, ttl_ms))
+
+    def release_lease(self, serial: str, owner: str = NODE_ID):
+        self.redis.eval(self._RELEASE, 1, self.prefix + "lease:" + serial, owner)
+
+    def leases(self) -> dict:
+        leases = {}
+        for key in self.redis.scan_iter(self.prefix + "lease:*"):
+            owner = self.redis.get(key)
+            expires_in = self.redis.pttl(key)
+            if owner is not None and expires_in > 0:
+                leases[key[len(self.prefix + "lease:"):]] = {"owner": owner, "expires_in": round(expires_in / 1000, 1)}
+        return leases
+
+    def close(self):
+        self.redis.close()
+
+
+def from_url(url: str = None) -> StateBackend:
+    """
+        Creates the backend described by url, or by SIMU_STATE_URL when not given.
+    """
+    url = url or os.environ.get("SIMU_STATE_URL") or "memory"
+    if url == "memory":
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SqliteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unknown SIMU_STATE_URL {url}, expected memory, sqlite:///path or redis://host:port/db")
@@ -1,17 +1,18 @@
-var current_devices = []
 var masterList = ["com.DefaultCompany.Kindred", "com.IndigoStorm.TheMuseumofImaginedFutures", "com.NoGhost.OffTheRecord", "com.SV.LifeCycles", "com.Shroomstudio.Promenade", "com.Visualise.GetPunked", "com.epicgames.Storyfutures"]
 var status_global = document.getElementById("status");
 var statusToast = new bootstrap.Toast(document.getElementById('statusToast'));
 class DeviceTable extends HTMLElement {
-    constructor(deviceList) {
+    constructor() {
         super();
-        this.deviceList = deviceList;
+        this.deviceList = [];
+        this.hashes = {};
         this.attachShadow({ mode: 'open' });
         var bootstrapStyles = document.createElement('link')
         bootstrapStyles.rel = 'stylesheet'
-        bootstrapStyles.href = 'static/bootstrap-5.2.0-beta1-dist/css/bootstrap.css'
+        // the same fingerprinted stylesheet the page has, already cached
+        bootstrapStyles.href = document.getElementById('bootstrap-css').href
         this.shadowRoot.appendChild(bootstrapStyles);
-        this.tableGenerator(deviceList);
+        this.shadowRoot.appendChild(document.querySelector("#devices-table-template").content.cloneNode(true));
         this.classList.add("w-100");
         this.classList.add("p-0");
 
@@ -19,81 +20,58 @@ class DeviceTable extends HTMLElement {
     }
     connectedCallback() {
     }
-    tableGenerator(deviceList) {
-        this.shadowRoot.appendChild(document.querySelector("#devices-table-template").content.cloneNode(true));
+    // rows are rendered by the server (templates/ui/list-item.html), only the ones that changed are sent and swapped
+    swapRows(deviceIds, fragments) {
         var tableBody = this.shadowRoot.querySelector("#body-container");
-        deviceList.forEach(device => {
-            tableBody.appendChild(this.itemGenerator(device));
-            this.getBatteryPercentage(device.id);
-            this.getCurrentExperience(device.id);
+        for (var id of Object.keys(this.hashes)) {
+            if (deviceIds.indexOf(id) === -1) {
+                var gone = this.shadowRoot.getElementById(id);
+                if (gone) gone.remove();
+                delete this.hashes[id];
+            }
+        }
+        deviceIds.forEach(id => {
+            var fragment = fragments[id];
+            if (!fragment) return;
+            var holder = document.createElement('template');
+            holder.innerHTML = fragment.html.trim();
+            var row = holder.content.firstElementChild;
+            var existing = this.shadowRoot.getElementById(id);
+            if (existing) {
+                row.querySelector("input").checked = existing.querySelector("input").checked;
+                existing.replaceWith(row);
+            } else {
+                tableBody.appendChild(row);
+            }
+            this.hashes[id] = fragment.hash;
+            this.checkLoadedExperiences(id);
         });
+        this.deviceList = deviceIds.map(id => ({ id: id }));
     }
-    itemGenerator(device) {
-        let row = document.querySelector("#device-list-item").content.cloneNode(true)
-        row.querySelector("tr").setAttribute("id", device.id)
-        if (device.icon) {
-            row.querySelector("tr").setAttribute("name", device.icon.text)
-        }
-        else {
-            row.querySelector("tr").setAttribute("name", device.id)
-        }
-
-        if (device.icon) {
-
-            var col = device.icon.col
-            var icon = device.icon.icon
-
-
-            $('.icon-set').each(function () {
-                if ($(this).data('col') === col && $(this).data('icon') === icon) {
-                    var found = $(this).parent().find('svg')
-                    var cloned_icon = $(found).clone();
-                    cloned_icon.css('color', col);
-
-                    row.querySelector("#setIcon").innerHTML = cloned_icon[0].outerHTML;
-
-                }
-            });
+    showBatteryPercentage(id, data) {
+        if (!this.shadowRoot.getElementById(id)) {
+            return
         }
-        if (device.ip === false) {
+        if (data >= 60) {
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.add("text-bg-success")
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-danger")
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-warning")
+        } else if (data < 60 && data >= 30) {
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.add("text-bg-warning")
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-success")
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-danger")
+        } else {
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.add("text-bg-danger")
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-success")
+            this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-warning")
 
-            row.querySelector("#deviceConnection").innerHTML = "Wired"
-            row.querySelector("#deviceConnection").classList.remove("text-success")
-            row.querySelector("#deviceConnection").classList.add("text-warning")
         }
-        this.checkLoadedExperiences(device.id);
-        return row;
-    }
-    getBatteryPercentage(id) {
-
-        fetch("/battery/" + id).then(response => {
-            return response.json()
-        }).then(data => {
-            if (data >= 60) {
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.add("text-bg-success")
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-danger")
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-warning")
-            } else if (data < 60 && data >= 30) {
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.add("text-bg-warning")
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-success")
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-danger")
-            } else {
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.add("text-bg-danger")
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-success")
-                this.shadowRoot.getElementById(id).querySelector("#batteryBadge").classList.remove("text-bg-warning")
-
-            }
-            this.shadowRoot.getElementById(id).querySelector("#batteryPercent").innerHTML = data + "%";
-
-        })
+        this.shadowRoot.getElementById(id).querySelector("#batteryPercent").innerHTML = data + "%";
     }
-    getCurrentExperience(id) {
-        fetch("/current-experience/" + id).then(response => {
-            return response.json()
-        }).then(data => {
-            this.shadowRoot.getElementById(id).querySelector("#deviceCurrentExperience").innerHTML = data.current_app;
-
-        })
+    showCurrentExperience(id, current_app) {
+        if (this.shadowRoot.getElementById(id)) {
+            this.shadowRoot.getElementById(id).querySelector("#deviceCurrentExperience").innerHTML = current_app;
+        }
     }
     checkLoadedExperiences(id) {
         fetch("/loaded-experiences/" + id).then(response => {
@@ -119,10 +97,19 @@ class DeviceTable extends HTMLElement {
         })
     }
     updateStatus(list) {
-        list.forEach(device => {
-            this.getCurrentExperience(device.id);
-            this.getBatteryPercentage(device.id);
-
+        // one request for the whole fleet rather than two per device
+        fetch("/fleet-status").then(response => {
+            return response.json()
+        }).then(data => {
+            list.forEach(device => {
+                let status = data.devices[device.id]
+                if (!status || status.error) {
+                    this.showCurrentExperience(device.id, status ? 'DISCONNECTED' : '?')
+                    return
+                }
+                this.showBatteryPercentage(device.id, status.battery === null ? "?" : status.battery)
+                this.showCurrentExperience(device.id, status.current_app)
+            })
         })
     }
     getSelected() {
@@ -164,8 +151,11 @@ customElements.define('device-table', DeviceTable);
 
 function get_devices() {
     console.log('Polling for new devices')
-    fetch('devices', {
-        method: 'GET',
+    var table = document.querySelector("device-table");
+    fetch('device-fragments/row', {
+        method: 'POST',
+        body: JSON.stringify(table ? table.hashes : {}),
+        headers: { "Content-type": "application/json" }
     })
         .then(function (response) {
             if (!response.ok) {
@@ -176,21 +166,19 @@ function get_devices() {
         .then(function (json) {
             var devices_count = json['devices'].length;
 
-
-            if (JSON.stringify(json['devices']) != JSON.stringify(current_devices)) {
-                console.log('Found changes')
-                document.getElementById("main-container").innerHTML = "";
-                var devicetable = new DeviceTable(json['devices'])
-                document.getElementById("main-container").appendChild(devicetable);
-
-                current_devices = json['devices'];
-                devicetable.updateStatus(devicetable.deviceList);
-            }
-            document.querySelector("device-table").updateStatus(document.querySelector("device-table").deviceList);
             if (devices_count === 0) {
                 document.getElementById("main-container").innerHTML = `<h2 class="w-100 text-center p-3" id="no-devices">No Devices Connected.</h2>`
-
+                return;
+            }
+            var devicetable = document.querySelector("device-table");
+            if (!devicetable) {
+                document.getElementById("main-container").innerHTML = "";
+                devicetable = new DeviceTable();
+                document.getElementById("main-container").appendChild(devicetable);
             }
+            if (Object.keys(json['fragments']).length > 0) console.log('Found changes')
+            devicetable.swapRows(json['devices'], json['fragments']);
+            devicetable.updateStatus(devicetable.deviceList);
 
         })
         .catch(function (error) {
@@ -75,6 +75,72 @@ function send(params) {
     });
 }
 
+// polls /jobs/<id> until the job has finished, calling progress(job) on every change and done(job) at the end,
+// node being the peer the job runs on when a hub fanned the command out
+function followJob(jobId, progress, done, node = null, interval = 1000) {
+    var last = null;
+    var url = "/jobs/" + jobId + (node && node !== "local" ? "?node=" + encodeURIComponent(node) : "");
+    var poll = function () {
+        fetch(url)
+            .then(function (response) {
+                return response.json()
+            })
+            .then(function (job) {
+                if (job['success'] === false) throw Error(job['error']);
+                var body = JSON.stringify(job);
+                if (body !== last && progress) progress(job);
+                last = body;
+                if (job['finished']) {
+                    if (done) done(job);
+                } else {
+                    setTimeout(poll, interval);
+                }
+            })
+            .catch(function (error) {
+                showStatus("Lost track of job " + jobId + ": " + error, true);
+            });
+    }
+    poll();
+}
+
+// follows the job of every node a command ran on (data["jobs"], node -> job id, when a hub fanned it out) or its one
+// job, calling progress and done with them combined as one job
+function followJobs(data, progress, done) {
+    var jobs = data["jobs"] || { "local": data["job_id"] };
+    var nodes = Object.keys(jobs);
+    var latest = {};
+    var combined = function () {
+        var known = nodes.filter(node => latest[node]).map(node => latest[node]);
+        var finished = known.length === nodes.length && known.every(job => job['finished']);
+        var failed = known.some(job => job['status'] === 'failed');
+        return {
+            "devices": [].concat(...known.map(job => job['devices'])),
+            "finished": finished,
+            "status": finished ? (failed ? "failed" : "done") : "running",
+        };
+    };
+    nodes.forEach(function (node) {
+        followJob(jobs[node], function (job) {
+            latest[node] = job;
+            if (progress) progress(combined());
+        }, function (job) {
+            latest[node] = job;
+            var all = combined();
+            if (all['finished'] && done) done(all);
+        }, node);
+    });
+}
+
+function jobSummary(job) {
+    var done = job['devices'].filter(device => device['status'] === 'done').length;
+    var failed = job['devices'].filter(device => device['status'] === 'failed');
+    var text = done + "/" + job['devices'].length + " devices done";
+    failed.forEach(device => {
+        text += "<br>" + device['serial'] + ": " + device['message'];
+    });
+    return text;
+}
+
 var showStatus = (text = "The showStatus function was used incorrectly and status text was not defined", isError = false) => {
     if (isError === true) {
         document.getElementById("statusToast").classList.add("bg-danger");
@@ -166,7 +232,14 @@ function loadExperience() {
         body: body,
         success: function (data) {
             $('#loadModal').modal('hide');
-            showStatus("Experience has loaded on " + data["device_count"] + " devices!");
+            showStatus("Installing the experience on " + data["device_count"] + " devices...");
+            followJobs(data, null, function (job) {
+                if (job['status'] === 'done') {
+                    showStatus("Experience has loaded on " + job['devices'].length + " devices!");
+                } else {
+                    showStatus("Problem loading the experience: " + jobSummary(job), true);
+                }
+            });
         },
         problem: function (error) {
             showStatus("Error loading experience: " + error);
@@ -258,6 +331,23 @@ function stopExperience() {
     }
 }
 
+function enrollUsb() {
+    send({
+        url: '/enroll-usb',
+        success: function (data) {
+            showStatus("Moving " + data["device_count"] + " USB headsets onto wifi...");
+            followJob(data["job_id"], function (job) {
+                if (!job['finished']) showStatus("Moving USB headsets onto wifi: " + jobSummary(job));
+            }, function (job) {
+                showStatus("Moved USB headsets onto wifi: " + jobSummary(job), job['status'] !== 'done');
+            });
+        },
+        problem: function (error) {
+            showStatus("Error moving USB headsets onto wifi: " + error);
+        },
+    })
+}
+
 function disconnectSingleDevice(id){
     send({
         url: '/disconnect',
@@ -373,85 +463,49 @@ function getScreenshots() {
 }
 
 //DEVICE CARDS
+// the card itself is rendered by the server (templates/ui/card.html) and swapped in whenever it changes
 class DeviceCard extends HTMLElement {
-    constructor(image, device, selected) {
+    constructor(image, deviceId, selected, html, hash) {
         super();
         this.attachShadow({ mode: 'open' });
         var bootstrapStyles = document.createElement('link')
         bootstrapStyles.rel = 'stylesheet'
-        bootstrapStyles.href = 'static/bootstrap-5.2.0-beta1-dist/css/bootstrap.css'
+        // the same fingerprinted stylesheet the page has, already cached
+        bootstrapStyles.href = document.getElementById('bootstrap-css').href
         this.shadowRoot.appendChild(bootstrapStyles);
-        this.shadowRoot.appendChild(document.querySelector("#device-card").content.cloneNode(true));
+        this.root = document.createElement('div');
+        this.shadowRoot.appendChild(this.root);
         this.image = image;
-        this.deviceId = device['id'];
-        this.device_icon = device['icon'];
+        this.src = image;
+        this.deviceId = deviceId;
         this.selected = selected;
-        this.updateMessage(device['message']);
+        // from the fleet status poll, see devices_manager
+        this.status = undefined;
         this.updated = undefined;
-        var checkbox = this.shadowRoot.getElementById("cardSelect");
+        this.swap(html, hash);
+    }
 
-        if(defaults.manual_screenshots_enabled){
-            var refresh_screen = this.shadowRoot.getElementById('refresh-screen');
-            refresh_screen.hidden = false;
-        }
+    swap(html, hash) {
+        this.root.innerHTML = html;
+        this.hash = hash;
+        this.shadowRoot.getElementById("device-image").src = this.src;
 
+        var checkbox = this.shadowRoot.getElementById("cardSelect");
+        checkbox.checked = this.selected;
+        if (this.selected) this.shadowRoot.getElementById("main-card").children[0].classList.add("shadow");
         checkbox.addEventListener('change', () => {
-            if (checkbox.checked) {
-                this.updateSelected(true)
-            } else {
-                this.updateSelected(false)
-            }
+            this.updateSelected(checkbox.checked)
         })
 
-        if (this.device_icon && this.device_icon['col']) {
-            var el = this.shadowRoot.getElementById('setIcon');
-            $(el).children('svg').remove();
-
-            var col = this.device_icon['col'];
-            var icon = this.device_icon['icon'];
-
-
-            if (col) {
-                var my_id = '#' + col + '-' + icon;
-                $('.icon-set').each(function () {
-                    if ($(this).data('col') === col && $(this).data('icon') === icon) {
-                        var found = $(this).parent().find('svg')
-                        var cloned_icon = $(found).clone();
-                        cloned_icon.css('color', col);
-                        $(el).append(cloned_icon);
-                    }
-                });
-            }
-        }
-
-        // setting this attribute on the nodes themselves to avoid future breakage during UI redesign
-        for (var el_id of ['checkExperiences', 'stop_some_experience', 'setIcon', 'refresh-screen', 'wifi-connect']) {
-            var el = this.shadowRoot.getElementById(el_id);
-            // should really be setting data-device_id
-            el.setAttribute('device_id', this.deviceId)
-        }
-
-        if (this.deviceId.split('.').length > 2) {
-            var el = this.shadowRoot.getElementById('wifi-connect');
-            el.hidden = true;
+        if(defaults.manual_screenshots_enabled){
+            this.shadowRoot.getElementById('refresh-screen').hidden = false;
         }
-
-        var check_battery_mins_wait = 5;
-        this.getBatteryPercentage()
-        this.batteryInterval = setInterval(() => {
-            this.getBatteryPercentage()
-        }, check_battery_mins_wait * 60 * 1000);
-
-    }
-
-    kill() {
-        clearInterval(this.batteryInterval);
+        if (this.status !== undefined) this.updateStatus(this.status);
     }
 
     updated_recently(){
         var difference = (new Date().getTime() - this.updated) / 1000;
         var grace_period_after_headset_dies_s = 1;
-        console.log(difference,333)
         return difference < grace_period_after_headset_dies_s;
     }
 
@@ -482,50 +536,42 @@ class DeviceCard extends HTMLElement {
         }
     }
 
-    getBatteryPercentage() {
-
-        fetch("/battery/" + this.deviceId).then(response => {
-            return response.json()
-        }).then(data => {
-            if (data >= 60) {
-                this.shadowRoot.getElementById("batteryBadge").classList.add("text-bg-success")
-                this.shadowRoot.getElementById("batteryBadge").classList.remove("text-bg-danger")
-                this.shadowRoot.getElementById("batteryBadge").classList.remove("text-bg-warning")
-            } else if (data < 60 && data >= 30) {
-                this.shadowRoot.getElementById("batteryBadge").classList.add("text-bg-warning")
-                this.shadowRoot.getElementById("batteryBadge").classList.remove("text-bg-success")
-                this.shadowRoot.getElementById("batteryBadge").classList.remove("text-bg-danger")
-            } else {
-                this.shadowRoot.getElementById("batteryBadge").classList.add("text-bg-danger")
-                this.shadowRoot.getElementById("batteryBadge").classList.remove("text-bg-success")
-                this.shadowRoot.getElementById("batteryBadge").classList.remove("text-bg-warning")
+    updateStatus(status) {
+        this.status = status;
+        if (status.error) {
+            this.shadowRoot.getElementById("batteryPercent").innerHTML = "?";
+        } else if (status.battery !== null && status.battery !== undefined) {
+            this.showBatteryPercentage(status.battery);
+        }
+        this.shadowRoot.getElementById("currentApp").textContent = status.error ? '' : (status.current_app || '');
+    }
 
-            }
-            this.shadowRoot.getElementById("batteryPercent").innerHTML = data + "%";
-        })
+    showBatteryPercentage(data) {
+        var badge = this.shadowRoot.getElementById("batteryBadge");
+        badge.classList.remove("text-bg-success", "text-bg-warning", "text-bg-danger");
+        if (data >= 60) {
+            badge.classList.add("text-bg-success")
+        } else if (data < 60 && data >= 30) {
+            badge.classList.add("text-bg-warning")
+        } else {
+            badge.classList.add("text-bg-danger")
+        }
+        this.shadowRoot.getElementById("batteryPercent").innerHTML = data + "%";
     }
 
     updateImage(image) {
         this.image = image;
-        this.shadowRoot.querySelector("img").src = image;
-    }
-
-    updateMessage(str) {
-        var el = this.shadowRoot.getElementById("message");
-        if (str.length > 0) {
-            el.hidden = false;
-        } else {
-            el.hidden = true;
-        }
-        el.innerHTML = str;
+        this.src = image;
+        this.shadowRoot.getElementById("device-image").src = image;
     }
 
     check_screenshots_enabled_and_now_remove_image() {
 
         if(defaults.screenshots_enabled) return false;
         if(this.image !==''){
-            this.shadowRoot.querySelector("img").src = '';
+            this.shadowRoot.getElementById("device-image").src = '';
             this.image = '';
+            this.src = '';
             return true;
         }
         return false;
@@ -533,22 +579,9 @@ class DeviceCard extends HTMLElement {
 
     updateImage64(image64) {
         this.image = image64;
+        this.src = "data:image/png;base64, " + image64;
         this.just_updated();
-        this.shadowRoot.querySelector("img").src = "data:image/png;base64, " + image64;
-    }
-
-    connectedCallback() {
-        this.shadowRoot.querySelector("img").src = this.image;
-        var device_name = this.shadowRoot.querySelector("#device-name");
-
-        if (this.device_icon && this.device_icon['text']) {
-            var text = this.device_icon['text'];
-            if (text.length > 0) device_name.innerHTML = text;
-
-        } else {
-            device_name.innerHTML = this.deviceId;
-        }
-
+        this.shadowRoot.getElementById("device-image").src = this.src;
     }
 }
 
@@ -592,23 +625,25 @@ var devices_manager = function () {
         var orig_text = el.innerHTML;
         el.innerHTML = 'please wait';
         el.classList.add('disabled');
+        var finished = function () {
+            el.innerHTML = orig_text;
+            el.classList.remove('disabled');
+        }
         fetch("connect/" + device_id)
             .then(function (response) {
                 return response.json()
             })
             .then(function (json) {
-                if (json['success']) {
-                    showStatus(json['message']);
-                } else {
-                    showStatus(json['error']);
-                }
+                followJob(json['job_id'], function (job) {
+                    if (!job['finished'] && job['devices'][0]['message']) el.innerHTML = job['devices'][0]['message'];
+                }, function (job) {
+                    showStatus(job['devices'][0]['message'], job['status'] !== 'done');
+                    finished();
+                });
             })
             .catch(function () {
                 console.log('error with wifi connecting device ' + device_id);
-            })
-            .finally(function () {
-                el.innerHTML = orig_text;
-                el.classList.remove('disabled');
+                finished();
             });
     }
 
@@ -692,17 +727,21 @@ var devices_manager = function () {
         //
         screengrab_polling(card_id, false);
 
-        card.kill();
         delete card_map[card_id];
-        var i = cardList.indexOf(card_id);
+        var i = cardList.indexOf(card);
         cardList.splice(i, 1);
         document.querySelector("#main-container").removeChild(card);
     }
 
     function get_devices() {
         console.log('polling for new devices')
-        fetch('devices', {
-            method: 'GET',
+        // only the cards that changed since the hashes we have are sent back
+        var known = {};
+        for (var device_id in card_map) known[device_id] = card_map[device_id].hash;
+        fetch('device-fragments/card', {
+            method: 'POST',
+            body: JSON.stringify(known),
+            headers: { "Content-type": "application/json" }
         })
             .then(function (response) {
                 if (!response.ok) {
@@ -717,23 +756,26 @@ var devices_manager = function () {
                     if (found) found.remove();
                 }
                 var devices_so_far = Object.keys(card_map);
+                var added = false;
 
-                for (var device of json['devices']) {
-                    var device_id = device['id'];
+                for (var device_id of json['devices']) {
+                    var fragment = json['fragments'][device_id];
                     var found_at = devices_so_far.indexOf(device_id);
                     var card;
                     if (found_at === -1) {
+                        if (!fragment) continue;
                         var placeholder = "/static/images/placeholder.jpg";
                         if(!defaults.screenshots_enabled) placeholder =  '';
-                        card = new DeviceCard(placeholder, device, false);
+                        card = new DeviceCard(placeholder, device_id, false, fragment['html'], fragment['hash']);
                         card.classList.add('col')
                         cardList.push(card);
                         document.querySelector("#main-container").prepend(card);
                         card_map[device_id] = card
                         screengrab_polling(device_id, true);
+                        added = true;
                     } else {
                         card = card_map[device_id];
-                        card.updateMessage(device['message']);
+                        if (fragment) card.swap(fragment['html'], fragment['hash']);
                         card.just_updated();
                         devices_so_far.splice(found_at, 1);
                     }
@@ -741,7 +783,28 @@ var devices_manager = function () {
                 for (var d_missing of devices_so_far) {
                     remove_card(d_missing);
                 }
+                // new cards get their battery and current app without waiting for the next poll
+                if (added) get_fleet_status();
+            })
+            .catch(function (error) {
+                console.log(error);
+            })
+    }
 
+    // battery and current app of every card in one request, rather than one per card
+    function get_fleet_status() {
+        if (Object.keys(card_map).length === 0) return;
+        fetch('fleet-status')
+            .then(function (response) {
+                if (!response.ok) {
+                    throw Error(response.statusText);
+                }
+                return response.json()
+            })
+            .then(function (json) {
+                for (var device_id in json['devices']) {
+                    if (card_map[device_id]) card_map[device_id].updateStatus(json['devices'][device_id]);
+                }
             })
             .catch(function (error) {
                 console.log(error);
@@ -750,6 +813,7 @@ var devices_manager = function () {
 
     get_devices();
     setInterval(get_devices, defaults.check_for_new_devices_poll);
+    setInterval(get_fleet_status, defaults.check_for_new_devices_poll);
 
 
     api.devices = function () {
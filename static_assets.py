@@ -0,0 +1,232 @@
+"""
+Serving /static so that reloading a page over a busy venue wifi costs next to nothing.
+
+Templates reference assets through static_url('css/project.css'), which gives the URL with a hash of the file's content
+in its name (/static/css/project.3f2a9c81d0b4.css). Those URLs can never refer to anything else, so they are served with
+a year long immutable Cache-Control and a browser that has them never asks the Pi again; editing a file changes its URL.
+The plain names keep working, but are revalidated on every use.
+
+Text assets (css, js, svg...) are also served gzip compressed, or brotli compressed when the optional brotli package is
+installed, to the browsers that accept it. The compressed variants are built once, in the background at startup or
+ahead of time with:
+
+    python static_assets.py
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import stat
+import sys
+import tempfile
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE = {".css", ".js", ".svg", ".html", ".json", ".txt", ".map"}
+# best first
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+FINGERPRINTED = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)$")
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """
+        The encodings an Accept-Encoding header allows, ie: "gzip, deflate, br;q=0" -> {"gzip", "deflate"}
+    """
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = re.search(r"q=([0-9.]+)", params)
+        try:
+            if quality and float(quality.group(1)) == 0:
+                continue
+        except ValueError:
+            continue
+        if name.strip():
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticAssets:
+    def __init__(self, directory: str, cache_dir: str = None):
+        """
+        :param directory: the static directory
+        :param cache_dir: where compressed variants are kept, defaults to SIMU_STATIC_CACHE or a directory under /tmp
+        """
+        self.directory = directory
+        self.cache_dir = cache_dir or os.environ.get(
+            "SIMU_STATIC_CACHE", os.path.join(tempfile.gettempdir(), "simu-static")
+        )
+        self.hashes = {}
+        self.stats = {"hashed": 0, "compressed": 0}
+
+    def _full_path(self, path: str) -> str:
+        directory = os.path.realpath(self.directory)
+        full_path = os.path.realpath(os.path.join(directory, path))
+        if os.path.commonpath([full_path, directory]) != directory:
+            raise ValueError(f"{path} is outside {self.directory}")
+        return full_path
+
+    def fingerprint(self, path: str) -> str:
+        """
+            Hash of a static file's content, recomputed only when the file changes.
+
+        :param path: relative to the static directory, ie: css/project.css
+        :return: the hash, or None if there is no such file
+        """
+        try:
+            stat_result = os.stat(self._full_path(path))
+        except (OSError, ValueError):
+            return None
+        key = (stat_result.st_mtime_ns, stat_result.st_size)
+        cached = self.hashes.get(path)
+        if cached is None or cached[0] != key:
+            digest = hashlib.sha256()
+            with open(self._full_path(path), "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(chunk)
+            cached = self.hashes[path] = (key, digest.hexdigest()[:12])
+            self.stats["hashed"] += 1
+        return cached[1]
+
+    def url(self, path: str) -> str:
+        """
+            The template helper, static_url('main.js') -> /static/main.<hash>.js
+
+        :param path: relative to the static directory
+        """
+        path = path.lstrip("/")
+        fingerprint = self.fingerprint(path)
+        if fingerprint is None:
+            logging.info(f"No static file {path}, linking it without a fingerprint")
+            return f"/static/{path}"
+        directory, name = os.path.split(path)
+        stem, ext = os.path.splitext(name)
+        return "/static/" + "/".join(filter(None, [directory, f"{stem}.{fingerprint}{ext}"]))
+
+    def resolve(self, path: str) -> tuple:
+        """
+            A requested path -> (the file's path, the fingerprint asked for or None)
+        """
+        match = FINGERPRINTED.match(path)
+        if match is None or self.fingerprint(path) is not None:
+            return path, None
+        return match.group("stem") + match.group("ext"), match.group("hash")
+
+    def variant(self, path: str, encoding: str) -> str:
+        """
+            A compressed copy of a static file, made the first time it is asked for.
+
+        :param path: relative to the static directory
+        :param encoding: br or gzip
+        :return: the compressed file's path, or None when the file doesn't compress well
+        """
+        fingerprint = self.fingerprint(path)
+        if fingerprint is None or os.path.splitext(path)[1] not in COMPRESSIBLE or encoding not in ENCODINGS:
+            return None
+        variant_path = os.path.join(self.cache_dir, f"{path}.{fingerprint}{SUFFIXES[encoding]}")
+        skipped = variant_path + ".skip"
+        if os.path.exists(variant_path):
+            return variant_path
+        if os.path.exists(skipped):
+            return None
+
+        with open(self._full_path(path), "rb") as f:
+            data = f.read()
+        compressed = compress(data, encoding)
+        os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+        keep = len(compressed) < len(data) * 0.9
+        target = variant_path if keep else skipped
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(variant_path), delete=False) as f:
+            f.write(compressed if keep else b"")
+        os.replace(f.name, target)
+        self.stats["compressed"] += 1
+        return variant_path if keep else None
+
+    def build(self) -> int:
+        """
+            Compresses every text static file, so no request has to wait for it. Source maps are left to be compressed
+            if ever asked for, only the browser's developer tools fetch them.
+
+        :return: how many files were looked at
+        """
+        count = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.relpath(os.path.join(root, name), self.directory).replace(os.sep, "/")
+                if path.endswith(".map"):
+                    continue
+                for encoding in ENCODINGS:
+                    self.variant(path, encoding)
+                count += 1
+        return count
+
+
+class AssetFiles(StaticFiles):
+    """
+        StaticFiles serving fingerprinted names as immutable and compressed variants to the browsers accepting them.
+    """
+
+    def __init__(self, assets: StaticAssets):
+        super().__init__(directory=assets.directory)
+        self.assets = assets
+
+    async def get_response(self, path: str, scope) -> FileResponse:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        path = path.replace(os.sep, "/")
+        name, fingerprint = self.assets.resolve(path)
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, name)
+        if not (stat_result and stat.S_ISREG(stat_result.st_mode)):
+            return await super().get_response(path, scope)
+
+        current = await anyio.to_thread.run_sync(self.assets.fingerprint, name)
+        # an out of date fingerprint still gets the file, but must not be cached as if it were that version
+        headers = {"Cache-Control": IMMUTABLE if fingerprint and fingerprint == current else REVALIDATE}
+        request_headers = Headers(scope=scope)
+        if os.path.splitext(name)[1] in COMPRESSIBLE:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding in ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                variant_path = await anyio.to_thread.run_sync(self.assets.variant, name, encoding)
+                if variant_path is not None:
+                    full_path, stat_result = variant_path, os.stat(variant_path)
+                    headers["Content-Encoding"] = encoding
+                    break
+
+        response = FileResponse(
+            full_path,
+            stat_result=stat_result,
+            method=scope["method"],
+            headers=headers,
+            media_type=mimetypes.guess_type(name)[0] or "text/plain",
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+if __name__ == "__main__":
+    assets = StaticAssets(sys.argv[1] if len(sys.argv) > 1 else "static")
+    print(f"{assets.build()} static files, {assets.stats['compressed']} compressed into {assets.cache_dir}")
@@ -0,0 +1,48 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from ppadb.client import Client
+
+import apk_install
+from benchmarks.fake_adb import FakeAdbServer
+
+
+class TestApkInstall(TestCase):
+
+    def setUp(self):
+        self.fake = FakeAdbServer(device_count=2, latency_ms=0, jitter_ms=0).start()
+        self.client = Client(port=self.fake.port)
+        self.directory = tempfile.TemporaryDirectory()
+        self.apk = os.path.join(self.directory.name, "experience.apk")
+        with open(self.apk, "wb") as f:
+            f.write(os.urandom(3 * apk_install.CHUNK_BYTES + 100))
+
+    def tearDown(self):
+        self.fake.stop()
+        self.directory.cleanup()
+        apk_install._streaming.clear()
+
+    def test_streamed_without_staging_on_the_headset(self):
+        sent = []
+        outcome = apk_install.install(self.client.device("FAKE0000"), self.apk, lambda done, total: sent.append(done))
+        device = self.fake.devices["FAKE0000"]
+        assert outcome["method"] == "stream" and outcome["bytes"] == os.path.getsize(self.apk)
+        assert device.streamed == outcome["bytes"] and device.installed == {}
+        assert sent == [apk_install.CHUNK_BYTES, 2 * apk_install.CHUNK_BYTES, 3 * apk_install.CHUNK_BYTES,
+                        outcome["bytes"]]
+
+    def test_older_headsets_are_pushed(self):
+        self.fake.devices["FAKE0001"].features = "shell_v2"
+        outcome = apk_install.install(self.client.device("FAKE0001"), self.apk)
+        assert outcome["method"] == "push"
+        assert self.fake.devices["FAKE0001"].streamed == 0
+        assert self.fake.devices["FAKE0001"].installed == {"/data/local/tmp/experience.apk": outcome["bytes"]}
+        assert apk_install.describe(dict(outcome, mb_per_s=12.5)) == "Installed (push, 3.0MB at 12.5MB/s)"
+
+    def test_push_mode(self):
+        os.environ["SIMU_INSTALL_MODE"] = "push"
+        try:
+            assert apk_install.install(self.client.device("FAKE0000"), self.apk)["method"] == "push"
+        finally:
+            del os.environ["SIMU_INSTALL_MODE"]
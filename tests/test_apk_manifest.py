@@ -0,0 +1,160 @@
+import io
+import os
+import struct
+import tempfile
+import zipfile
+from unittest import TestCase
+
+import apk_manifest
+from helpers import launch_app
+
+NO_INDEX = 0xFFFFFFFF
+
+
+def binary_xml(elements, utf8=False) -> bytes:
+    """
+        A small Android binary XML encoder, elements are ("start", tag, {name: value}) and ("end", tag).
+    """
+    strings = []
+
+    def index(value):
+        if value not in strings:
+            strings.append(value)
+        return strings.index(value)
+
+    for element in elements:
+        index(element[1])
+        if element[0] == "start":
+            for name, value in element[2].items():
+                index(name)
+                if isinstance(value, str):
+                    index(value)
+
+    encoded, offsets = b"", []
+    for value in strings:
+        offsets.append(len(encoded))
+        if utf8:
+            raw = value.encode("utf-8")
+            encoded += bytes([len(value), len(raw)]) + raw + b"\0"
+        else:
+            encoded += struct.pack("<H", len(value)) + value.encode("utf-16-le") + b"\0\0"
+    encoded += b"\0" * (-len(encoded) % 4)
+    strings_start = 28 + 4 * len(strings)
+    pool = struct.pack(
+        "<HHIIIIII", 0x0001, 28, strings_start + len(encoded), len(strings), 0, 0x100 if utf8 else 0, strings_start, 0
+    ) + struct.pack(f"<{len(strings)}I", *offsets) + encoded
+
+    chunks = b""
+    for element in elements:
+        if element[0] == "end":
+            chunks += struct.pack("<HHIII", 0x0103, 16, 24, 1, NO_INDEX) + struct.pack("<II", NO_INDEX, index(element[1]))
+            continue
+        attributes = b""
+        for name, value in element[2].items():
+            if isinstance(value, bool):
+                raw, data_type, data = NO_INDEX, 0x12, NO_INDEX if value else 0
+            elif isinstance(value, int):
+                raw, data_type, data = NO_INDEX, 0x10, value
+            else:
+                raw, data_type, data = index(value), 0x03, index(value)
+            attributes += struct.pack("<IIIHBBI", NO_INDEX, index(name), raw, 8, 0, data_type, data)
+        extension = struct.pack("<IIHHHHHH", NO_INDEX, index(element[1]), 20, 20, len(element[2]), 0, 0, 0)
+        chunks += struct.pack("<HHIII", 0x0102, 16, 16 + len(extension) + len(attributes), 1, NO_INDEX)
+        chunks += extension + attributes
+
+    return struct.pack("<HHI", 0x0003, 8, 8 + len(pool) + len(chunks)) + pool + chunks
+
+
+def launcher(activity, *categories):
+    elements = [("start", "activity", {"name": activity}), ("start", "intent-filter", {}),
+                ("start", "action", {"name": "android.intent.action.MAIN"}), ("end", "action")]
+    for category in categories:
+        elements += [("start", "category", {"name": category}), ("end", "category")]
+    return elements + [("end", "intent-filter"), ("end", "activity")]
+
+
+def manifest(*body, package="com.simu.maze"):
+    return [("start", "manifest", {"package": package, "versionCode": 42, "versionName": "1.2"}),
+            ("start", "application", {})] + list(body) + [("end", "application"), ("end", "manifest")]
+
+
+def write_apk(directory, name, data) -> str:
+    path = os.path.join(directory, name)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as apk:
+        apk.writestr("AndroidManifest.xml", data)
+        apk.writestr("classes.dex", b"\0" * 1024)
+    with open(path, "wb") as f:
+        f.write(buffer.getvalue())
+    return path
+
+
+class Headset:
+    def __init__(self):
+        self.commands = []
+
+    def shell(self, command):
+        self.commands.append(command)
+        return ""
+
+
+class TestApkManifest(TestCase):
+
+    def tearDown(self):
+        apk_manifest._by_sha256.clear()
+
+    def test_flat_launcher(self):
+        data = binary_xml(manifest(*launcher(".MainActivity", "android.intent.category.LAUNCHER")))
+        assert apk_manifest.parse_manifest(data) == {
+            "package": "com.simu.maze",
+            "version_code": 42,
+            "version_name": "1.2",
+            "launch_activity": "com.simu.maze.MainActivity",
+            "is_vr": False,
+        }
+
+    def test_vr_launcher_wins_in_either_pool_encoding(self):
+        body = launcher("com.simu.maze.Settings", "android.intent.category.LAUNCHER") + launcher(
+            "com.unity3d.player.UnityPlayerActivity", "android.intent.category.LAUNCHER",
+            "com.oculus.intent.category.VR"
+        )
+        for utf8 in (False, True):
+            details = apk_manifest.parse_manifest(binary_xml(manifest(*body), utf8=utf8))
+            assert details["launch_activity"] == "com.unity3d.player.UnityPlayerActivity"
+            assert details["is_vr"]
+
+    def test_vr_feature_and_no_launcher(self):
+        feature = [("start", "uses-feature", {"name": "android.hardware.vr.headtracking", "required": True}),
+                   ("end", "uses-feature")]
+        details = apk_manifest.parse_manifest(binary_xml(manifest(*feature, *launcher("Service"))))
+        assert details["is_vr"]
+        assert details["launch_activity"] is None
+
+    def test_read_apk_is_cached_by_sha256(self):
+        data = binary_xml(manifest(*launcher(".Main", "android.intent.category.LAUNCHER")))
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_apk(directory, "maze.apk", data)
+            assert apk_manifest.read_apk(path, sha256="abc")["package"] == "com.simu.maze"
+            os.remove(path)
+            assert apk_manifest.read_apk(path, sha256="abc")["launch_activity"] == "com.simu.maze.Main"
+            with self.assertRaises(FileNotFoundError):
+                apk_manifest.read_apk(path)
+
+    def test_not_an_apk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "broken.apk")
+            with open(path, "wb") as f:
+                f.write(b"not a zip")
+            with self.assertRaises(ValueError):
+                apk_manifest.read_apk(path)
+            with self.assertRaises(ValueError):
+                apk_manifest.read_apk(write_apk(directory, "empty.apk", b"\0" * 16))
+
+    def test_launch_with_package(self):
+        headset = Headset()
+        launch_app(headset, "renamed-upload.apk", d_type=False, command="com.simu.maze.Main", package="com.simu.maze")
+        launch_app(headset, "renamed-upload.apk", d_type=False)
+        assert headset.commands == [
+            "am start -n com.simu.maze/com.simu.maze.Main",
+            "monkey -p renamed-upload -v 1",
+        ]
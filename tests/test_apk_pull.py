@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from fastapi.testclient import TestClient
+from ppadb import InstallError
+from ppadb.client import Client
+
+import apk_pull
+from benchmarks.fake_adb import FakeAdbServer
+from federation import file_sha256
+from main import app
+
+
+class TestParseRange(TestCase):
+
+    def test_ranges(self):
+        assert apk_pull.parse_range("bytes=0-99", 1000) == (0, 99)
+        assert apk_pull.parse_range("bytes=500-", 1000) == (500, 999)
+        assert apk_pull.parse_range("bytes=-100", 1000) == (900, 999)
+        assert apk_pull.parse_range("bytes=900-5000", 1000) == (900, 999)
+        assert apk_pull.parse_range(None, 1000) is None
+        assert apk_pull.parse_range("bytes=0-1,5-6", 1000) is None
+        assert apk_pull.parse_range("items=0-1", 1000) is None
+        with self.assertRaises(ValueError):
+            apk_pull.parse_range("bytes=1000-", 1000)
+
+
+class TestApkFile(TestCase):
+
+    def setUp(self):
+        self.made_dir = not os.path.isdir("apks")
+        os.makedirs("apks", exist_ok=True)
+        self.path = os.path.join("apks", "test-pull.apk")
+        self.content = os.urandom(300 * 1024)
+        with open(self.path, "wb") as f:
+            f.write(self.content)
+        self.etag = '"' + file_sha256(self.path) + '"'
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        os.remove(self.path)
+        if self.made_dir:
+            os.rmdir("apks")
+
+    def test_whole_and_ranges(self):
+        response = self.client.get("/apks/test-pull.apk")
+        assert response.status_code == 200 and response.content == self.content
+        assert response.headers["etag"] == self.etag and response.headers["accept-ranges"] == "bytes"
+
+        response = self.client.get("/apks/test-pull.apk", headers={"Range": "bytes=1000-"})
+        assert response.status_code == 206 and response.content == self.content[1000:]
+        assert response.headers["content-range"] == f"bytes 1000-{len(self.content) - 1}/{len(self.content)}"
+
+        response = self.client.get("/apks/test-pull.apk", headers={"Range": "bytes=1000-", "If-Range": '"older"'})
+        assert response.status_code == 200 and response.content == self.content
+
+        response = self.client.get("/apks/test-pull.apk", headers={"Range": f"bytes={len(self.content)}-"})
+        assert response.status_code == 416
+
+        assert self.client.get("/apks/test-pull.apk", headers={"If-None-Match": self.etag}).status_code == 304
+        assert self.client.get("/apks/missing.apk").status_code == 404
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+        Serves one file with Range, like /apks/<name>, counting the bytes sent.
+    """
+    path_served = None
+    sent = 0
+
+    def do_GET(self):
+        size = os.path.getsize(self.path_served)
+        wanted = apk_pull.parse_range(self.headers.get("Range"), size)
+        first, last = wanted or (0, size - 1)
+        self.send_response(206 if wanted else 200)
+        self.send_header("Content-Length", str(last - first + 1))
+        if wanted:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.end_headers()
+        for chunk in apk_pull.file_chunks(self.path_served, first, last):
+            self.wfile.write(chunk)
+            RangeHandler.sent += len(chunk)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPullInstall(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.apk = os.path.join(self.directory, "experience.apk")
+        with open(self.apk, "wb") as f:
+            f.write(os.urandom(2 * 1024 * 1024))
+        RangeHandler.path_served, RangeHandler.sent = self.apk, 0
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        self.fake = FakeAdbServer(device_count=1, latency_ms=0, jitter_ms=0).start()
+        self.headset = self.fake.devices["FAKE0000"]
+        self.headset.download_dir = os.path.join(self.directory, "headset")
+        os.mkdir(self.headset.download_dir)
+
+    def tearDown(self):
+        self.http.shutdown()
+        self.http.server_close()
+        self.fake.stop()
+        shutil.rmtree(self.directory)
+
+    def test_download_resumes_and_is_installed(self):
+        sha256 = file_sha256(self.apk)
+        # half of it downloaded by an earlier, interrupted, attempt
+        partial = os.path.join(self.headset.download_dir, os.path.basename(apk_pull.download_path(sha256)))
+        with open(self.apk, "rb") as source, open(partial, "wb") as f:
+            f.write(source.read(1024 * 1024))
+
+        device = Client(port=self.fake.port).device("FAKE0000")
+        outcome = apk_pull.pull_install(device, self.apk, sha256, f"http://127.0.0.1:{self.http.server_port}")
+        assert outcome["method"] == "pull" and outcome["bytes"] == 2 * 1024 * 1024
+        assert RangeHandler.sent == 1024 * 1024
+        assert os.listdir(self.headset.download_dir) == []
+        assert self.headset.streamed == 0
+
+    def test_corrupt_download_is_not_installed(self):
+        device = Client(port=self.fake.port).device("FAKE0000")
+        with self.assertRaises(InstallError):
+            apk_pull.pull_install(device, self.apk, "0" * 64, f"http://127.0.0.1:{self.http.server_port}")
+        assert os.listdir(self.headset.download_dir) == []
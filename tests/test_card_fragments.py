@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from starlette.templating import Jinja2Templates
+
+from card_fragments import FragmentCache
+from static_assets import StaticAssets
+
+DEVICE = {"id": "192.168.0.155:5555", "icon": {"col": "red", "icon": "icons/1-bar.svg", "text": "Blue 1"}, "message": "", "ip": True}
+
+
+class TestCardFragments(TestCase):
+
+    def setUp(self):
+        env = Jinja2Templates(directory="templates").env
+        env.globals["static_url"] = StaticAssets("static").url
+        self.cache = FragmentCache(env, ["icons/1-bar.svg"])
+
+    def test_only_changed_fragments_are_sent(self):
+        first = self.cache.fragments("card", [DEVICE], {})
+        assert first["devices"] == [DEVICE["id"]]
+        card = first["fragments"][DEVICE["id"]]
+        assert "Blue 1" in card["html"] and "color: red" in card["html"]
+        assert "wifi-connect" not in card["html"]
+
+        assert self.cache.fragments("card", [DEVICE], {DEVICE["id"]: card["hash"]})["fragments"] == {}
+
+        dropped = dict(DEVICE, message="Wifi issue!")
+        changed = self.cache.fragments("card", [dropped], {DEVICE["id"]: card["hash"]})["fragments"]
+        assert changed[DEVICE["id"]]["hash"] != card["hash"]
+        assert "Wifi issue!" in changed[DEVICE["id"]]["html"]
+        assert self.cache.stats["rendered"] == 2
+
+    def test_a_new_page_gets_the_cached_render(self):
+        self.cache.fragments("row", [DEVICE], {})
+        row = self.cache.fragments("row", [DEVICE], {})["fragments"][DEVICE["id"]]["html"]
+        assert row.strip().startswith(f'<tr id="{DEVICE["id"]}"')
+        assert self.cache.stats == {"rendered": 1, "cached": 1, "unchanged": 0}
+
+    def test_unknown_icons_are_not_included(self):
+        device = dict(DEVICE, icon={"col": "red", "icon": "../main.py", "text": ""})
+        html = self.cache.fragments("card", [device], {})["fragments"][DEVICE["id"]]["html"]
+        assert "bi-brush" in html
+        assert DEVICE["id"] in html
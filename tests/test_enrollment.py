@@ -0,0 +1,38 @@
+import asyncio
+from unittest import TestCase
+
+from benchmarks.fake_adb import FakeAdbServer
+from enrollment import DeviceTracker, is_usb, parse_device_list
+
+
+class TestEnrollment(TestCase):
+
+    def test_parse_device_list(self):
+        payload = "1WMHH000000001\tdevice\n1WMHH000000002\tunauthorized\n192.168.0.155:5555\tdevice\n"
+        devices = parse_device_list(payload)
+        assert devices == {
+            "1WMHH000000001": "device",
+            "1WMHH000000002": "unauthorized",
+            "192.168.0.155:5555": "device",
+        }
+        assert [serial for serial in devices if is_usb(serial)] == ["1WMHH000000001", "1WMHH000000002"]
+
+    def test_tracker_follows_the_adb_server(self):
+        fake = FakeAdbServer(device_count=3, latency_ms=0, jitter_ms=0).start()
+        try:
+            async def track():
+                tracker = DeviceTracker("127.0.0.1", fake.port)
+                assert sorted(await tracker.usb_devices()) == ["FAKE0000", "FAKE0001", "FAKE0002"]
+
+                tracker.start()
+                await asyncio.wait_for(tracker.changed.wait(), 5)
+                changed = tracker.changed
+                fake._loop.call_soon_threadsafe(fake.devices.pop, "FAKE0002")
+                fake._loop.call_soon_threadsafe(fake._notify_trackers)
+                await asyncio.wait_for(changed.wait(), 5)
+                tracker.stop()
+                return tracker.devices
+
+            assert sorted(asyncio.run(track())) == ["FAKE0000", "FAKE0001"]
+        finally:
+            fake.stop()
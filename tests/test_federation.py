@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+from unittest import TestCase
+
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+from federation import Federation, merge_devices, merge_results
+from main import app, federation_stage_apk
+from models_pydantic import Experience
+
+
+class DisconnectingRequest:
+    """A hub that goes away part way through sending an APK."""
+
+    headers = {}
+
+    async def stream(self):
+        yield os.urandom(3 * 1024 * 1024)
+        raise ClientDisconnect()
+
+
+class TestFederation(TestCase):
+
+    def test_route_splits_devices_by_node(self):
+        federation = Federation(peers=["http://pi2:8000", "http://pi3:8000"])
+        federation.device_nodes = {"10.0.0.31": "http://pi2:8000", "10.0.0.41": "http://pi3:8000"}
+
+        assert federation.route(["10.0.0.11", "10.0.0.31", "10.0.0.41"]) == {
+            None: ["10.0.0.11"],
+            "http://pi2:8000": ["10.0.0.31"],
+            "http://pi3:8000": ["10.0.0.41"],
+        }
+        # no devices means all of them, so every node is asked
+        assert federation.route([]) == {None: [], "http://pi2:8000": [], "http://pi3:8000": []}
+
+    def test_merge_devices_tags_nodes(self):
+        local = {"devices": [{"id": "10.0.0.11"}], "errs": []}
+        merged = merge_devices(
+            local,
+            {
+                "http://pi2:8000": {"devices": [{"id": "10.0.0.31"}], "errs": ["unauthorised"]},
+                "http://pi3:8000": {"success": False, "error": "unreachable (ConnectTimeout)"},
+            },
+        )
+        assert merged["devices"] == [{"id": "10.0.0.11", "node": None}, {"id": "10.0.0.31", "node": "http://pi2:8000"}]
+        assert merged["errs"] == ["http://pi2:8000: unauthorised", "http://pi3:8000: unreachable (ConnectTimeout)"]
+
+    def test_merge_results(self):
+        merged = merge_results(
+            {
+                "local": {"success": True, "device_count": 3},
+                "http://pi2:8000": {"success": False, "error": "Cannot find the Experience APK"},
+                "http://pi3:8000": {"success": True, "device_count": 2},
+            }
+        )
+        assert not merged["success"]
+        assert merged["device_count"] == 5
+        assert merged["error"] == "http://pi2:8000: Cannot find the Experience APK"
+
+    def test_merge_results_keeps_every_nodes_job(self):
+        merged = merge_results(
+            {
+                "local": {"success": True, "device_count": 3, "job_id": 7},
+                "http://pi2:8000": {"success": True, "device_count": 2, "job_id": 7},
+            }
+        )
+        assert merged["jobs"] == {"local": 7, "http://pi2:8000": 7}
+        assert "job_id" not in merged
+
+    def test_fan_out_sends_each_node_its_devices(self):
+        federation = Federation(peers=["http://pi2:8000"])
+        federation.device_nodes = {"10.0.0.31": "http://pi2:8000"}
+        sent = {}
+
+        async def call(peer, method, path, json=None):
+            sent[peer] = json["devices"]
+            return {"success": True, "device_count": len(json["devices"])}
+
+        async def run_local(payload):
+            sent["local"] = payload.devices
+            return {"success": True, "device_count": len(payload.devices)}
+
+        federation.call = call
+        payload = Experience(devices=["10.0.0.11", "10.0.0.31"], experience="com.simu.demo.apk")
+        result = asyncio.run(federation.fan_out("/stop", payload, run_local))
+
+        assert sent == {"local": ["10.0.0.11"], "http://pi2:8000": ["10.0.0.31"]}
+        assert result["success"] and result["device_count"] == 2
+
+
+class TestStageApk(TestCase):
+
+    def setUp(self):
+        self.made_dir = not os.path.isdir("apks")
+        os.makedirs("apks", exist_ok=True)
+        self.path = os.path.join("apks", "test-stage.apk")
+        self.partial_path = os.path.join("apks", ".test-stage.apk.partial")
+
+    def tearDown(self):
+        for path in (self.path, self.partial_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if self.made_dir:
+            os.rmdir("apks")
+
+    def test_staged_apk_is_checked(self):
+        content = os.urandom(2 * 1024 * 1024 + 10)
+        sha256 = hashlib.sha256(content).hexdigest()
+        client = TestClient(app)
+        response = client.put("/federation/apks/test-stage.apk", data=content, headers={"X-Simu-Sha256": sha256})
+        assert response.json() == {"success": True, "sha256": sha256}
+        with open(self.path, "rb") as f:
+            assert f.read() == content
+
+        response = client.put("/federation/apks/test-stage.apk", data=b"corrupted", headers={"X-Simu-Sha256": sha256})
+        assert not response.json()["success"]
+        assert not os.path.exists(self.partial_path)
+
+    def test_interrupted_upload_leaves_nothing_behind(self):
+        with self.assertRaises(ClientDisconnect):
+            asyncio.run(federation_stage_apk(DisconnectingRequest(), "test-stage.apk"))
+        assert not os.path.exists(self.partial_path)
+        assert not os.path.exists(self.path)
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from fleet_status import parse_status, SEPARATOR
+
+
+class TestFleetStatus(TestCase):
+
+    def test_parse_status(self):
+        output = (
+            "  level: 64\n"
+            f"{SEPARATOR}\n"
+            "    mResumedActivity: ActivityRecord{1a2b3c u0 com.StoryFutures.experience/.MainActivity t12}\n"
+            f"{SEPARATOR}\n"
+            "Display Power: state=OFF\n"
+            f"{SEPARATOR}\n"
+            "volume is 7 in range [0..15]\n"
+        )
+        assert parse_status(output) == {
+            "battery": 64,
+            "current_app": "com.StoryFutures.experience",
+            "screen_on": False,
+            "volume": 7,
+        }
+
+    def test_parse_status_missing_sections(self):
+        output = f"  level: 12\n{SEPARATOR}\n{SEPARATOR}\n{SEPARATOR}\n/system/bin/sh: cmd: not found\n"
+        assert parse_status(output) == {"battery": 12, "current_app": None, "screen_on": None, "volume": None}
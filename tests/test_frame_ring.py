@@ -0,0 +1,85 @@
+import asyncio
+import multiprocessing
+import tempfile
+import time
+from unittest import TestCase
+
+from frame_ring import FrameRing, FrameRings, SEQUENCE
+from image_pipeline import ImageWorkerPool
+
+
+def publish_from_another_process(directory, payload):
+    ring = FrameRing("192.168.0.155:5555", directory)
+    assert ring.try_capture()
+    ring.publish(payload, 108)
+    ring.close()
+
+
+class TestFrameRing(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ring = FrameRing("192.168.0.155:5555", self.directory, slots=3, slot_bytes=64)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_frames_are_shared_between_processes(self):
+        assert self.ring.latest() is None
+        process = multiprocessing.get_context("spawn").Process(
+            target=publish_from_another_process, args=(self.directory, b"frame from another worker")
+        )
+        process.start()
+        process.join(30)
+        frame = self.ring.latest()
+        assert frame.payload == b"frame from another worker"
+        assert frame.height == 108 and frame.sequence == 1
+
+    def test_newest_frame_wins_as_the_ring_wraps(self):
+        for count in range(7):
+            self.ring.publish(f"frame {count}".encode(), 108)
+        assert self.ring.latest().payload == b"frame 6"
+        assert self.ring.publish(b"x" * 65, 108) == 0
+
+    def test_stale_and_half_written_frames_are_not_served(self):
+        self.ring.publish(b"old", 108, timestamp=time.time() - 10)
+        assert self.ring.latest(max_age=1) is None
+        assert self.ring.latest().payload == b"old"
+
+        sequence = self.ring.publish(b"new", 108)
+        # as if the writer were part way through overwriting the slot
+        SEQUENCE.pack_into(self.ring.map, self.ring._slot_offset(sequence), 2 * sequence + 1)
+        assert self.ring.latest() is None
+
+    def test_one_capture_at_a_time(self):
+        other = FrameRing("192.168.0.155:5555", self.directory)
+        try:
+            assert self.ring.try_capture()
+            assert not other.try_capture()
+            self.ring.release_capture()
+            assert other.try_capture()
+        finally:
+            other.close()
+
+    def test_capture_lock_is_kept_until_the_last_capture_in_the_worker_is_done(self):
+        other = FrameRing("192.168.0.155:5555", self.directory)
+        try:
+            # two thumbnail heights of the same headset captured at once
+            assert self.ring.try_capture()
+            assert self.ring.try_capture()
+            self.ring.release_capture()
+            assert not other.try_capture()
+            self.ring.release_capture()
+            assert other.try_capture()
+        finally:
+            other.close()
+
+    def test_pool_serves_a_fresh_shared_frame_without_capturing(self):
+        rings = FrameRings(self.directory, max_age=5)
+        rings.get("192.168.0.155:5555").publish(b"aGVsbG8=", 108)
+        pool = ImageWorkerPool(workers=0, frame_rings=rings)
+        try:
+            assert asyncio.run(pool.thumbnail("192.168.0.155:5555", 108)) == "aGVsbG8="
+            assert pool.stats["shared"] == 1 and pool.stats["produced"] == 0
+        finally:
+            pool.shutdown()
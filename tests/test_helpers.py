@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+import helpers
+from helpers import connect_actions, config_commands, desired_config, forget_applied_config, record_applied
+
+
+class Headset:
+    def __init__(self, serial):
+        self.serial = serial
+        self.commands = []
+
+    def shell(self, command):
+        self.commands.append(command)
+        return ""
+
+
+class TestConnectActions(TestCase):
+
+    def tearDown(self):
+        helpers.applied_configs.clear()
+
+    def test_only_differences_are_sent(self):
+        desired = {"volume": 5, "screen_off_timeout": 100}
+        assert config_commands(desired, {}) == [
+            "cmd media_session volume --stream 3 --set 5",
+            "settings put system screen_off_timeout 100",
+        ]
+        assert config_commands(desired, {"volume": 10, "screen_off_timeout": 100}) == [
+            "cmd media_session volume --stream 3 --set 5"
+        ]
+        assert config_commands(desired, desired) == []
+
+    def test_reconnecting_a_configured_headset_sends_nothing(self):
+        headset = Headset("192.168.0.155:5555")
+        connect_actions(headset, 7)
+        assert len(headset.commands) == 1
+        assert "--set 7;" in headset.commands[0]
+
+        connect_actions(headset, 7)
+        assert len(headset.commands) == 1
+
+        record_applied(headset.serial, volume=3)
+        connect_actions(headset, 7)
+        assert headset.commands[-1] == "cmd media_session volume --stream 3 --set 7"
+
+        forget_applied_config(headset.serial)
+        connect_actions(headset, 7)
+        assert headset.commands[-1] == headset.commands[0]
+        assert helpers.applied_configs[headset.serial] == desired_config(7)
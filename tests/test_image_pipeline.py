@@ -0,0 +1,95 @@
+import asyncio
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import TestCase
+
+from benchmarks.fake_adb import solid_png
+from image_pipeline import ImageWorkerPool
+
+
+class Scheduler:
+    """Hands out a screencap once released, counting the screencaps asked for."""
+
+    def __init__(self):
+        self.captures = []
+        self.release = None
+
+    async def submit(self, serial, priority, func, *args, timeout=None):
+        self.captures.append(serial)
+        if self.release is not None:
+            await self.release.wait()
+        return solid_png(400, 200)
+
+
+class BrokenExecutor(Executor):
+    """As a process pool whose worker was killed, ie: by the OOM killer."""
+
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        return future
+
+    def shutdown(self, wait=True, **kwargs):
+        self.shut_down = True
+
+
+class TestImageWorkerPool(TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def pool(self, max_pending=8):
+        return ImageWorkerPool(workers=0, max_pending=max_pending, scheduler=self.scheduler)
+
+    def test_requests_for_the_same_thumbnail_share_one_capture(self):
+        pool = self.pool()
+
+        async def run():
+            self.scheduler.release = asyncio.Event()
+            browsers = [asyncio.ensure_future(pool.thumbnail("192.168.0.155:5555", 108)) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            self.scheduler.release.set()
+            return await asyncio.gather(*browsers)
+
+        try:
+            images = asyncio.run(run())
+        finally:
+            pool.shutdown()
+        assert images[0] is not None and images.count(images[0]) == 3
+        assert self.scheduler.captures == ["192.168.0.155:5555"]
+        assert pool.stats["coalesced"] == 2 and pool.stats["produced"] == 1
+
+    def test_requests_beyond_max_pending_are_shed(self):
+        pool = self.pool(max_pending=1)
+
+        async def run():
+            self.scheduler.release = asyncio.Event()
+            first = asyncio.ensure_future(pool.thumbnail("192.168.0.155:5555", 108))
+            await asyncio.sleep(0.05)
+            shed = await pool.thumbnail("192.168.0.156:5555", 108)
+            self.scheduler.release.set()
+            return await first, shed
+
+        try:
+            first, shed = asyncio.run(run())
+        finally:
+            pool.shutdown()
+        assert first is not None and shed is None
+        assert self.scheduler.captures == ["192.168.0.155:5555"]
+        assert pool.stats["shed"] == 1
+
+    def test_a_broken_pool_is_replaced(self):
+        pool = self.pool()
+        broken = pool._executor = BrokenExecutor()
+        try:
+            assert asyncio.run(pool.thumbnail("192.168.0.155:5555", 108)) is None
+            assert pool.stats["failed"] == 1
+            assert broken.shut_down
+            assert asyncio.run(pool.thumbnail("192.168.0.155:5555", 108)) is not None
+            assert not isinstance(pool.executor, BrokenExecutor)
+            assert pool.stats["produced"] == 1
+        finally:
+            pool.shutdown()
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from jobs import JobQueue, JobContext
+from sql_app import crud
+from sql_app.database import Base
+from state_backend import SqliteBackend, MemoryBackend, NODE_ID, LEASE_TTL_S
+
+
+class FlakyBackend(MemoryBackend):
+    """Fails to renew leases the given number of times, as a sqlite backend whose database is locked."""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def acquire_lease(self, serial, owner=NODE_ID, ttl=LEASE_TTL_S):
+        if self.failures and self.leases():
+            self.failures -= 1
+            raise OSError("database is locked")
+        return super().acquire_lease(serial, owner, ttl)
+
+
+class TestJobQueue(TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self.queue = JobQueue(self.session_factory, workers=2)
+        self.attempts = []
+
+        @self.queue.handler("install")
+        async def install(job: JobContext):
+            async def install_on(serial):
+                self.attempts.append(serial)
+                if serial == "offline":
+                    raise RuntimeError("Temporarily unavailable")
+                return "Installed " + job.params["apk_path"]
+
+            await job.each_device(install_on)
+
+    def test_per_device_status_is_persisted(self):
+        async def submit():
+            job = self.queue.submit("install", {"apk_path": "apks/demo.apk"}, ["q1", "offline", "q2"])
+            assert job["status"] == "queued"
+            while not self.queue.get(job["id"])["finished"]:
+                await asyncio.sleep(0.01)
+            return job["id"]
+
+        job = self.queue.get(asyncio.run(submit()))
+        assert job["status"] == "failed"
+        assert job["message"] == "Failed on 1 of 3 devices"
+        assert [(device["serial"], device["status"]) for device in job["devices"]] == [
+            ("q1", "done"), ("offline", "failed"), ("q2", "done")
+        ]
+        assert job["devices"][0]["message"] == "Installed apks/demo.apk"
+        assert job["devices"][1]["message"] == "Temporarily unavailable"
+
+    def test_resume_skips_devices_already_done(self):
+        db = self.session_factory()
+        job_id = crud.create_job(db, "install", {"apk_path": "apks/demo.apk"}, ["q1", "q2"]).id
+        crud.update_job(db, job_id, "running")
+        crud.update_job_device(db, job_id, "q1", "done")
+        db.close()
+
+        async def resume():
+            assert await self.queue.resume() == [job_id]
+            while not self.queue.get(job_id)["finished"]:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(resume())
+        assert self.attempts == ["q2"]
+        assert self.queue.get(job_id)["status"] == "done"
+
+    def test_two_workers_resume_a_job_once(self):
+        folder = tempfile.TemporaryDirectory()
+        state = SqliteBackend(os.path.join(folder.name, "state.db"))
+        queues = [JobQueue(self.session_factory, workers=2, state=state, owner=owner) for owner in ("w1", "w2")]
+        for queue in queues:
+            queue.handlers = self.queue.handlers
+        db = self.session_factory()
+        job_id = crud.create_job(db, "install", {"apk_path": "apks/demo.apk"}, ["q1", "q2"]).id
+        crud.update_job(db, job_id, "running")
+        db.close()
+
+        async def resume():
+            resumed = await asyncio.gather(*[queue.resume() for queue in queues])
+            while any(queue.running for queue in queues):
+                await asyncio.sleep(0.01)
+            return resumed
+
+        try:
+            assert sorted(asyncio.run(resume())) == [[], [job_id]]
+            assert sorted(self.attempts) == ["q1", "q2"]
+            # finished, so its lease is given up
+            assert state.leases() == {}
+        finally:
+            state.close()
+            folder.cleanup()
+
+    def slow_queue(self, state, lease_ttl):
+        queue = JobQueue(self.session_factory, workers=2, state=state, owner="w1", lease_ttl=lease_ttl)
+
+        @queue.handler("install")
+        async def install(job: JobContext):
+            async def install_on(serial):
+                for _ in range(4):
+                    await asyncio.sleep(0.1)
+                    self.attempts.append(serial)
+
+            await job.each_device(install_on)
+
+        return queue
+
+    def run_job(self, queue, state=None, taken_by=None):
+        async def run():
+            job = queue.submit("install", {}, ["q1"])
+            if taken_by is not None:
+                await asyncio.sleep(0.05)
+                # as if the lease had expired and another worker took the job over
+                state.release_lease(f"job:{job['id']}", "w1")
+                state.acquire_lease(f"job:{job['id']}", taken_by, 60)
+            while queue.running:
+                await asyncio.sleep(0.01)
+            return queue.get(job["id"])
+
+        return asyncio.run(run())
+
+    def test_a_failed_lease_renewal_is_retried(self):
+        state = FlakyBackend(failures=2)
+        job = self.run_job(self.slow_queue(state, lease_ttl=0.3), state)
+        assert job["status"] == "done"
+        assert self.attempts == ["q1"] * 4
+        assert state.failures == 0
+
+    def test_a_job_whose_lease_was_lost_is_stopped(self):
+        state = MemoryBackend()
+        job = self.run_job(self.slow_queue(state, lease_ttl=0.3), state, taken_by="w2")
+        assert job["status"] == "running"
+        assert len(self.attempts) < 4
+        assert state.lease_owner(f"job:{job['id']}") == "w2"
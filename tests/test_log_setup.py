@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import queue
+import tempfile
+from unittest import TestCase
+
+from log_setup import setup_logging, stop_logging, log_context, DroppingQueueHandler
+
+
+class TestLogSetup(TestCase):
+
+    def setUp(self):
+        self.log_file = os.path.join(tempfile.mkdtemp(), "api.log")
+        self.logger = logging.getLogger("test-log-setup")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        stop_logging(self.logger)
+
+    def read_entries(self):
+        stop_logging(self.logger)
+        with open(self.log_file) as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_carry_the_serial_and_action(self):
+        setup_logging(self.logger, log_file=self.log_file, console=False)
+        with log_context(serial="192.168.0.155:5555", action="install"):
+            self.logger.info("Installing %s", "experience.apk")
+        self.logger.info("No headset", extra={"action": "startup"})
+
+        first, second = self.read_entries()
+        assert first["message"] == "Installing experience.apk"
+        assert first["serial"] == "192.168.0.155:5555" and first["action"] == "install"
+        assert "serial" not in second and second["action"] == "startup"
+
+    def test_exceptions_are_kept(self):
+        setup_logging(self.logger, log_file=self.log_file, console=False)
+        try:
+            raise RuntimeError("device offline")
+        except RuntimeError:
+            self.logger.exception("Failed")
+        entry, = self.read_entries()
+        assert "RuntimeError: device offline" in entry["exception"]
+
+    def test_log_files_are_capped(self):
+        setup_logging(self.logger, log_file=self.log_file, max_bytes=2000, backups=2, console=False)
+        for count in range(200):
+            self.logger.info(f"line {count}")
+        stop_logging(self.logger)
+        files = sorted(os.listdir(os.path.dirname(self.log_file)))
+        assert files == ["api.log", "api.log.1", "api.log.2"]
+        assert all(os.path.getsize(os.path.join(os.path.dirname(self.log_file), name)) <= 2000 for name in files)
+
+    def test_a_full_queue_drops_rather_than_blocks(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        self.logger.addHandler(handler)
+        try:
+            self.logger.info("first")
+            self.logger.info("second")
+        finally:
+            self.logger.removeHandler(handler)
+        assert handler.dropped == 1
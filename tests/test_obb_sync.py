@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from ppadb.client import Client
+
+import obb_sync
+from benchmarks.fake_adb import FakeAdbServer
+
+REMOTE_DIR = "/sdcard/Android/obb/com.simu.maze"
+
+
+class TestObbSync(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.local_dir = os.path.join(self.directory, "com.simu.maze")
+        for name, size in (("main.1.com.simu.maze.obb", 300 * 1024), ("levels/one.bundle", 1000),
+                           ("levels/two bundle", 2000)):
+            path = os.path.join(self.local_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            os.utime(path, (1700000000, 1700000000))
+        self.fake = FakeAdbServer(device_count=1, latency_ms=0, jitter_ms=0).start()
+        self.headset = self.fake.devices["FAKE0000"]
+        self.headset.storage_dir = os.path.join(self.directory, "headset")
+        self.device = Client(port=self.fake.port).device("FAKE0000")
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.directory)
+
+    def sync(self):
+        manifest = obb_sync.local_manifest(self.local_dir)
+        return obb_sync.sync_device(self.device, self.local_dir, REMOTE_DIR, manifest)
+
+    def remote_path(self, name):
+        return os.path.join(self.headset.storage_dir, "Android/obb/com.simu.maze", name)
+
+    def test_only_changes_are_sent(self):
+        first = self.sync()
+        assert first["pushed"] == 3 and first["bytes"] == 300 * 1024 + 3000
+        with open(self.remote_path("levels/two bundle"), "rb") as remote, \
+                open(os.path.join(self.local_dir, "levels/two bundle"), "rb") as local:
+            assert remote.read() == local.read()
+        assert self.sync()["pushed"] == 0
+
+        # a new build of one level, same size
+        with open(os.path.join(self.local_dir, "levels/one.bundle"), "wb") as f:
+            f.write(os.urandom(1000))
+        second = self.sync()
+        assert second["pushed"] == 1 and second["bytes"] == 1000 and second["unchanged"] == 2
+
+    def test_same_content_with_another_time_is_not_sent(self):
+        self.sync()
+        os.utime(self.remote_path("main.1.com.simu.maze.obb"), (1800000000, 1800000000))
+        assert self.sync()["pushed"] == 0
+
+    def test_many_files_are_compared_in_batches(self):
+        manifest = obb_sync.local_manifest(self.local_dir)
+        chars = obb_sync.SCRIPT_CHARS
+        obb_sync.SCRIPT_CHARS = 300
+        try:
+            assert len(obb_sync.remote_scripts(REMOTE_DIR, manifest)) == 3
+            self.sync()
+            assert self.sync()["pushed"] == 0
+        finally:
+            obb_sync.SCRIPT_CHARS = chars
+
+    def test_throttle(self):
+        throttle = obb_sync.Throttle(1024 * 1024)
+        started = time.monotonic()
+        for _ in range(3):
+            throttle.consume(256 * 1024)
+        assert time.monotonic() - started >= 0.4
@@ -0,0 +1,43 @@
+import asyncio
+from unittest import TestCase
+
+from onboarding import Onboarding, OnboardingError, parse_wlan_ip
+from scheduler import DeviceScheduler
+
+
+class StuckHeadset(Onboarding):
+    """Answers over USB but never accepts the wifi connection."""
+
+    async def _wlan_ip(self, usb_serial):
+        return "192.168.0.155"
+
+    async def _tcpip(self, usb_serial):
+        pass
+
+    async def _connect(self, serial):
+        await asyncio.sleep(60)
+
+
+class TestOnboarding(TestCase):
+
+    def test_parse_wlan_ip(self):
+        output = (
+            "3: wlan0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc mq state UP group default qlen 3000\n"
+            "    link/ether 2c:26:17:00:00:01 brd ff:ff:ff:ff:ff:ff\n"
+            "    inet 192.168.0.155/24 brd 192.168.0.255 scope global wlan0\n"
+        )
+        assert parse_wlan_ip(output) == "192.168.0.155"
+        assert parse_wlan_ip("Device \"wlan0\" does not exist.\n") is None
+
+    def test_stage_timeout_names_the_stage(self):
+        stages = []
+        onboarding = StuckHeadset(DeviceScheduler(threads=1), configure=print, timeouts={"connect": 0.05})
+
+        async def run():
+            await onboarding.onboard(usb_serial="1WMHH000000001", progress=lambda stage, *_: stages.append(stage))
+
+        with self.assertRaises(OnboardingError) as raised:
+            asyncio.run(run())
+        assert raised.exception.stage == "connect"
+        assert "same router" in str(raised.exception)
+        assert stages == ["wlan_ip", "tcpip"]
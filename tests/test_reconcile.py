@@ -0,0 +1,141 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ppadb.client import Client
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from benchmarks.fake_adb import FakeAdbServer
+from helpers import HOME_APP_APK
+from reconcile import parse_observed, plan, HOME_ACTIVITY, Reconciler
+from scheduler import DeviceScheduler
+from sql_app import crud, schemas
+from sql_app.database import Base
+from sql_app.models import DeviceTypes
+from state_backend import MemoryBackend
+
+OBSERVED = (
+    "volume is 10 in range [0..15]\n"
+    "30000\n"
+    "package:com.oculus.shellenv\n"
+    "package:com.StoryFutures.experience\n"
+    "    mResumedActivity: ActivityRecord{1a2b3c u0 com.oculus.shellenv/.ShellEnvActivity t12}\n"
+)
+
+
+class TestReconcile(TestCase):
+
+    def test_parse_observed(self):
+        observed = parse_observed(OBSERVED)
+        assert observed["volume"] == 10
+        assert observed["screen_off_timeout"] == 30000
+        assert observed["packages"] == ["com.oculus.shellenv", "com.StoryFutures.experience"]
+        assert observed["resumed"] == "com.oculus.shellenv/.ShellEnvActivity"
+
+    def test_plan_does_only_what_differs(self):
+        observed = parse_observed(OBSERVED)
+        profile = {"apk_name": "com.StoryFutures.experience.apk", "volume": 10, "screen_off_timeout": None}
+        assert plan(profile, observed) == {"install": [], "shell": []}
+
+        profile = {"apk_name": "com.Other.experience.apk", "volume": 8, "screen_off_timeout": 14400000}
+        assert plan(profile, observed) == {
+            "install": ["com.Other.experience.apk"],
+            "shell": [
+                "cmd media_session volume --stream 3 --set 8",
+                "settings put system screen_off_timeout 14400000",
+            ],
+        }
+
+    def test_a_new_apk_replaces_the_one_installed_earlier(self):
+        observed = parse_observed(OBSERVED)
+        profile = {"apk_name": "com.StoryFutures.experience.apk"}
+        installed = {"com.StoryFutures.experience.apk": "old"}
+        assert plan(profile, observed, installed, "new")["install"] == ["com.StoryFutures.experience.apk"]
+        assert plan(profile, observed, installed, "old")["install"] == []
+
+    def test_a_renamed_apk_is_known_by_its_package(self):
+        observed = parse_observed(OBSERVED)
+        profile = {"apk_name": "Maze final v3.apk", "package_name": "com.StoryFutures.experience"}
+        assert plan(profile, observed)["install"] == []
+        profile["package_name"] = None
+        assert plan(profile, observed)["install"] == ["Maze final v3.apk"]
+
+    def test_home_app_is_never_started_over_an_experience(self):
+        observed = parse_observed(OBSERVED)
+        assert plan({"home_app": True}, observed) == {"install": [HOME_APP_APK], "shell": [f"am start -n {HOME_ACTIVITY}"]}
+
+        observed["resumed"] = "com.StoryFutures.experience/com.unity3d.player.UnityPlayerActivity"
+        assert plan({"home_app": True}, observed)["shell"] == []
+
+
+class TestReconciler(TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self.apk_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.apk_dir, "com.simu.maze.apk"), "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        self.fake = FakeAdbServer(device_count=2, latency_ms=0, jitter_ms=0).start()
+        self.scheduler = DeviceScheduler(threads=4)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+        self.fake.stop()
+        shutil.rmtree(self.apk_dir)
+
+    def reconciler(self):
+        async def list_devices():
+            return {serial: "device" for serial in self.fake.devices}
+
+        return Reconciler(
+            self.session_factory, self.scheduler, Client(port=self.fake.port), MemoryBackend(), list_devices,
+            apk_dir=self.apk_dir,
+        )
+
+    def test_renamed_apk_is_not_installed_again(self):
+        os.rename(os.path.join(self.apk_dir, "com.simu.maze.apk"), os.path.join(self.apk_dir, "Maze v3.apk"))
+        db = self.session_factory()
+        item = crud.create_apk_details_item(db, schemas.APKDetailsCreate(
+            experience_name="Maze", apk_name="Maze v3.apk", command="", device_type=DeviceTypes.quest
+        ))
+        crud.set_apk_manifest(db, item, {
+            "package": "com.simu.maze", "version_code": 3, "launch_activity": None, "is_vr": True
+        })
+        crud.set_fleet_profile(db, "venue", [], "Maze v3.apk")
+        db.close()
+        for device in self.fake.devices.values():
+            device.packages.append("com.simu.maze")
+        reconciler = self.reconciler()
+
+        report = asyncio.run(reconciler.reconcile())
+        assert report["FAKE0000"] == {"in_line": True, "actions": [], "error": None}
+        assert self.fake.devices["FAKE0000"].streamed == 0
+
+    def test_a_refused_install_is_reported_and_backed_off(self):
+        db = self.session_factory()
+        crud.set_fleet_profile(db, "venue", [], "com.simu.maze.apk", 8)
+        db.close()
+        broken = self.fake.devices["FAKE0000"]
+        broken.install_result = "Failure [INSTALL_FAILED_INSUFFICIENT_STORAGE]"
+        reconciler = self.reconciler()
+
+        async def run():
+            first = await reconciler.reconcile()
+            again = await reconciler.reconcile()
+            return first, again
+
+        first, again = asyncio.run(run())
+        assert "INSTALL_FAILED_INSUFFICIENT_STORAGE" in first["FAKE0000"]["error"]
+        # the settings are still put right, and the other headset isn't held up
+        assert broken.volume == 8
+        assert first["FAKE0001"]["actions"][0] == "installed com.simu.maze.apk"
+        assert broken.streamed == 64 * 1024
+        # not sent again on the next pass
+        assert "next try in" in again["FAKE0000"]["error"]
+        assert broken.streamed == 64 * 1024
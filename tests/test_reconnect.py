@@ -0,0 +1,109 @@
+import asyncio
+from unittest import TestCase
+
+from reconnect import ReconnectSupervisor, backoff_delay
+from scheduler import DeviceScheduler
+from state_backend import MemoryBackend
+
+
+class Tracker:
+    def __init__(self):
+        self.devices = {}
+
+    async def list_devices(self):
+        return dict(self.devices)
+
+
+class Client:
+    def __init__(self):
+        self.reachable = False
+        self.connects = 0
+
+    def remote_connect(self, host, port):
+        self.connects += 1
+        return self.reachable
+
+    def remote_disconnect(self, host, port):
+        return True
+
+
+class Supervisor(ReconnectSupervisor):
+    """The headset's port and boot id are faked rather than asked for over the network."""
+
+    boot_id = "first-boot"
+
+    async def _reachable(self, serial):
+        return self.client.reachable
+
+    async def _boot_id(self, serial):
+        return self.boot_id
+
+
+class TestReconnect(TestCase):
+
+    def test_backoff_grows_and_is_capped(self):
+        assert backoff_delay(1, 2, 120, 0) == 2
+        assert backoff_delay(4, 2, 120, 0) == 16
+        assert backoff_delay(20, 2, 120, 0) == 120
+        assert 1.5 <= backoff_delay(1, 2, 120, 0.25) <= 2.5
+
+    def test_reconnects_and_only_reconfigures_after_a_reboot(self):
+        serial = "192.168.0.155:5555"
+        configured = []
+        tracker, client = Tracker(), Client()
+        supervisor = Supervisor(tracker, DeviceScheduler(threads=2), client, configured.append, MemoryBackend())
+
+        async def run():
+            tracker.devices = {serial: "device"}
+            client.reachable = True
+            await supervisor.check()
+            assert supervisor.known() == [serial]
+
+            # wifi drops, the first attempt fails and the next one is backed off
+            tracker.devices = {}
+            client.reachable = False
+            assert await supervisor.check() == [serial]
+            assert supervisor.stats()[serial]["failed_attempts"] == 1
+            await supervisor.check()
+            assert client.connects == 1
+
+            # back on the wifi without having rebooted: nothing to reapply
+            client.reachable = True
+            supervisor.health[serial].next_attempt = 0
+            assert await supervisor.check() == [serial]
+            assert configured == []
+
+            # dropped again and rebooted meanwhile: settings are reapplied
+            tracker.devices = {}
+            client.reachable = False
+            await supervisor.check()
+            client.reachable = True
+            supervisor.boot_id = "second-boot"
+            supervisor.health[serial].next_attempt = 0
+            await supervisor.check()
+            assert configured == [serial]
+
+        asyncio.run(run())
+        stats = supervisor.stats()[serial]
+        assert stats["status"] == "up"
+        assert stats["reconnections"] == 2
+        assert stats["mean_recovery_s"] is not None
+
+    def test_forgotten_headsets_are_left_alone(self):
+        serial = "192.168.0.155:5555"
+        tracker, client = Tracker(), Client()
+        supervisor = Supervisor(tracker, DeviceScheduler(threads=1), client, print, MemoryBackend())
+        supervisor.remember(serial)
+        supervisor.forget(serial)
+
+        asyncio.run(supervisor.check())
+        assert client.connects == 0
+        assert supervisor.stats() == {}
+
+    def test_headsets_remembered_as_a_list_are_kept(self):
+        state = MemoryBackend()
+        state.set("known_devices", ["192.168.0.155:5555"])
+        supervisor = Supervisor(Tracker(), DeviceScheduler(threads=1), Client(), print, state)
+        supervisor.remember("192.168.0.156:5555")
+        assert supervisor.known() == ["192.168.0.155:5555", "192.168.0.156:5555"]
+        assert state.get("known_devices") is None
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from scheduler import DeviceScheduler, Priority, CommandDropped
+
+
+class TestScheduler(TestCase):
+
+    def test_commands_for_a_device_run_one_at_a_time_by_priority(self):
+        scheduler = DeviceScheduler()
+        ran = []
+
+        async def command(name):
+            ran.append(name)
+            await asyncio.sleep(0.01)
+            return name
+
+        async def main():
+            first = asyncio.ensure_future(scheduler.submit("A", Priority.THUMBNAIL, command, "first"))
+            await asyncio.sleep(0)
+            queued = [
+                asyncio.ensure_future(scheduler.submit("A", Priority.INSTALL, command, "install")),
+                asyncio.ensure_future(scheduler.submit("A", Priority.CONTROL, command, "stop")),
+            ]
+            return await asyncio.gather(first, *queued)
+
+        assert asyncio.run(main()) == ["first", "install", "stop"]
+        assert ran == ["first", "stop", "install"]
+
+    def test_low_priority_work_dropped_while_control_pending(self):
+        scheduler = DeviceScheduler()
+
+        async def slow():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        async def main():
+            thumbnail = asyncio.ensure_future(scheduler.submit("A", Priority.THUMBNAIL, slow))
+            await asyncio.sleep(0)
+            battery = asyncio.ensure_future(scheduler.submit("A", Priority.STATUS, slow))
+            await asyncio.sleep(0)
+            control = asyncio.ensure_future(scheduler.submit("A", Priority.CONTROL, slow))
+            await asyncio.sleep(0)
+            with self.assertRaises(CommandDropped):
+                await scheduler.submit("A", Priority.STATUS, slow)
+            other_device = await scheduler.submit("B", Priority.STATUS, slow)
+            return await asyncio.gather(thumbnail, battery, control, return_exceptions=True), other_device
+
+        (thumbnail, battery, control), other_device = asyncio.run(main())
+        assert thumbnail == "done"
+        assert isinstance(battery, CommandDropped)
+        assert control == "done"
+        assert other_device == "done"
+
+    def test_status_polls_with_the_same_key_are_coalesced(self):
+        scheduler = DeviceScheduler()
+        calls = []
+
+        def battery_level():
+            calls.append(1)
+            return 87
+
+        async def main():
+            return await asyncio.gather(
+                *[scheduler.submit("A", Priority.STATUS, battery_level, key="battery") for _ in range(5)]
+            )
+
+        assert asyncio.run(main()) == [87] * 5
+        assert len(calls) == 1
+
+    def test_each_event_loop_keeps_its_own_queues(self):
+        scheduler = DeviceScheduler()
+        release = threading.Event()
+
+        def install(name):
+            release.wait(5)
+            return name
+
+        other_loop = asyncio.new_event_loop()
+        threading.Thread(target=other_loop.run_forever, daemon=True).start()
+        try:
+            first, second = [
+                asyncio.run_coroutine_threadsafe(scheduler.submit("A", Priority.INSTALL, install, name), other_loop)
+                for name in ("first", "second")
+            ]
+            time.sleep(0.05)
+            assert scheduler.queue_depths() == {"A": 1}
+
+            # used from another loop meanwhile, what is queued on the first one is left alone
+            assert asyncio.run(scheduler.submit("B", Priority.STATUS, lambda: "battery")) == "battery"
+            assert scheduler.queue_depths() == {"A": 1}
+            release.set()
+            assert (first.result(5), second.result(5)) == ("first", "second")
+        finally:
+            release.set()
+            other_loop.call_soon_threadsafe(other_loop.stop)
+            scheduler.shutdown()
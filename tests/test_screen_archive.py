@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import os
+import struct
+import tempfile
+from unittest import TestCase
+
+import cv2
+import numpy as np
+
+from screen_archive import ScreenArchive, jpeg_size, INDEX_RECORD
+from state_backend import MemoryBackend
+
+
+def thumbnail(shade: int) -> str:
+    image = np.full((108, 96, 3), shade, np.uint8)
+    return base64.b64encode(cv2.imencode(".png", image)[1].tobytes()).decode()
+
+
+def jpeg(shade: int) -> bytes:
+    return cv2.imencode(".jpg", np.full((108, 96, 3), shade, np.uint8))[1].tobytes()
+
+
+class TestScreenArchive(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = ScreenArchive(self.directory, budget_mb=1, interval_s=0)
+        self.archive.enabled = True
+
+    def tearDown(self):
+        self.archive.shutdown()
+
+    def test_only_changed_screens_are_kept(self):
+        async def record():
+            return [await self.archive.record("192.168.0.155:5555", thumbnail(shade)) for shade in (10, 10, 200)]
+
+        assert asyncio.run(record()) == [True, False, True]
+        summary = self.archive.summary()
+        assert summary["devices"]["192.168.0.155:5555"]["frames"] == 2
+        assert summary["unchanged"] == 1
+
+        reopened = ScreenArchive(self.directory)
+        assert reopened.summary()["devices"]["192.168.0.155:5555"]["frames"] == 2
+
+    def test_oldest_segments_are_evicted_first(self):
+        archive = ScreenArchive(self.directory, budget_mb=0.01, segment_bytes=2000)
+        frame = jpeg(50)
+        for second in range(20):
+            archive.append("first", frame, 1000 + second)
+            archive.append("second", frame, 1000.5 + second)
+        assert archive.used <= archive.budget
+        assert archive.stats["evicted_segments"] > 0
+        frames = archive.frames("first") + archive.frames("second")
+        assert min(frame[0] for frame in frames) > 1000
+        assert max(frame[0] for frame in frames) == 1019.5
+
+    def test_workers_share_one_archive_and_budget(self):
+        first = ScreenArchive(self.directory, budget_mb=0.01, segment_bytes=2000)
+        second = ScreenArchive(self.directory, budget_mb=0.01, segment_bytes=2000)
+        frame = jpeg(50)
+        for count in range(20):
+            first.append("ABC", frame, 1000 + count)
+            second.append("DEF", frame, 1000.5 + count)
+        on_disk = sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(self.directory)
+            for name in names if not name.startswith(".")
+        )
+        assert on_disk <= first.budget
+        assert first.summary()["used_mb"] == second.summary()["used_mb"]
+        assert first.frames("DEF") == second.frames("DEF")
+
+    def test_a_frame_another_worker_just_archived_is_not_kept_again(self):
+        other = ScreenArchive(self.directory)
+        assert self.archive.append("ABC", jpeg(50), 1000, min_gap=2)
+        assert not other.append("ABC", jpeg(60), 1001, min_gap=2)
+        assert other.append("ABC", jpeg(60), 1002, min_gap=2)
+        assert len(self.archive.frames("ABC")) == 2
+
+    def test_archiving_is_switched_for_every_worker(self):
+        state = MemoryBackend()
+        first, second = ScreenArchive(self.directory, state=state), ScreenArchive(self.directory, state=state)
+        assert not asyncio.run(second.is_enabled())
+        first.switch(True)
+        second._enabled_at = None
+        assert asyncio.run(second.is_enabled())
+        first.switch(False)
+        assert not second.summary()["enabled"]
+
+    def test_export_copies_frames_into_an_avi(self):
+        for second in range(5):
+            self.archive.append("ABC", jpeg(second * 40), 1000 + second)
+        path = os.path.join(self.directory, "out.avi")
+        assert self.archive.export(path, ["ABC"], start=1001, end=1003) == 3
+        with open(path, "rb") as f:
+            data = f.read()
+        assert data[:4] == b"RIFF" and data[8:12] == b"AVI "
+        assert struct.unpack("<I", data[4:8])[0] == len(data) - 8
+        assert data.count(jpeg(80)) == 1
+        capture = cv2.VideoCapture(path)
+        assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == 3
+        capture.release()
+
+    def test_grid_export(self):
+        for second in range(3):
+            self.archive.append("ABC", jpeg(20), 1000 + second)
+            self.archive.append("DEF", jpeg(220), 1000.5 + second)
+        path = os.path.join(self.directory, "grid.avi")
+        assert self.archive.export(path, ["ABC", "DEF"]) == 3
+        capture = cv2.VideoCapture(path)
+        ok, frame = capture.read()
+        capture.release()
+        assert ok and frame.shape[:2] == (108, 192)
+
+    def test_jpeg_size(self):
+        assert jpeg_size(jpeg(0)) == (96, 108)
+        assert INDEX_RECORD.size == 16
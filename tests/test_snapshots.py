@@ -0,0 +1,78 @@
+import asyncio
+from unittest import TestCase
+
+from snapshots import Snapshot
+
+
+class TestSnapshot(TestCase):
+
+    def test_concurrent_callers_share_one_refresh(self):
+        calls = []
+
+        async def refresh():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"devices": len(calls)}
+
+        async def main():
+            snapshot = Snapshot(refresh, ttl=10)
+            return await asyncio.gather(*[snapshot.get() for _ in range(10)]), snapshot
+
+        results, snapshot = asyncio.run(main())
+        assert results == [{"devices": 1}] * 10
+        assert len(calls) == 1
+        assert snapshot.etag
+
+    def test_stale_value_served_while_refreshing(self):
+        calls = []
+
+        async def refresh():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def main():
+            snapshot = Snapshot(refresh, ttl=0, stale_ttl=10)
+            first = await snapshot.get()
+            second = await snapshot.get()
+            await asyncio.sleep(0.05)
+            third = await snapshot.get()
+            return first, second, third
+
+        first, second, third = asyncio.run(main())
+        assert (first, second) == (1, 1)
+        assert third == 2
+
+    def test_a_refresh_from_before_invalidate_is_not_kept(self):
+        devices = ["q1"]
+        started = []
+
+        async def refresh():
+            seen = list(devices)
+            started.append(1)
+            await asyncio.sleep(0.05)
+            return seen
+
+        async def main():
+            snapshot = Snapshot(refresh, ttl=10)
+            before = asyncio.ensure_future(snapshot.get())
+            await asyncio.sleep(0.01)
+            # a headset connects while the first refresh is running
+            devices.append("q2")
+            snapshot.invalidate()
+            after = await snapshot.get()
+            return await before, after, await snapshot.get()
+
+        before, after, later = asyncio.run(main())
+        assert before == ["q1"]
+        assert after == later == ["q1", "q2"]
+        assert len(started) == 2
+
+    def test_each_event_loop_refreshes_on_its_own(self):
+        async def refresh():
+            await asyncio.sleep(0.01)
+            return "fleet"
+
+        snapshot = Snapshot(refresh, ttl=0)
+        assert asyncio.run(snapshot.get()) == "fleet"
+        assert asyncio.run(snapshot.get()) == "fleet"
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from state_backend import MemoryBackend, SqliteBackend, StateBackend, from_url
+
+
+class LeaseBehaviour:
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+
+    def tearDown(self):
+        self.backend.close()
+
+    def test_values_round_trip(self):
+        assert self.backend.get("volume", 10) == 10
+        self.backend.set("volume", 4)
+        self.backend.set("app_name", "com.simu.demo.apk")
+        assert self.backend.get("volume") == 4
+        assert self.backend.get("app_name") == "com.simu.demo.apk"
+        self.backend.delete("volume")
+        assert self.backend.get("volume") is None
+
+    def test_set_members_are_added_and_removed_one_at_a_time(self):
+        assert self.backend.members("known_devices") == []
+        self.backend.add_member("known_devices", "192.168.0.11:5555")
+        self.backend.add_member("known_devices", "192.168.0.10:5555")
+        self.backend.add_member("known_devices", "192.168.0.11:5555")
+        assert self.backend.members("known_devices") == ["192.168.0.10:5555", "192.168.0.11:5555"]
+        self.backend.remove_member("known_devices", "192.168.0.11:5555")
+        self.backend.remove_member("known_devices", "192.168.0.12:5555")
+        assert self.backend.members("known_devices") == ["192.168.0.10:5555"]
+
+    def test_lease_held_until_expired(self):
+        assert self.backend.acquire_lease("192.168.0.10", owner="node-a", ttl=0.2)
+        assert self.backend.acquire_lease("192.168.0.10", owner="node-a", ttl=0.2)
+        assert not self.backend.acquire_lease("192.168.0.10", owner="node-b", ttl=0.2)
+        assert self.backend.lease_owner("192.168.0.10") == "node-a"
+
+        time.sleep(0.25)
+        assert self.backend.acquire_lease("192.168.0.10", owner="node-b", ttl=10)
+        assert self.backend.lease_owner("192.168.0.10") == "node-b"
+
+    def test_leased_keeps_those_not_held_by_another(self):
+        self.backend.acquire_lease("192.168.0.12", owner="node-b")
+        assert self.backend.leased(["192.168.0.11", "192.168.0.12"], owner="node-a") == ["192.168.0.11"]
+
+    def test_release_only_by_owner(self):
+        self.backend.acquire_lease("1WMHH000000001", owner="node-a")
+        self.backend.release_lease("1WMHH000000001", owner="node-b")
+        assert self.backend.lease_owner("1WMHH000000001") == "node-a"
+        self.backend.release_lease("1WMHH000000001", owner="node-a")
+        assert self.backend.leases() == {}
+
+
+class TestMemoryBackend(LeaseBehaviour, TestCase):
+
+    def make_backend(self):
+        return MemoryBackend()
+
+
+class TestSqliteBackend(LeaseBehaviour, TestCase):
+
+    def make_backend(self):
+        self.folder = tempfile.TemporaryDirectory()
+        return SqliteBackend(os.path.join(self.folder.name, "state.db"))
+
+    def tearDown(self):
+        super().tearDown()
+        self.folder.cleanup()
+
+    def test_shared_between_connections(self):
+        other = SqliteBackend(self.backend.path)
+        try:
+            self.backend.set("volume", 7)
+            assert other.get("volume") == 7
+            assert self.backend.acquire_lease("192.168.0.11", owner="worker-1")
+            assert not other.acquire_lease("192.168.0.11", owner="worker-2")
+        finally:
+            other.close()
+
+
+class TestIncompleteBackend(TestCase):
+
+    def test_fails_when_made(self):
+        class ValuesOnly(StateBackend):
+            def get(self, key, default=None):
+                return default
+
+            def set(self, key, value):
+                pass
+
+            def delete(self, key):
+                pass
+
+        with self.assertRaises(TypeError):
+            ValuesOnly()
+
+
+class TestFromUrl(TestCase):
+
+    def test_unknown_url(self):
+        with self.assertRaises(ValueError):
+            from_url("postgres://nope")
@@ -0,0 +1,67 @@
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from static_assets import StaticAssets, AssetFiles, accepted_encodings, IMMUTABLE, REVALIDATE
+
+STYLES = "body { color: red; }\n" * 200
+
+
+class TestStaticAssets(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "css"))
+        with open(os.path.join(self.directory, "css", "project.css"), "w") as f:
+            f.write(STYLES)
+        self.assets = StaticAssets(self.directory, cache_dir=tempfile.mkdtemp())
+        app = Starlette()
+        app.mount("/static", AssetFiles(self.assets))
+        self.client = TestClient(app)
+
+    def test_urls_change_with_the_content(self):
+        url = self.assets.url("css/project.css")
+        assert url.startswith("/static/css/project.") and url.endswith(".css")
+        assert self.assets.resolve(url[len("/static/"):]) == ("css/project.css", url.split(".")[-2])
+
+        with open(os.path.join(self.directory, "css", "project.css"), "a") as f:
+            f.write("p { margin: 0; }\n")
+        assert self.assets.url("css/project.css") != url
+        assert self.assets.url("missing.js") == "/static/missing.js"
+
+    def test_accepted_encodings(self):
+        assert accepted_encodings("gzip, deflate, br;q=0") == {"gzip", "deflate"}
+        assert accepted_encodings("") == set()
+
+    def test_fingerprinted_urls_are_immutable_and_compressed(self):
+        url = self.assets.url("css/project.css")
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == IMMUTABLE
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < len(STYLES)
+        assert response.text == STYLES
+
+        again = self.client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]})
+        assert again.status_code == 304
+
+    def test_plain_and_outdated_urls_are_revalidated(self):
+        response = self.client.get("/static/css/project.css", headers={"Accept-Encoding": "identity"})
+        assert response.headers["cache-control"] == REVALIDATE
+        assert "content-encoding" not in response.headers
+        assert response.text == STYLES
+
+        outdated = self.client.get("/static/css/project.0123456789ab.css")
+        assert outdated.status_code == 200 and outdated.headers["cache-control"] == REVALIDATE
+        assert self.client.get("/static/css/missing.css").status_code == 404
+
+    def test_build_compresses_ahead_of_time(self):
+        assert self.assets.build() == 1
+        variant = self.assets.variant("css/project.css", "gzip")
+        with open(variant, "rb") as f:
+            assert gzip.decompress(f.read()).decode() == STYLES
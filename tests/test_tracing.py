@@ -0,0 +1,43 @@
+import asyncio
+from unittest import TestCase
+
+import tracing
+
+
+class TestTracing(TestCase):
+
+    def test_untraced_request_records_nothing(self):
+        before = len(tracing.recent_traces())
+        with tracing.request_trace("GET /devices") as trace:
+            with tracing.span("adb devices", "subprocess") as span_id:
+                assert span_id is None
+        assert trace is None
+        assert len(tracing.recent_traces()) == before
+
+    def test_nested_spans(self):
+        with tracing.request_trace("POST /start", force=True) as trace:
+            with tracing.span("check_alive", "adb", serial="192.168.0.2:5555") as outer:
+                with tracing.span("wait_host_port", "adb"):
+                    pass
+
+        assert trace in tracing.recent_traces()
+        spans = {span["name"]: span for span in trace.spans}
+        assert spans["wait_host_port"]["parent"] == outer
+        assert spans["check_alive"]["args"]["serial"] == "192.168.0.2:5555"
+        assert set(trace.summary()["ms_by_category"]) == {"adb"}
+
+    def test_concurrent_tasks_get_their_own_lane(self):
+        @tracing.traced("probe", "adb")
+        async def probe():
+            await asyncio.sleep(0.01)
+
+        async def request():
+            with tracing.request_trace("GET /devices", force=True) as trace:
+                await asyncio.gather(probe(), probe(), probe())
+            return trace
+
+        trace = asyncio.run(request())
+        assert len({span["tid"] for span in trace.spans}) == 3
+
+        events = tracing.chrome_trace([trace])["traceEvents"]
+        assert [event["name"] for event in events if event["ph"] == "X"].count("probe") == 3
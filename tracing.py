@@ -0,0 +1,327 @@
+"""
+Optional request tracing, used to find out where the time goes when a facilitator reports a slow start/stop.
+
+Every sampled request gets a trace, and anything running on its behalf (adb calls, db queries, subprocesses, image
+work) can record nested spans into it. The last few traces are kept in memory and served from `/debug/traces` in the
+Chrome trace event format, so they can be dropped straight into chrome://tracing or https://ui.perfetto.dev.
+
+Tracing is off unless SIMU_TRACE_SAMPLE_RATE is set (0.0 - 1.0). A request can always be forced into a trace with the
+`X-Simu-Trace: 1` header, which is handy for reproducing a report without raising the sample rate for everyone.
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+sample_rate = float(os.environ.get("SIMU_TRACE_SAMPLE_RATE", "0"))
+trace_history = int(os.environ.get("SIMU_TRACE_HISTORY", "50"))
+
+_current_trace = contextvars.ContextVar("simu_current_trace", default=None)
+_current_span = contextvars.ContextVar("simu_current_span", default=None)
+
+_trace_ids = itertools.count(1)
+_span_ids = itertools.count(1)
+_recent_traces = deque(maxlen=trace_history)
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.id = next(_trace_ids)
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans = []
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def lane(self):
+        """
+            Chrome trace nests spans by timestamp within a thread, so each asyncio task / thread gets its own lane to
+            keep concurrently running spans (eg. asyncio.gather over devices) from overlapping each other.
+        """
+        try:
+            key = id(asyncio.current_task())
+        except RuntimeError:
+            key = threading.get_ident()
+        with self._lock:
+            return self._lanes.setdefault(key, len(self._lanes))
+
+    def add(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def duration_ms(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def summary(self):
+        by_category = {}
+        for span in self.spans:
+            by_category[span["cat"]] = by_category.get(span["cat"], 0) + span["dur"]
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "span_count": len(self.spans),
+            "ms_by_category": {cat: round(dur / 1000, 3) for cat, dur in by_category.items()},
+        }
+
+    def to_events(self):
+        pid = self.id
+        events = [
+            {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"#{self.id} {self.name}"}},
+            {
+                "name": self.name,
+                "cat": "request",
+                "ph": "X",
+                "pid": pid,
+                "tid": 0,
+                "ts": 0,
+                "dur": round(self.duration_ms * 1000, 1),
+            },
+        ]
+        for span in self.spans:
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["cat"],
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": span["tid"],
+                    "ts": span["ts"],
+                    "dur": span["dur"],
+                    "args": dict(span["args"], span_id=span["id"], parent_id=span["parent"]),
+                }
+            )
+        return events
+
+
+def should_sample(force: bool = False):
+    return force or (sample_rate > 0 and random.random() < sample_rate)
+
+
+@contextmanager
+def request_trace(name: str, force: bool = False):
+    """
+        Starts a trace for the current request if it is sampled. Yields the Trace or None.
+    """
+    if _current_trace.get() is not None or not should_sample(force):
+        yield _current_trace.get()
+        return
+
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.end = time.perf_counter()
+        _current_trace.reset(token)
+        _recent_traces.append(trace)
+
+
+@contextmanager
+def span(name: str, category: str = "app", **args):
+    """
+        Records a span into the current trace. Costs a single contextvar lookup when the request is not traced.
+
+    :param name: what is being timed, ie: 'adb shell'
+    :param category: one of adb, db, subprocess, image, pool or app. Used to group time in the summary.
+    :param args: any extra details to attach, ie: the device serial
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    span_id = next(_span_ids)
+    parent = _current_span.get()
+    token = _current_span.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield span_id
+    finally:
+        end = time.perf_counter()
+        _current_span.reset(token)
+        trace.add(
+            {
+                "id": span_id,
+                "parent": parent,
+                "name": name,
+                "cat": category,
+                "tid": trace.lane() + 1,
+                "ts": round((start - trace.start) * 1_000_000, 1),
+                "dur": round((end - start) * 1_000_000, 1),
+                "args": {key: str(value) for key, value in args.items()},
+            }
+        )
+
+
+def traced(name: str = None, category: str = "app"):
+    """
+        Decorator version of span() that works for both plain and async functions.
+    """
+
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, category):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_in_executor(executor, func, *args):
+    """
+        loop.run_in_executor does not carry contextvars over to the worker thread, so spans recorded there would be
+        lost. This copies the context across first.
+    """
+    loop = asyncio.get_event_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        # contexts can't be pickled, and spans from another process couldn't be recorded anyway
+        return loop.run_in_executor(executor, func, *args)
+    context = contextvars.copy_context()
+    return loop.run_in_executor(executor, functools.partial(context.run, func, *args))
+
+
+class TraceMiddleware:
+    """
+        Wraps sampled requests in a trace so their adb/db/subprocess/image spans can be inspected at /debug/traces.
+
+        A plain ASGI middleware rather than @app.middleware("http"): starlette's BaseHTTPMiddleware runs the endpoint
+        in a separate task and chokes on template responses under the test client.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        force = (b"x-simu-trace", b"1") in scope.get("headers", [])
+        with request_trace(f"{scope['method']} {scope['path']}", force=force) as trace:
+            if trace is None:
+                return await self.app(scope, receive, send)
+
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", [])) + [(b"x-simu-trace-id", str(trace.id).encode())]
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_id)
+
+
+def instrument_engine(engine):
+    """
+        Records every SQL statement run through the engine as a 'db' span.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = _current_trace.get()
+        if trace is not None:
+            conn.info.setdefault("simu_trace_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = _current_trace.get()
+        starts = conn.info.get("simu_trace_start")
+        if trace is None or not starts:
+            return
+        start = starts.pop()
+        end = time.perf_counter()
+        trace.add(
+            {
+                "id": next(_span_ids),
+                "parent": _current_span.get(),
+                "name": statement.split(" ", 1)[0],
+                "cat": "db",
+                "tid": trace.lane() + 1,
+                "ts": round((start - trace.start) * 1_000_000, 1),
+                "dur": round((end - start) * 1_000_000, 1),
+                "args": {"statement": statement[:200]},
+            }
+        )
+
+
+def instrument_ppadb():
+    """
+        Wraps the ppadb device methods that talk to the adb server so each call shows up as an 'adb' span.
+    """
+    from ppadb.device import Device
+    from ppadb.device_async import DeviceAsync
+
+    def wrap(cls, method_name):
+        original = getattr(cls, method_name)
+        if getattr(original, "_simu_traced", False):
+            return
+
+        if inspect.iscoroutinefunction(original):
+
+            @functools.wraps(original)
+            async def wrapper(self, *args, **kwargs):
+                with span(method_name, "adb", serial=self.serial, args=" ".join(str(a) for a in args)[:120]):
+                    return await original(self, *args, **kwargs)
+
+        else:
+
+            @functools.wraps(original)
+            def wrapper(self, *args, **kwargs):
+                with span(method_name, "adb", serial=self.serial, args=" ".join(str(a) for a in args)[:120]):
+                    return original(self, *args, **kwargs)
+
+        wrapper._simu_traced = True
+        setattr(cls, method_name, wrapper)
+
+    for method_name in ("shell", "install", "screencap", "get_battery_level", "get_state", "reboot"):
+        if hasattr(Device, method_name):
+            wrap(Device, method_name)
+    if hasattr(DeviceAsync, "shell"):
+        wrap(DeviceAsync, "shell")
+
+
+def recent_traces(limit: int = None):
+    traces = list(_recent_traces)
+    if limit:
+        traces = traces[-limit:]
+    return traces
+
+
+def get_trace(trace_id: int):
+    for trace in _recent_traces:
+        if trace.id == trace_id:
+            return trace
+    return None
+
+
+def chrome_trace(traces):
+    events = []
+    for trace in traces:
+        events.extend(trace.to_events())
+    return {"traceEvents": events, "displayTimeUnit": "ms"}